@@ -0,0 +1,152 @@
+"""
+OMEMO send fan-out benchmark.
+
+Encrypts one message for a recipient with a growing number of devices,
+comparing the per-device body encryption with the per-message key wrapping
+of ``OmemoExtension``, with and without the worker pool.
+
+Usage:
+    python -m benchmarks.omemo_fanout [--devices 1,10,50,100] [--size 4096] [--rounds 5]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+
+from typing import Tuple
+
+from osmxml import XmlElement, XmlAttribute, XmlTextElement
+from osmomemo import Omemo, OmemoBundle, XKeyPair, EdKeyPair
+from osmomemo.storage import OmemoStorage
+
+from osmxmpp.message import XmppMessage
+from osmxmpp.extensions.omemo import OmemoExtension
+
+
+JID = "alice@example.org/bench"
+JID_TO = "bob@example.org"
+
+
+class _BenchVariables:
+    def function(self, function):
+        return function
+
+
+class _BenchClientInterface:
+    def __init__(self):
+        self.variables = _BenchVariables()
+        self.hooks = {}
+
+    def __getattr__(self, name):
+        if (not name.startswith(("on_", "hook_"))):
+            raise AttributeError(name)
+
+        def register(function):
+            self.hooks[name] = function
+            return function
+        return register
+
+    def get_jid(self, with_resource=True):
+        return JID if with_resource else JID.split("/")[0]
+
+    def send_xml(self, xml):
+        # Device list refreshes are never answered
+        pass
+
+    def resume_send_message(self, hook, message, *args, **kwargs):
+        # The extension sends the encrypted message itself
+        pass
+
+    def get_tracer(self):
+        return None
+
+    def mark_send_held(self):
+        pass
+
+
+def make_bundle(device: int) -> OmemoBundle:
+    return OmemoBundle(device, EdKeyPair.generate(), XKeyPair.generate(), {"0": XKeyPair.generate()})
+
+
+def make_storage(devices: int) -> Tuple:
+    path = os.path.join(tempfile.mkdtemp(), "omemo.db")
+    bundle = make_bundle(1)
+    storage = OmemoStorage(path)
+    omemo = Omemo(bundle, storage)
+
+    # Establish a session with every recipient device
+    for device in range(100, 100 + devices):
+        device_bundle = make_bundle(device)
+        omemo.create_init_message(
+            jid=JID_TO,
+            device=device,
+            message_bytes=b"init",
+            indentity_key=device_bundle.get_indentity().get_public_key(),
+            signed_prekey=device_bundle.get_prekey().get_public_key(),
+            prekey_signature=base64.b64decode(device_bundle.get_prekey_signature()),
+            onetime_prekey=device_bundle.get_onetime_prekey("0").get_public_key(),
+        )
+    return bundle, storage, omemo
+
+
+def make_message(body: str) -> XmppMessage:
+    message = XmppMessage()
+    message.xml.add_attribute(XmlAttribute("to", JID_TO))
+    message.xml.add_attribute(XmlAttribute("type", "chat"))
+    message.xml.add_child(XmlElement("body", children=[XmlTextElement(body)]))
+    return message
+
+
+def bench_legacy(omemo: Omemo, body: str, rounds: int) -> float:
+    devices = omemo.get_device_list(JID_TO)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for device in devices:
+            wrapped, payload = omemo.send_message(JID_TO, device, body.encode("utf-8"))
+            base64.b64encode(json.dumps({
+                "k": base64.b64encode(wrapped).decode("utf-8"),
+                "p": base64.b64encode(payload).decode("utf-8"),
+            }).encode("utf-8"))
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_extension(bundle: OmemoBundle, storage: OmemoStorage, body: str, rounds: int, workers: int) -> float:
+    ci = _BenchClientInterface()
+    extension = OmemoExtension(bundle, storage, workers=workers)
+    extension._connect_ci(ci)
+    extension._process()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        ci.hooks["hook_send_message"](make_message(body))
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", default="1,10,50,100")
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    body = "x" * args.size
+
+    print(f"{'devices':>8} {'legacy ms':>10} {'wrap ms':>10} {f'wrap x{args.workers} ms':>14}")
+    for devices in [int(count) for count in args.devices.split(",")]:
+        bundle, storage, omemo = make_storage(devices)
+
+        legacy = bench_legacy(omemo, body, args.rounds)
+        serial = bench_extension(bundle, storage, body, args.rounds, 0)
+        parallel = bench_extension(bundle, storage, body, args.rounds, args.workers)
+
+        print(f"{devices:>8} {legacy * 1000:>10.2f} {serial * 1000:>10.2f} {parallel * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
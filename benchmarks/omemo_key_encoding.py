@@ -0,0 +1,142 @@
+"""
+OMEMO key element encoding benchmark.
+
+Builds a message header addressed to a number of devices with the ``json``
+and ``binary`` key encodings, and compares the stanza size and the receive-side
+cost of finding and decoding our own key: the original linear scan with
+double base64/JSON decoding, and ``OmemoXml.find_key`` with ``OmemoKeyEncoding``.
+
+Usage:
+    python -m benchmarks.omemo_key_encoding [--devices 50] [--rounds 2000]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+
+from osmxml import XmlParser, XmlElement, XmlAttribute, XmlTextElement
+from osmomemo import Omemo, OmemoBundle, XKeyPair, EdKeyPair
+from osmomemo.storage import OmemoStorage
+
+from osmxmpp.extensions.omemo.xml import OmemoXml
+from osmxmpp.extensions.omemo.encoding import OmemoKeyEncoding
+from osmxmpp.extensions.omemo.payload import OmemoPayload
+
+
+JID = "alice@example.org/bench"
+JID_TO = "bob@example.org"
+
+
+def make_bundle(device: int) -> OmemoBundle:
+    return OmemoBundle(device, EdKeyPair.generate(), XKeyPair.generate(), {"0": XKeyPair.generate()})
+
+
+def make_keys(devices: int):
+    omemo = Omemo(make_bundle(1), OmemoStorage(os.path.join(tempfile.mkdtemp(), "omemo.db")))
+    message_key, _ = OmemoPayload.encrypt(b"benchmark")
+
+    keys = []
+    key_exchanges = []
+    for device in range(100, 100 + devices):
+        device_bundle = make_bundle(device)
+        ek_pub, en_message = omemo.create_init_message(
+            jid=JID_TO,
+            device=device,
+            message_bytes=message_key,
+            indentity_key=device_bundle.get_indentity().get_public_key(),
+            signed_prekey=device_bundle.get_prekey().get_public_key(),
+            prekey_signature=base64.b64decode(device_bundle.get_prekey_signature()),
+            onetime_prekey=device_bundle.get_onetime_prekey("0").get_public_key(),
+        )
+        key_exchanges.append((device, XKeyPair.public_key_to_bytes(ek_pub), en_message))
+        keys.append((device, *omemo.send_message(JID_TO, device, message_key)))
+
+    identity = os.urandom(32)
+    return keys, key_exchanges, identity
+
+
+def build_stanza(keys, encoding: str) -> str:
+    xml_keys = XmlElement("keys", [XmlAttribute("jid", JID_TO)])
+    for device, wrapped, payload in keys:
+        xml_keys.add_child(
+            XmlElement(
+                "key",
+                [XmlAttribute("rid", device)],
+                [XmlTextElement(OmemoKeyEncoding.encode_key(wrapped, payload, encoding))]
+            )
+        )
+    return OmemoXml.send_message(JID, JID_TO, 1, [xml_keys], "payload").to_string()
+
+
+def build_kex_stanza(key_exchanges, identity: bytes, encoding: str) -> str:
+    xml_keys = XmlElement("keys", [XmlAttribute("jid", JID_TO)])
+    for device, ek, ct in key_exchanges:
+        xml_keys.add_child(
+            XmlElement(
+                "key",
+                [XmlAttribute("rid", device), XmlAttribute("kex", "true")],
+                [XmlTextElement(OmemoKeyEncoding.encode_key_exchange(identity, ek, "0", "0", ct, encoding))]
+            )
+        )
+    return OmemoXml.send_message(JID, JID_TO, 1, [xml_keys], "payload").to_string()
+
+
+def decode_legacy(header: XmlElement, device: int):
+    # The lookup and decoding as done before the binary encoding
+    device_keys = None
+    for jid_keys in header.children:
+        if (jid_keys.get_attribute_by_name("jid").value == JID_TO):
+            device_keys = jid_keys
+            break
+
+    for key in device_keys.children:
+        if (int(key.get_attribute_by_name("rid").value) == device):
+            key_data_js = json.loads(base64.b64decode(key.children[0].to_string()).decode("utf-8"))
+            return base64.b64decode(key_data_js["k"].encode("utf-8")), base64.b64decode(key_data_js["p"].encode("utf-8"))
+
+
+def decode_indexed(header: XmlElement, device: int):
+    key = OmemoXml.find_key(header, JID_TO, device)
+    return OmemoKeyEncoding.decode_key(key.children[0].to_string())
+
+
+def bench(function, header: XmlElement, device: int, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(header, device)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    keys, key_exchanges, identity = make_keys(args.devices)
+
+    # Our key is the last one, the worst case for a scan
+    device = keys[-1][0]
+
+    print(f"{args.devices} devices")
+    print(f"{'':>22} {'stanza B':>10} {'kex stanza B':>13} {'decode us':>10}")
+    for name, encoding, decode in (
+                ("json + scan", OmemoKeyEncoding.JSON, decode_legacy),
+                ("json + find_key", OmemoKeyEncoding.JSON, decode_indexed),
+                ("binary + find_key", OmemoKeyEncoding.BINARY, decode_indexed),
+            ):
+        stanza = build_stanza(keys, encoding)
+        kex_stanza = build_kex_stanza(key_exchanges, identity, encoding)
+
+        header = XmlParser.parse_elements(stanza)[0].get_child_by_name("encrypted").get_child_by_name("header")
+        decode_time = bench(decode, header, device, args.rounds)
+
+        print(f"{name:>22} {len(stanza.encode('utf-8')):>10} {len(kex_stanza.encode('utf-8')):>13} {decode_time * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
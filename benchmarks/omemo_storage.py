@@ -0,0 +1,105 @@
+"""
+OMEMO storage benchmark.
+
+Measures the encrypt/decrypt throughput of a ratchet between two devices
+with the default ``OmemoStorage`` and with ``SqliteOmemoStorage``.
+The crash safety of ``SqliteOmemoStorage`` is checked in ``tests/test_omemo_storage.py``.
+
+Usage:
+    python -m benchmarks.omemo_storage [--messages 500] [--interval 1.0]
+"""
+
+import os
+import sys
+import time
+import base64
+import argparse
+import tempfile
+
+from osmomemo import Omemo, OmemoBundle, XKeyPair, EdKeyPair
+from osmomemo.storage import OmemoStorage
+
+from osmxmpp.extensions.omemo.storage import SqliteOmemoStorage
+
+
+JID_A = "alice@example.org"
+JID_B = "bob@example.org"
+
+
+def make_bundle(device: int) -> OmemoBundle:
+    return OmemoBundle(device, EdKeyPair.generate(), XKeyPair.generate(), {"0": XKeyPair.generate()})
+
+
+def make_pair(storage_a, storage_b):
+    bundle_a = make_bundle(1)
+    bundle_b = make_bundle(2)
+    alice = Omemo(bundle_a, storage_a)
+    bob = Omemo(bundle_b, storage_b)
+
+    ek_pub, encrypted = alice.create_init_message(
+        jid=JID_B,
+        device=2,
+        message_bytes=b"init",
+        indentity_key=bundle_b.get_indentity().get_public_key(),
+        signed_prekey=bundle_b.get_prekey().get_public_key(),
+        prekey_signature=base64.b64decode(bundle_b.get_prekey_signature()),
+        onetime_prekey=bundle_b.get_onetime_prekey("0").get_public_key(),
+    )
+    bob.accept_init_message(
+        jid=JID_A,
+        device=1,
+        encrypted_message=encrypted,
+        indentity_key=bundle_a.get_indentity().get_public_key(),
+        ephemeral_key=ek_pub,
+        spk_id="0",
+        opk_id="0",
+    )
+    return alice, bob
+
+
+def bench(name: str, storage_a, storage_b, messages: int):
+    alice, bob = make_pair(storage_a, storage_b)
+    message = os.urandom(32)
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        wrapped, payload = alice.send_message(JID_B, 2, message)
+        bob.receive_message(JID_A, 1, wrapped, payload)
+    for storage in (storage_a, storage_b):
+        if (hasattr(storage, "flush")):
+            storage.flush()
+    elapsed = time.perf_counter() - start
+
+    print(f"{name:>24} {messages / elapsed:>12.0f} {elapsed / messages * 1e6:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print(f"{'storage':>24} {'messages/s':>12} {'us/message':>12}")
+    bench(
+        "OmemoStorage",
+        OmemoStorage(os.path.join(directory, "a.db")),
+        OmemoStorage(os.path.join(directory, "b.db")),
+        args.messages
+    )
+    bench(
+        "SqliteOmemoStorage (0)",
+        SqliteOmemoStorage(os.path.join(directory, "c.db"), commit_interval=0),
+        SqliteOmemoStorage(os.path.join(directory, "d.db"), commit_interval=0),
+        args.messages
+    )
+    bench(
+        f"SqliteOmemoStorage ({args.interval:g})",
+        SqliteOmemoStorage(os.path.join(directory, "e.db"), commit_interval=args.interval),
+        SqliteOmemoStorage(os.path.join(directory, "f.db"), commit_interval=args.interval),
+        args.messages
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
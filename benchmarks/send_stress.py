@@ -0,0 +1,116 @@
+"""
+Stress test of the client send path from many threads.
+
+Threads send messages of mixed sizes, up to several times the socket buffer,
+through one client at the same time, while others register hooks and handlers.
+The other end of the socket frames and parses the stream and checks that every
+message arrived whole, so interleaved writes show up as parse errors or
+mismatched bodies.
+
+Run it under the free-threaded build (``python3.13t``) as well, where threads
+really send in parallel. With ``--require-free-threading`` it exits with 2 if
+the GIL is enabled, e.g. when an extension module enabled it again on import.
+
+Usage:
+    python -m benchmarks.send_stress [--threads 16] [--messages 2000] [--require-free-threading]
+"""
+
+import sys
+import time
+import socket
+import argparse
+import threading
+
+from osmxml import XmlParser
+
+from osmxmpp import XmppClient
+from osmxmpp.framing import XmppStreamFramer
+
+
+# Body sizes, the largest are split by sendall into several writes
+SIZES = [16, 200, 4096, 70000, 300000]
+
+
+def body(thread: int, index: int) -> str:
+    size = SIZES[(thread + index) % len(SIZES)]
+    prefix = f"{thread}:{index}:"
+    return prefix + "x" * (size - len(prefix))
+
+
+def receive(sock: socket.socket, result: dict):
+    framer = XmppStreamFramer()
+    while True:
+        data = sock.recv(65536)
+        if (not data):
+            break
+        try:
+            for chunk in framer.feed(data):
+                for element in XmlParser.parse_elements(chunk.decode("utf-8")):
+                    text = element.get_child_by_name("body").children[0].text
+                    thread, index, _ = text.split(":", 2)
+                    if (text != body(int(thread), int(index))):
+                        result["corrupted"] += 1
+                    result["received"] += 1
+        except Exception as e:
+            result["errors"].append(f"{type(e).__name__}: {e}")
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sends messages through one client from many threads and checks the stream.")
+    parser.add_argument("--threads", type=int, default=16, help="The number of sending threads.")
+    parser.add_argument("--messages", type=int, default=2000, help="The messages sent by each thread.")
+    parser.add_argument("--require-free-threading", action="store_true", help="Exit with 2 if the GIL is enabled.")
+    args = parser.parse_args()
+
+    client_socket, server_socket = socket.socketpair()
+    client = XmppClient("example.org")
+    client.socket = client_socket
+
+    result = {"received": 0, "corrupted": 0, "errors": []}
+    receiver = threading.Thread(target=receive, args=(server_socket, result))
+    receiver.start()
+
+    barrier = threading.Barrier(args.threads + 1)
+
+    def send(thread: int):
+        barrier.wait()
+        for index in range(args.messages):
+            client.send_message("bob@example.org", body(thread, index))
+            if (index % 100 == 0):
+                # Registered while the other threads trigger the hooks
+                client.hook_send_message(lambda message, *args, **kwargs: message)
+
+    senders = [threading.Thread(target=send, args=(thread,)) for thread in range(args.threads)]
+    for sender in senders:
+        sender.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for sender in senders:
+        sender.join()
+    elapsed = time.perf_counter() - start
+
+    client_socket.shutdown(socket.SHUT_WR)
+    receiver.join()
+    client_socket.close()
+    server_socket.close()
+
+    # Checked after the run, imports may have enabled the GIL again
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    sent = args.threads * args.messages
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, {args.threads} threads")
+    print(f"{sent} messages sent in {elapsed:.2f}s, {sent / elapsed:.0f}/s")
+    print(f"{result['received']} received, {result['corrupted']} corrupted")
+    for error in result["errors"]:
+        print(f"Stream error: {error}")
+
+    if (result["received"] != sent or result["corrupted"] or result["errors"]):
+        sys.exit(1)
+    if (args.require_free_threading and gil):
+        print("The GIL is enabled, the sends did not run in parallel")
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
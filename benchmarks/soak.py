@@ -0,0 +1,123 @@
+"""
+Memory soak test of a long-lived client.
+
+Replays a capture again and again through a client with the caps, service
+discovery, subscription and OMEMO extensions, and prints the resident memory,
+the memory still allocated by Python and the entries of the internal structures
+every round. The memory must stay flat once the caches are filled.
+
+Without ``--capture``, a capture of the benchmark stream is written first.
+With ``--allocations``, the allocated memory is also attributed to the extensions,
+which makes the replay several times slower.
+
+Usage:
+    python -m benchmarks.soak [--capture stream.cap] [--rounds 50] [--stanzas 10000]
+    python -m benchmarks.soak --allocations
+"""
+
+import os
+import gc
+import sys
+import argparse
+import tempfile
+import tracemalloc
+
+from osmomemo import OmemoBundle, XKeyPair, EdKeyPair
+from osmomemo.storage import OmemoStorage
+
+from osmxmpp import XmppClient, XmppPermission, CapsExtension, ServiceDiscoveryExtension, OmemoExtension
+from osmxmpp.extensions.roster.subscription import SubscriptionExtension
+from osmxmpp.bench.cases import make_stream, make_chunks
+from osmxmpp.capture import XmppCaptureWriter, replay
+from osmxmpp.loadtest import rss
+
+
+# Growth of the Python allocations tolerated between the first and the last half of the rounds,
+# relative or in bytes, whichever is larger
+TOLERANCE = 0.05
+TOLERANCE_BYTES = 256 * 1024
+
+
+def make_capture(path: str, stanzas: int):
+    writer = XmppCaptureWriter(path)
+    for chunk in make_chunks(make_stream(stanzas)):
+        writer.write(chunk)
+    writer.close()
+
+
+def make_client(directory: str) -> XmppClient:
+    client = XmppClient("example.org")
+
+    bundle = OmemoBundle(1, EdKeyPair.generate(), XKeyPair.generate(), {"0": XKeyPair.generate()})
+    client.connect_extensions([
+        (ServiceDiscoveryExtension(), XmppPermission.ALL),
+        (CapsExtension(), XmppPermission.ALL),
+        (SubscriptionExtension(), XmppPermission.ALL),
+        (OmemoExtension(bundle, OmemoStorage(os.path.join(directory, "omemo.json"))), XmppPermission.ALL),
+    ])
+
+    client.on_message(lambda message: message.body)
+    return client
+
+
+def entries(report: dict) -> int:
+    total = sum(structure["entries"] for structure in report["client"].values())
+    for structures in report["extensions"].values():
+        total += sum(structure["entries"] for structure in structures.values())
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a capture in a loop and checks that the memory stays flat.")
+    parser.add_argument("--capture", help="The capture to replay. (Default: a capture of the benchmark stream)")
+    parser.add_argument("--stanzas", type=int, default=10000, help="The stanzas of the generated capture.")
+    parser.add_argument("--rounds", type=int, default=50, help="The number of replays.")
+    parser.add_argument("--allocations", action="store_true", help="Attribute the allocated memory to the extensions.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = args.capture
+    if (path is None):
+        path = os.path.join(directory, "soak.cap")
+        make_capture(path, args.stanzas)
+
+    client = make_client(directory)
+    if (args.allocations):
+        client.enable_allocation_tracking()
+    elif (not tracemalloc.is_tracing()):
+        # One frame is enough to count the allocated memory
+        tracemalloc.start(1)
+
+    print(f"{'round':>5} {'rss MiB':>9} {'python MiB':>11} {'entries':>8} {'records':>8}")
+
+    allocated = []
+    for round in range(1, args.rounds + 1):
+        result = replay(path, client)
+        gc.collect()
+
+        allocated.append(tracemalloc.get_traced_memory()[0])
+        report = client.memory_report()
+        print(f"{round:>5} {rss() / 2**20:>9.1f} {allocated[-1] / 2**20:>11.2f} {entries(report):>8} {result['records']:>8}")
+
+    report = client.memory_report()
+    print()
+    for owner, structures in [("client", report["client"]), *report["extensions"].items()]:
+        for name, structure in structures.items():
+            print(f"{owner:>30} {name:>20} {structure['entries']:>8} {structure['bytes'] / 1024:>10.1f} KiB")
+
+    if (args.allocations):
+        print()
+        for owner, allocation in report["allocations"].items():
+            print(f"{owner:>30} {allocation['bytes'] / 2**20:>10.2f} MiB {allocation['blocks']:>9} blocks")
+
+    half = len(allocated) // 2
+    if (half):
+        first = max(allocated[:half])
+        last = max(allocated[half:])
+        print(f"\nPython allocations grew by {(last - first) / 1024:.1f} KiB over the last {len(allocated) - half} rounds")
+        if (last - first > max(first * TOLERANCE, TOLERANCE_BYTES)):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
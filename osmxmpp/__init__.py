@@ -2,6 +2,7 @@ __version__ = "1.0.1"
 __author__ = "osmiumnet"
 
 from .validation import XmppValidation, ValidationException
+from .jid import Jid
 
 from .permission import XmppPermission
 
@@ -9,19 +10,27 @@ from .message import XmppMessage
 
 from .ci import XmppClientInterface
 from .client import XmppClient
+from .metrics import XmppMetrics
+from .profiler import XmppProfiler
+from .memory import XmppAllocationTracker
+from .recorder import XmppFlightRecorder
+from .keepalive import XmppKeepalive
+from .tracing import XmppTracer, XmppSpan, XmppSpanExporter, JsonLinesExporter, MemoryExporter, OpenTelemetryExporter
 
 from .extensions.abc import XmppExtension
 from .extensions.omemo import OmemoExtension
 from .extensions.service.discovery import ServiceDiscoveryExtension
+from .extensions.service.caps import CapsExtension
 
 from .features.abc import XmppFeature
 from .features.tls import TlsFeature
-from .features.sasl import SaslException, SaslMechanism, SaslFeature, PlainMechanism
+from .features.sasl import SaslException, SaslMechanism, SaslFeature, PlainMechanism, ScramMechanism, ScramSha1Mechanism, ScramSha256Mechanism
 from .features.bind import BindFeature
 
 __all__ = [
     "XmppValidation",
     "ValidationException",
+    "Jid",
 
     "XmppMessage",
 
@@ -29,6 +38,17 @@ __all__ = [
 
     "XmppClient",
     "XmppClientInterface",
+    "XmppMetrics",
+    "XmppProfiler",
+    "XmppAllocationTracker",
+    "XmppFlightRecorder",
+    "XmppKeepalive",
+    "XmppTracer",
+    "XmppSpan",
+    "XmppSpanExporter",
+    "JsonLinesExporter",
+    "MemoryExporter",
+    "OpenTelemetryExporter",
 
 
     "XmppExtension",
@@ -37,6 +57,8 @@ __all__ = [
     
     "ServiceDiscoveryExtension",
 
+    "CapsExtension",
+
 
     "XmppFeature",
 
@@ -46,6 +68,9 @@ __all__ = [
     "SaslMechanism",
     "SaslFeature",
     "PlainMechanism",
+    "ScramMechanism",
+    "ScramSha1Mechanism",
+    "ScramSha256Mechanism",
 
     "BindFeature",
 ]
@@ -0,0 +1,114 @@
+"""
+Micro-benchmarks of the client hot paths.
+
+Run them with ``python -m osmxmpp.bench``.
+"""
+
+import gc
+import time
+import platform
+import statistics
+
+from typing import Dict, List
+
+from .. import __version__
+from .cases import CASES, SIZES
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def run(names: List[str] = None, size: int = 1000, rounds: int = 5) -> Dict:
+    """
+    Runs the benchmark cases.
+
+    Every case runs once to warm up, then ``rounds`` times. The best round gives the
+    throughput, the slower rounds are mostly noise of the machine.
+
+    Args:
+        names (List[str]): The cases to run. If none, runs all of them. (Default: None)
+        size (int): The number of operations per round. (Default: 1000)
+        rounds (int): The number of measured rounds. (Default: 5)
+
+    Returns:
+        Dict: The results, serializable to JSON.
+    """
+
+    results = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "size": size,
+        "rounds": rounds,
+        "cases": {},
+    }
+
+    for name in names or CASES:
+        if (name not in CASES):
+            raise ValueError(f"Unknown benchmark case '{name}'")
+
+        case_size = max(1, int(size * SIZES.get(name, 1)))
+        function, ops = CASES[name](case_size)
+        function()
+
+        times = []
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+        finally:
+            if (gc_enabled):
+                gc.enable()
+
+        best = min(times)
+        results["cases"][name] = {
+            "ops": ops,
+            "ops_per_sec": ops / best,
+            "best": best,
+            "median": statistics.median(times),
+        }
+        logger.debug(f"Benchmark '{name}': {ops / best:.0f} ops/s")
+
+    return results
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.2) -> Dict[str, Dict]:
+    """
+    Compares results with a baseline.
+
+    Args:
+        results (Dict): The results returned by ``run``.
+        baseline (Dict): Earlier results, usually loaded from a JSON file.
+        tolerance (float): The relative slowdown still accepted. (Default: 0.2)
+
+    Returns:
+        Dict[str, Dict]: For every case of both, the ``baseline`` and current ``ops_per_sec``,
+        their ``ratio`` and whether it is a ``regression``.
+    """
+
+    comparison = {}
+    for name, case in results["cases"].items():
+        baseline_case = baseline.get("cases", {}).get(name)
+        if (baseline_case is None):
+            continue
+
+        ratio = case["ops_per_sec"] / baseline_case["ops_per_sec"]
+        comparison[name] = {
+            "baseline": baseline_case["ops_per_sec"],
+            "ops_per_sec": case["ops_per_sec"],
+            "ratio": ratio,
+            "regression": ratio < 1 - tolerance,
+        }
+    return comparison
+
+
+__all__ = [
+    "CASES",
+    "run",
+    "compare",
+]
@@ -0,0 +1,63 @@
+"""
+Runs the micro-benchmarks.
+
+Usage:
+    python -m osmxmpp.bench [--cases parse dispatch] [--size 1000] [--rounds 5]
+    python -m osmxmpp.bench --output results.json
+    python -m osmxmpp.bench --baseline benchmarks/baseline.json [--tolerance 0.2]
+
+Exits with 1 if a case is slower than the baseline by more than the tolerance.
+"""
+
+import sys
+import json
+import argparse
+
+from . import CASES, run, compare
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m osmxmpp.bench", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="+", choices=list(CASES))
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="small size and rounds, for smoke tests")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if (args.quick):
+        args.size, args.rounds = 100, 2
+
+    results = run(args.cases, args.size, args.rounds)
+
+    if (args.output):
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+    comparison = {}
+    if (args.baseline):
+        with open(args.baseline) as file:
+            comparison = compare(results, json.load(file), args.tolerance)
+        results["comparison"] = comparison
+
+    if (args.json):
+        print(json.dumps(results, indent=4))
+    else:
+        print(f"osmxmpp {results['version']}, {results['implementation']} {results['python']} {results['machine']}")
+        print(f"{'case':>20} {'ops/s':>12} {'us/op':>10} {'baseline':>12} {'change':>8}")
+        for name, case in results["cases"].items():
+            line = f"{name:>20} {case['ops_per_sec']:>12.0f} {1e6 / case['ops_per_sec']:>10.2f}"
+            if (name in comparison):
+                compared = comparison[name]
+                mark = " !" if compared["regression"] else ""
+                line += f" {compared['baseline']:>12.0f} {(compared['ratio'] - 1) * 100:>+7.1f}%{mark}"
+            print(line)
+
+    return 1 if any(compared["regression"] for compared in comparison.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
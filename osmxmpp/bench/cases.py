@@ -0,0 +1,426 @@
+import os
+import base64
+import tempfile
+
+from typing import Callable, List, Tuple
+
+from osmxml import *
+
+from ..client import XmppClient
+from ..permission import XmppPermission
+from ..extensions import XmppExtension
+from ..message import XmppMessage
+from ..validation import XmppValidation
+from ..tracing import JsonLinesExporter
+
+
+JID = "alice@example.org/bench"
+JID_TO = "bob@example.org"
+
+CHUNK_SIZE = 4096
+
+
+class _EndOfStream(Exception):
+    pass
+
+
+class _BenchSocket:
+    """
+    Socket replacement feeding recorded chunks to ``recv`` and counting sent bytes,
+    kept in ``written`` if asked.
+    """
+
+    def __init__(self, chunks: List[bytes] = None, keep: bool = False):
+        self.chunks = chunks or []
+        self.position = 0
+        self.sent = 0
+        self.written = [] if keep else None
+
+    def recv(self, size: int) -> bytes:
+        if (self.position >= len(self.chunks)):
+            raise _EndOfStream()
+        self.position += 1
+        return self.chunks[self.position - 1]
+
+    def sendall(self, data: bytes):
+        self.sent += len(data)
+        if (self.written is not None):
+            self.written.append(data)
+
+    def close(self):
+        pass
+
+
+def make_stream(stanzas: int) -> List[str]:
+    """
+    Builds a stream of the stanzas a client typically receives: chats, MUC
+    messages with delays, presences with caps and IQ results.
+
+    Top-level stanzas are never self-closing, the parser nests following stanzas into them.
+    """
+
+    stream = []
+    for i in range(stanzas):
+        kind = i % 4
+        if (kind == 0):
+            stream.append(
+                f'<message from="contact{i % 50}@example.org/phone" to="{JID}" type="chat" id="msg-{i}">'
+                f'<body>Message number {i}, with a few words of text in it</body>'
+                f'<active xmlns="http://jabber.org/protocol/chatstates"/>'
+                f'</message>'
+            )
+        elif (kind == 1):
+            stream.append(
+                f'<message from="room@conference.example.org/nick{i % 20}" to="{JID}" type="groupchat" id="muc-{i}">'
+                f'<body>Group message {i}</body>'
+                f'<delay xmlns="urn:xmpp:delay" from="room@conference.example.org" stamp="2024-01-01T00:00:00Z"/>'
+                f'<stanza-id xmlns="urn:xmpp:sid:0" id="sid-{i}" by="room@conference.example.org"/>'
+                f'</message>'
+            )
+        elif (kind == 2):
+            stream.append(
+                f'<presence from="contact{i % 50}@example.org/phone" to="{JID}">'
+                f'<show>away</show><status>Busy</status><priority>5</priority>'
+                f'<c xmlns="http://jabber.org/protocol/caps" hash="sha-1" node="https://example.org" ver="QgayPKawpkPSDYmwT/WM94uAlu0="/>'
+                f'</presence>'
+            )
+        else:
+            stream.append(
+                f'<iq from="example.org" to="{JID}" type="result" id="iq-{i}">'
+                f'<query xmlns="jabber:iq:roster"><item jid="contact{i % 50}@example.org" subscription="both"/></query>'
+                f'</iq>'
+            )
+    return stream
+
+def make_chunks(stream: List[str]) -> List[bytes]:
+    """
+    Groups stanzas into ``recv``-sized chunks, split on stanza boundaries.
+    """
+
+    chunks = []
+    chunk = b""
+    for stanza in stream:
+        data = stanza.encode("utf-8")
+        if (chunk and len(chunk) + len(data) > CHUNK_SIZE):
+            chunks.append(chunk)
+            chunk = b""
+        chunk += data
+    if (chunk):
+        chunks.append(chunk)
+    return chunks
+
+
+def _make_client(chunks: List[bytes] = None, keep: bool = False) -> XmppClient:
+    client = XmppClient("example.org")
+    client.socket = _BenchSocket(chunks, keep)
+    return client
+
+def _listen(client: XmppClient, chunks: List[bytes]):
+    client.socket.chunks = chunks
+    client.socket.position = 0
+    try:
+        client._listen()
+    except _EndOfStream:
+        pass
+
+
+def case_parse(size: int) -> Tuple[Callable, int]:
+    """
+    Parses a recorded stream chunk by chunk.
+    """
+
+    chunks = make_chunks(make_stream(size))
+
+    def run():
+        for chunk in chunks:
+            XmlParser.parse_elements(chunk.decode("utf-8"))
+
+    return run, size
+
+def _make_pieces(stream: List[str]) -> List[bytes]:
+    """
+    Cuts the stream into pieces of random sizes, splitting tags, end tags and characters.
+    """
+
+    import random
+
+    data = "".join(stream).encode("utf-8")
+    rng = random.Random(0)
+    pieces = []
+    position = 0
+    while position < len(data):
+        piece = data[position:position + rng.randint(1, 64)]
+        position += len(piece)
+        pieces.append(piece)
+    return pieces
+
+def case_framing_split(size: int) -> Tuple[Callable, int]:
+    """
+    Frames the stream read in pieces of random sizes, cutting tags and end tags.
+    """
+
+    from ..framing import XmppStreamFramer
+
+    pieces = _make_pieces(make_stream(size))
+
+    def run():
+        framer = XmppStreamFramer()
+        for piece in pieces:
+            framer.feed(piece)
+
+    return run, size
+
+def case_capture_redact(size: int) -> Tuple[Callable, int]:
+    """
+    Redacts the stream read in pieces of random sizes, as a capture does.
+    """
+
+    from ..capture import XmlTextRedactor
+
+    pieces = _make_pieces(make_stream(size))
+
+    def run():
+        redactor = XmlTextRedactor()
+        for piece in pieces:
+            redactor(piece)
+
+    return run, size
+
+class _BenchExtension(XmppExtension):
+    ID = "osmiumnet.bench"
+
+    def _connect_ci(self, ci):
+        self.ci = ci
+
+    def _process(self):
+        pass
+
+
+def _dispatch(size: int, metrics: bool = False, sample_rate: float = None, trace_rate: float = None, recorder: bool = False) -> Tuple[Callable, int]:
+    chunks = make_chunks(make_stream(size))
+    client = _make_client()
+    if (metrics):
+        client.enable_metrics()
+    if (recorder):
+        client.enable_flight_recorder()
+    if (trace_rate is not None):
+        client.enable_tracing(JsonLinesExporter(open(os.devnull, "w")), trace_rate)
+
+    # Registered through a client interface, wrapped for profiling
+    target = client
+    if (sample_rate is not None):
+        extension = _BenchExtension()
+        client.connect_extension(extension, XmppPermission.ALL)
+        client.enable_profiling(sample_rate)
+        target = extension.ci
+
+    for _ in range(3):
+        target.hook_on_message(lambda message: message)
+        target.hook_on_presence(lambda presence: presence)
+        target.hook_on_iq(lambda iq: iq)
+
+    target.on_message(lambda message: message.body)
+    target.on_presence(lambda presence: presence.name)
+    target.on_iq(lambda iq: iq.name)
+
+    def run():
+        _listen(client, chunks)
+
+    return run, size
+
+def case_dispatch(size: int) -> Tuple[Callable, int]:
+    """
+    Feeds a recorded stream through ``_listen``, with three hooks and one handler per stanza kind.
+    """
+
+    return _dispatch(size, metrics=False)
+
+def case_dispatch_metrics(size: int) -> Tuple[Callable, int]:
+    """
+    The ``dispatch`` case with the client metrics enabled.
+    """
+
+    return _dispatch(size, metrics=True)
+
+def case_dispatch_profiling(size: int) -> Tuple[Callable, int]:
+    """
+    The ``dispatch`` case with the hooks and handlers of an extension, profiled with a 1% sample rate.
+    """
+
+    return _dispatch(size, sample_rate=0.01)
+
+def case_dispatch_tracing(size: int) -> Tuple[Callable, int]:
+    """
+    The ``dispatch`` case with 1% of the received stanzas traced.
+    """
+
+    return _dispatch(size, trace_rate=0.01)
+
+def case_dispatch_recorder(size: int) -> Tuple[Callable, int]:
+    """
+    The ``dispatch`` case with the flight recorder enabled.
+    """
+
+    return _dispatch(size, recorder=True)
+
+def case_serialize(size: int) -> Tuple[Callable, int]:
+    """
+    Builds and sends ``send_message`` stanzas through two hooks.
+    """
+
+    client = _make_client()
+    for _ in range(2):
+        client.hook_send_message(lambda message, *args, **kwargs: message)
+
+    def run():
+        for i in range(size):
+            client.send_message(JID_TO, "Hello, this is a benchmark message")
+
+    return run, size
+
+def case_message_access(size: int) -> Tuple[Callable, int]:
+    """
+    Reads the usual attributes and children of received messages.
+    """
+
+    stanzas = [stanza for stanza in make_stream(size * 2) if stanza.startswith("<message")][:size]
+    messages = [XmppMessage(XmlParser.parse_elements(stanza)[0]) for stanza in stanzas]
+
+    def run():
+        for message in messages:
+            message.from_jid
+            message.to_jid
+            message.type
+            message.id
+            message.body
+            message.encrypted
+
+    return run, len(messages)
+
+def case_interface_calls(size: int) -> Tuple[Callable, int]:
+    """
+    Calls the client interface of an extension granted a list of permissions, four calls per operation.
+    """
+
+    client = _make_client()
+    client.jid = JID
+    extension = _BenchExtension()
+    client.connect_extension(extension, [
+        XmppPermission.SEND_XML,
+        XmppPermission.GET_JID,
+        XmppPermission.GET_HOST,
+        XmppPermission.GET_PORT,
+        XmppPermission.LISTEN_ON_MESSAGE,
+        XmppPermission.HOOK_ON_MESSAGE,
+    ])
+    ci = extension.ci
+
+    def run():
+        for _ in range(size):
+            ci.get_jid()
+            ci.get_host()
+            ci.get_port()
+            ci.has_permission(XmppPermission.SEND_XML)
+
+    return run, size
+
+def case_jid_validation(size: int) -> Tuple[Callable, int]:
+    """
+    Validates bare and full JIDs.
+    """
+
+    jids = []
+    for i in range(size):
+        jid = f"contact{i}@example.org"
+        jids.append(jid if i % 2 else f"{jid}/resource{i}")
+
+    def run():
+        for jid in jids:
+            XmppValidation.validate_jid(jid)
+
+    return run, size
+
+def case_omemo(size: int) -> Tuple[Callable, int]:
+    """
+    Sends OMEMO messages through the extension of one client and decrypts them in the extension of the other.
+    """
+
+    from osmomemo import Omemo, OmemoBundle, XKeyPair, EdKeyPair
+
+    from ..extensions.omemo import OmemoExtension, MemoryOmemoCache, SqliteOmemoStorage, OmemoKeyEncoding
+
+    directory = tempfile.mkdtemp()
+    bundle_a = OmemoBundle(1, EdKeyPair.generate(), XKeyPair.generate(), {"0": XKeyPair.generate()})
+    bundle_b = OmemoBundle(2, EdKeyPair.generate(), XKeyPair.generate(), {"0": XKeyPair.generate()})
+    storage_a = SqliteOmemoStorage(os.path.join(directory, "a.db"))
+    storage_b = SqliteOmemoStorage(os.path.join(directory, "b.db"))
+
+    # The session exists beforehand, only messages are measured
+    ek_pub, encrypted = Omemo(bundle_a, storage_a).create_init_message(
+        jid=JID_TO,
+        device=2,
+        message_bytes=b"init",
+        indentity_key=bundle_b.get_indentity().get_public_key(),
+        signed_prekey=bundle_b.get_prekey().get_public_key(),
+        prekey_signature=base64.b64decode(bundle_b.get_prekey_signature()),
+        onetime_prekey=bundle_b.get_onetime_prekey("0").get_public_key(),
+    )
+    Omemo(bundle_b, storage_b).accept_init_message(
+        jid=JID.split("/")[0],
+        device=1,
+        encrypted_message=encrypted,
+        indentity_key=bundle_a.get_indentity().get_public_key(),
+        ephemeral_key=ek_pub,
+        spk_id="0",
+        opk_id="0",
+    )
+
+    # Bob's device list is known, nothing is fetched
+    cache_a = MemoryOmemoCache()
+    cache_a.set_devices(JID_TO, [2])
+
+    alice = _make_client(keep=True)
+    alice.jid = JID
+    alice.connect_extension(
+        OmemoExtension(bundle_a, storage_a, cache_a, key_encoding=OmemoKeyEncoding.BINARY),
+        OmemoExtension.REQUIRED_PERMISSIONS
+    )
+
+    bob = _make_client()
+    bob.jid = f"{JID_TO}/bench"
+    bob.connect_extension(OmemoExtension(bundle_b, storage_b), OmemoExtension.REQUIRED_PERMISSIONS)
+
+    received = []
+    bob.on_message(lambda message: received.append(message.body))
+
+    # The server stamps the sender
+    sender = f'<message from="{JID}" '.encode("utf-8")
+
+    def run():
+        for i in range(size):
+            alice.send_message(JID_TO, "Hello, this is a benchmark message")
+            _listen(bob, [alice.socket.written.pop().replace(b"<message ", sender, 1)])
+        received.clear()
+
+    return run, size
+
+CASES = {
+    "parse": case_parse,
+    "framing_split": case_framing_split,
+    "capture_redact": case_capture_redact,
+    "dispatch": case_dispatch,
+    "dispatch_metrics": case_dispatch_metrics,
+    "dispatch_profiling": case_dispatch_profiling,
+    "dispatch_tracing": case_dispatch_tracing,
+    "dispatch_recorder": case_dispatch_recorder,
+    "serialize": case_serialize,
+    "message_access": case_message_access,
+    "interface_calls": case_interface_calls,
+    "jid_validation": case_jid_validation,
+    "omemo": case_omemo,
+}
+
+# OMEMO messages are two orders of magnitude slower than the other operations
+SIZES = {
+    "omemo": 0.1,
+}
@@ -0,0 +1,309 @@
+"""
+Capture of the received stream of a client, and its replay through the parser and handlers.
+
+Replay a capture with ``python -m osmxmpp.capture``.
+"""
+
+import re
+import time
+
+from xml.parsers import expat
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"OSMXCAP\x01"
+
+
+def _write_varint(file: BinaryIO, value: int):
+    out = bytearray()
+    while (value > 0x7f):
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    file.write(out)
+
+def _read_varint(file: BinaryIO) -> int | None:
+    value = 0
+    shift = 0
+    while True:
+        byte = file.read(1)
+        if (not byte):
+            return None
+        value |= (byte[0] & 0x7f) << shift
+        if (not byte[0] & 0x80):
+            return value
+        shift += 7
+
+
+class XmlTextRedactor:
+    """
+    Replaces the character data of a stream with ``x``, keeping its size and the markup.
+    Message bodies, statuses and encrypted payloads are removed, JIDs in attributes are kept.
+
+    The stream is parsed with expat, like the framer does, and only the bytes it reports as
+    character data are replaced, so a ``>`` in an attribute value is not taken for the end
+    of a tag. Chunks can end anywhere: an entity or character split over two chunks is
+    redacted in both.
+
+    A chunk that is not well-formed, e.g. when the capture started in the middle of a stanza,
+    has all its visible bytes replaced.
+    """
+
+    # The stream header was read during the negotiation, the redactor opens one of its own
+    __ROOT = b"<stream:stream>"
+
+    __visible = re.compile(rb"[^\s]")
+    # The brackets of a CDATA section end are kept, it may be split over two chunks
+    __visible_cdata = re.compile(rb"[^\s\]]")
+
+    def __init__(self):
+        self.__reset()
+
+    def __reset(self):
+        self.__parser = expat.ParserCreate()
+        # Text at the end of a chunk is reported with the chunk, not with the next one
+        if (hasattr(self.__parser, "SetReparseDeferralEnabled")):
+            self.__parser.SetReparseDeferralEnabled(False)
+        self.__parser.CharacterDataHandler = self.__on_text
+        self.__parser.StartCdataSectionHandler = self.__on_cdata_start
+        self.__parser.EndCdataSectionHandler = self.__on_cdata_end
+
+        # Stream index of the first byte of the next chunk
+        self.__base = len(self.__ROOT)
+        # Stream indexes of the character data and CDATA section events of the chunk
+        self.__events: List[Tuple[str, int]] = []
+        self.__in_cdata = False
+        # Kind of the token the parser keeps back at the end of the last chunk: text, cdata or markup
+        self.__tail = "markup"
+
+        self.__parser.Parse(self.__ROOT, False)
+
+    def __call__(self, data: bytes) -> bytes:
+        base = self.__base
+        self.__base += len(data)
+
+        try:
+            self.__parser.Parse(data, False)
+        except expat.ExpatError as e:
+            logger.warning(f"Redacting a chunk of {len(data)} bytes of malformed XML: {e}")
+            self.__reset()
+            return self.__visible.sub(b"x", data)
+
+        # Everything before it was parsed, the rest is an incomplete token
+        parsed = self.__parser.CurrentByteIndex
+
+        redacted = bytearray(data)
+        in_cdata = self.__in_cdata
+        for kind, index in self.__events:
+            if (kind != "text"):
+                in_cdata = kind == "cdata"
+                continue
+
+            # Text goes on until the next markup, its start may be in the last chunk
+            start = max(index, base) - base
+            end = data.find(b"]]>" if in_cdata else b"<", start)
+            end = min(len(data) if end < 0 else end, parsed - base)
+            if (start < end):
+                self.__redact(redacted, start, end, in_cdata)
+        self.__events = []
+        self.__in_cdata = in_cdata
+
+        if (parsed < self.__base):
+            if (parsed >= base):
+                if (in_cdata):
+                    self.__tail = "cdata"
+                else:
+                    self.__tail = "markup" if data[parsed - base] == ord("<") else "text"
+            # An entity or a multibyte character split over the chunks
+            if (self.__tail != "markup"):
+                self.__redact(redacted, max(parsed, base) - base, len(data), self.__tail == "cdata")
+
+        return bytes(redacted)
+
+    def __redact(self, data: bytearray, start: int, end: int, in_cdata: bool):
+        pattern = self.__visible_cdata if in_cdata else self.__visible
+        data[start:end] = pattern.sub(b"x", data[start:end])
+
+    def __on_text(self, text):
+        self.__events.append(("text", self.__parser.CurrentByteIndex))
+
+    def __on_cdata_start(self):
+        self.__events.append(("cdata", self.__parser.CurrentByteIndex))
+
+    def __on_cdata_end(self):
+        self.__events.append(("end_cdata", self.__parser.CurrentByteIndex))
+
+
+class XmppCaptureWriter:
+    """
+    Writes a capture file: the received bytes of a stream with their times.
+
+    The file starts with ``OSMXCAP\\x01`` and the start time in Unix milliseconds, then every
+    record is the microseconds since the last one, the data size and the data, as varints.
+
+    Attributes:
+        path (str): The path of the capture file.
+        redact (bool | Callable): Whether to redact the character data with ``XmlTextRedactor``,
+            or a function redacting a chunk of bytes. (Default: False)
+    """
+
+    def __init__(self, path: str, redact: bool | Callable[[bytes], bytes] = False):
+        self.__path = path
+        self.__file = open(path, "wb")
+        self.__redact = XmlTextRedactor() if redact is True else (redact or None)
+
+        self.__file.write(MAGIC)
+        _write_varint(self.__file, int(time.time() * 1000))
+        self.__last = time.monotonic()
+
+        self.__records = 0
+        self.__bytes = 0
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def write(self, data: bytes):
+        """
+        Writes the received data as a record.
+
+        Args:
+            data (bytes): The data, as returned by ``recv``.
+        """
+
+        now = time.monotonic()
+        if (self.__redact is not None):
+            data = self.__redact(data)
+
+        _write_varint(self.__file, int((now - self.__last) * 1e6))
+        _write_varint(self.__file, len(data))
+        self.__file.write(data)
+
+        self.__last = now
+        self.__records += 1
+        self.__bytes += len(data)
+
+    def close(self):
+        """
+        Closes the capture file.
+        """
+
+        if (not self.__file.closed):
+            self.__file.close()
+            logger.debug(f"Captured {self.__records} records, {self.__bytes} bytes to '{self.__path}'")
+
+
+class XmppCaptureReader:
+    """
+    Reads a capture file written by ``XmppCaptureWriter``.
+
+    Attributes:
+        path (str): The path of the capture file.
+
+    Example:
+        >>> for delay, data in XmppCaptureReader("stream.cap"):
+        ...     print(delay, len(data))
+    """
+
+    def __init__(self, path: str):
+        self.__path = path
+
+        with open(path, "rb") as file:
+            if (file.read(len(MAGIC)) != MAGIC):
+                raise ValueError(f"'{path}' is not an osmxmpp capture file")
+            self.__started = _read_varint(file) / 1000
+
+    @property
+    def started(self) -> float:
+        """
+        Gets the Unix time the capture was started at.
+        """
+
+        return self.__started
+
+    def __iter__(self) -> Iterator[Tuple[float, bytes]]:
+        """
+        Iterates the records as the seconds since the last record and the data.
+        """
+
+        with open(self.__path, "rb") as file:
+            file.read(len(MAGIC))
+            _read_varint(file)
+
+            while True:
+                delay = _read_varint(file)
+                size = _read_varint(file)
+                if (delay is None or size is None):
+                    return
+
+                data = file.read(size)
+                if (len(data) < size):
+                    logger.warning(f"Capture '{self.__path}' ends in a truncated record")
+                    return
+                yield delay / 1e6, data
+
+
+class _NullSocket:
+    def sendall(self, data: bytes):
+        pass
+
+    def close(self):
+        pass
+
+
+def replay(path: str, client, speed: float | None = None) -> Dict[str, float]:
+    """
+    Feeds a capture through the parser, hooks and handlers of a client, without a server.
+    Anything the client sends meanwhile is discarded if it has no socket.
+
+    Args:
+        path (str): The path of the capture file.
+        client (XmppClient): The client, with its extensions and handlers connected.
+        speed (float): The speed relative to the recorded one. If none, as fast as possible. (Default: None)
+
+    Returns:
+        Dict[str, float]: The ``records`` and ``bytes`` fed, and the ``elapsed`` seconds.
+
+    Example:
+        >>> client = XmppClient("example.org")
+        >>> client.on_message(lambda message: None)
+        >>> replay("presence-storm.cap", client)
+    """
+
+    if (getattr(client, "socket", None) is None):
+        client.socket = _NullSocket()
+
+    records = 0
+    size = 0
+    start = time.perf_counter()
+    due = start
+
+    for delay, data in XmppCaptureReader(path):
+        if (speed):
+            due += delay / speed
+            wait = due - time.perf_counter()
+            if (wait > 0):
+                time.sleep(wait)
+
+        client._feed(data)
+        records += 1
+        size += len(data)
+
+    return {
+        "records": records,
+        "bytes": size,
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+__all__ = [
+    "XmppCaptureWriter",
+    "XmppCaptureReader",
+    "XmlTextRedactor",
+    "replay",
+]
@@ -0,0 +1,53 @@
+"""
+Replays a capture file through a client without extensions and reports the throughput.
+
+Usage:
+    python -m osmxmpp.capture stream.cap [--repeat 10] [--profile]
+    python -m osmxmpp.capture stream.cap --speed 1
+"""
+
+import sys
+import argparse
+
+from . import replay
+from ..client import XmppClient
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m osmxmpp.capture", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, help="speed relative to the recorded one, as fast as possible if not given")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--profile", action="store_true", help="print the cProfile statistics of the replay")
+    args = parser.parse_args()
+
+    client = XmppClient("replay.invalid")
+    stanzas = {"message": 0, "presence": 0, "iq": 0}
+    client.on_message(lambda message: stanzas.__setitem__("message", stanzas["message"] + 1))
+    client.on_presence(lambda presence: stanzas.__setitem__("presence", stanzas["presence"] + 1))
+    client.on_iq(lambda iq: stanzas.__setitem__("iq", stanzas["iq"] + 1))
+
+    profiler = None
+    if (args.profile):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    elapsed = 0
+    for _ in range(args.repeat):
+        result = replay(args.path, client, args.speed)
+        elapsed += result["elapsed"]
+
+    if (profiler is not None):
+        import pstats
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+    total = sum(stanzas.values())
+    print(f"{result['records']} records, {result['bytes']} bytes, {total // args.repeat} stanzas per replay ({stanzas})")
+    print(f"{elapsed:.3f} s, {total / elapsed:.0f} stanzas/s, {result['bytes'] * args.repeat / elapsed / 2**20:.2f} MiB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
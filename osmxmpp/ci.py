@@ -1,9 +1,11 @@
 import socket
 
-from typing import List, Callable
+from typing import Iterable, Callable
 
 from .validation import XmppValidation
 from .permission import XmppPermission
+from .jid import bare_jid
+from .profiler import wrap
 
 from osmxml import *
 
@@ -19,47 +21,55 @@ class XmppClientInterface:
     Used by Features or Extensions to interact with the XMPP client.
     """
 
-    def __init__(self, client, obj, permissions: List[XmppPermission] | XmppPermission.ALL):
+    def __init__(self, client, obj, permissions: Iterable[XmppPermission] | XmppPermission):
         """
         Initializes the Xmpp client interface.
 
         Args:
             client (XmppClient): The XMPP client.
-            permissions (List[XmppPermission] | XmppPermission.ALL): The permissions to grant.
+            permissions (Iterable[XmppPermission] | XmppPermission): The permissions to grant, e.g. ``XmppPermission.ALL``.
         """
 
         self.__client = client
         self.variables = XmppVariableInterface(self)
-        
-        if permissions == XmppPermission.ALL:
-            permissions = [XmppPermission.ALL]
 
-        self.__permissions = permissions
+        self.__permissions = XmppPermission.combine(permissions)
+        # Checked on every call, the IntFlag operators are much slower than the ones of int
+        self.__mask = self.__permissions.value
 
         self.object = obj
+
+    @property
+    def permissions(self) -> XmppPermission:
+        """
+        The granted permissions.
+        """
+        return self.__permissions
     
-    def __handle_permission(self, permission:XmppPermission):
-        if self.has_permission(permission):
-            return
-        
-        raise Exception(f"No {permission} permission")
+    def __wrap(self, kind:str, event:str, func:Callable) -> Callable:
+        # Accounts the hook or handler to its extension or feature in client.profile()
+        return wrap(self.__client, self.object.ID, kind, event, func)
+
+    def __handle_permission(self, *permissions:XmppPermission):
+        for permission in permissions:
+            if self.__mask & permission._value_:
+                return
+
+        raise Exception(f"No {' or '.join(str(permission) for permission in permissions)} permission")
     
     # Exposed functions
     def has_permission(self, *permissions) -> bool:
         """
-        Checks if the client interface has the given permission.
+        Checks if the client interface has one of the given permissions.
 
         Args:
-            permissions (XmppPermission): The permissions to check.
+            permissions (XmppPermission): The permissions to check, combined permissions count as one that needs all of them.
 
         Returns:
             bool: True if the client interface has the permission, False otherwise.
         """
-        if XmppPermission.ALL in self.__permissions:
-            return True
-        
         for permission in permissions:
-            if permission in self.__permissions:
+            if self.__mask & permission._value_ == permission._value_:
                 return True
 
         return False
@@ -105,7 +115,7 @@ class XmppClientInterface:
         if with_resouce:
             return self.__client.jid
         else:
-            return self.__client.jid.split("/")[0]
+            return bare_jid(self.__client.jid)
 
     def get_resource(self) -> str:
         """
@@ -159,6 +169,17 @@ class XmppClientInterface:
         self.__handle_permission(XmppPermission.GET_HOST)
         return self.__client.host
 
+    def get_domain(self) -> str:
+        """
+        Gets the XMPP domain of the server, the host if not given.
+        Requires the GET_HOST permission.
+
+        Returns:
+            str: The XMPP domain of the server.
+        """
+        self.__handle_permission(XmppPermission.GET_HOST)
+        return self.__client.domain
+
     def get_port(self) -> int:
         """
         Gets the port of the XMPP client.
@@ -169,6 +190,26 @@ class XmppClientInterface:
         """
         self.__handle_permission(XmppPermission.GET_PORT)
         return self.__client.port
+
+    def get_tracer(self):
+        """
+        Gets the tracer of the XMPP client, for spans of work done outside of the client hooks.
+        No permission is required.
+
+        Returns:
+            XmppTracer | None: The tracer, None if tracing is disabled.
+        """
+        return self.__client.tracer
+
+    def get_extension_features(self) -> set:
+        """
+        Gets the service discovery features of the connected extensions, from their ``FEATURES``.
+        They are public, no permission is required.
+
+        Returns:
+            set: The features.
+        """
+        return self.__client.extension_features
     
     def change_socket(self, socket):
         """
@@ -179,7 +220,7 @@ class XmppClientInterface:
             socket (socket): The new socket of the XMPP client.
         """
         self.__handle_permission(XmppPermission.CHANGE_SOCKET)
-        self.__client.socket = socket
+        self.__client._change_socket(socket)
         return
     
     def get_socket(self) -> socket:
@@ -213,7 +254,8 @@ class XmppClientInterface:
             Callable: The handler (not changed).
         """
         self.__handle_permission(XmppPermission.LISTEN_ON_CONNECT)
-        return self.__client.on_connect(handler)
+        self.__client.on_connect(self.__wrap("handler", "connected", handler))
+        return handler
     
     def on_disconnect(self, handler:Callable) -> Callable:
         """
@@ -227,7 +269,8 @@ class XmppClientInterface:
             Callable: The handler (not changed).
         """
         self.__handle_permission(XmppPermission.LISTEN_ON_DISCONNECT)
-        return self.__client.on_disconnect(handler)
+        self.__client.on_disconnect(self.__wrap("handler", "disconnected", handler))
+        return handler
     
     def on_ready(self, handler:Callable) -> Callable:
         """
@@ -241,7 +284,8 @@ class XmppClientInterface:
             Callable: The handler (not changed).
         """
         self.__handle_permission(XmppPermission.LISTEN_ON_READY)
-        return self.__client.on_ready(handler)
+        self.__client.on_ready(self.__wrap("handler", "ready", handler))
+        return handler
 
     def on_message(self, handler:Callable) -> Callable:
         """
@@ -255,7 +299,8 @@ class XmppClientInterface:
             Callable: The handler (not changed).
         """
         self.__handle_permission(XmppPermission.LISTEN_ON_MESSAGE)
-        return self.__client.on_message(handler)
+        self.__client.on_message(self.__wrap("handler", "message", handler))
+        return handler
     
     def on_presence(self, handler:Callable) -> Callable:
         """
@@ -269,7 +314,8 @@ class XmppClientInterface:
             Callable: The handler (not changed).
         """
         self.__handle_permission(XmppPermission.LISTEN_ON_PRESENCE)
-        return self.__client.on_presence(handler)
+        self.__client.on_presence(self.__wrap("handler", "presence", handler))
+        return handler
     
     def on_iq(self, handler:Callable) -> Callable:
         """
@@ -283,7 +329,8 @@ class XmppClientInterface:
             Callable: The handler (not changed).
         """
         self.__handle_permission(XmppPermission.LISTEN_ON_IQ)
-        return self.__client.on_iq(handler)
+        self.__client.on_iq(self.__wrap("handler", "iq", handler))
+        return handler
     
     def hook_on_message(self, hook:Callable) -> Callable:
         """
@@ -297,7 +344,25 @@ class XmppClientInterface:
             Callable: The hook (not changed).
         """
         self.__handle_permission(XmppPermission.HOOK_ON_MESSAGE)
-        return self.__client.hook_on_message(hook)
+        self.__client.hook_on_message(self.__wrap("hook", "on_message", hook))
+        return hook
+    
+    def resume_on_message(self, hook:Callable, message) -> None:
+        """
+        Resumes processing of a message held back by the given hook.
+        The hooks registered after it are run, then the message handlers.
+        Requires the HOOK_ON_MESSAGE permission.
+
+        Args:
+            hook (Callable): The hook that held the message back (returned None for it).
+            message (XmppMessage): The processed message.
+        """
+        self.__handle_permission(XmppPermission.HOOK_ON_MESSAGE)
+
+        message = self.__client._resume_hooks("on_message", hook, message)
+        if message is None:
+            return
+        self.__client._trigger_handlers("message", message)
     
     def hook_on_presence(self, hook:Callable) -> Callable:
         """
@@ -311,7 +376,8 @@ class XmppClientInterface:
             Callable: The hook (not changed).
         """
         self.__handle_permission(XmppPermission.HOOK_ON_PRESENCE)
-        return self.__client.hook_on_presence(hook)
+        self.__client.hook_on_presence(self.__wrap("hook", "on_presence", hook))
+        return hook
     
     def hook_on_iq(self, hook:Callable) -> Callable:
         """
@@ -325,7 +391,8 @@ class XmppClientInterface:
             Callable: The hook (not changed).
         """
         self.__handle_permission(XmppPermission.HOOK_ON_IQ)
-        return self.__client.hook_on_iq(hook)
+        self.__client.hook_on_iq(self.__wrap("hook", "on_iq", hook))
+        return hook
     
     def hook_send_message(self, hook:Callable) -> Callable:
         """
@@ -339,7 +406,51 @@ class XmppClientInterface:
             Callable: The hook (not changed).
         """
         self.__handle_permission(XmppPermission.HOOK_SEND_MESSAGE)
-        return self.__client.hook_send_message(hook)
+        self.__client.hook_send_message(self.__wrap("hook", "send_message", hook))
+        return hook
+    
+    def mark_send_held(self) -> None:
+        """
+        Marks the message being sent as held back by the calling hook, to be sent later with
+        ``resume_send_message``. A hook returning None without it sent or dropped the message.
+        Requires the HOOK_SEND_MESSAGE permission.
+        """
+        self.__handle_permission(XmppPermission.HOOK_SEND_MESSAGE)
+        self.__client._mark_send_held()
+
+    def resume_send_message(self, hook:Callable, message, *args, **kwargs) -> None:
+        """
+        Resumes sending of a message held back by the given hook.
+        The hooks registered after it are run, then the message is sent.
+        Requires the HOOK_SEND_MESSAGE permission.
+
+        Args:
+            hook (Callable): The hook that held the message back (returned None for it).
+            message (XmppMessage): The processed message.
+            *args: The arguments the message was sent with.
+            **kwargs: The keyword arguments the message was sent with.
+        """
+        self.__handle_permission(XmppPermission.HOOK_SEND_MESSAGE)
+
+        message = self.__client._resume_hooks("send_message", hook, message, *args, **kwargs)
+        if message is None:
+            return
+        self.__client._send_xml(message.xml)
+    
+    def hook_send_presence(self, hook:Callable) -> Callable:
+        """
+        Registers a hook for the send presence event.
+        The hook will be called when the client sends its presence.
+        
+        Args:
+            hook (Callable): The hook to register.
+        
+        Returns:
+            Callable: The hook (not changed).
+        """
+        self.__handle_permission(XmppPermission.HOOK_SEND_PRESENCE)
+        self.__client.hook_send_presence(self.__wrap("hook", "send_presence", hook))
+        return hook
     
     def disconnect(self):
         """
@@ -1,7 +1,13 @@
 import socket
+import time
 import uuid
+import selectors
+import threading
+import contextlib
 
-from typing import Callable, List, Tuple
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Set, TextIO, Tuple
 
 from .validation import XmppValidation
 from .permission import XmppPermission
@@ -9,6 +15,14 @@ from .message import XmppMessage
 from .features import XmppFeature
 from .extensions import XmppExtension
 from .ci import XmppClientInterface
+from .capture import XmppCaptureWriter
+from .framing import XmppStreamFramer
+from .metrics import XmppMetrics
+from .profiler import XmppProfiler
+from .tracing import XmppTracer, XmppSpanExporter
+from .memory import XmppAllocationTracker, measure
+from .recorder import XmppFlightRecorder
+from .keepalive import XmppKeepalive
 
 from osmxml import *
 
@@ -21,23 +35,37 @@ logger = logging.getLogger(__name__)
 class XmppClient:
     """
     XMPP client implementation.
+
+    Stanzas can be sent and hooks and handlers registered from any thread,
+    while the connecting thread reads and dispatches the stream.
     """
 
-    def __init__(self, host:str, port:int=5222):
+    # Traced IQs never answered are ended beyond this
+    MAX_PENDING_IQ_SPANS = 1024
+
+    def __init__(self, host:str, port:int=5222, domain:str=None):
         """
         Initializes the XMPP client.
 
         Args:
             host (str): The host of the XMPP server.
             port (int): The port of the XMPP server.
+            domain (str): The XMPP domain of the server, if it differs from the host. (Default: None)
         """
         self.host = host
         self.port = port
+        self.domain = domain or host
 
         self.__connected = False
 
+        # One writer at a time, stanzas sent from several threads would interleave on the wire
+        self.__send_lock = threading.Lock()
+        # Hook and handler lists are replaced, never changed, so they can be triggered while others register
+        self.__register_lock = threading.Lock()
+
         self.__hooks = {
             "send_message": [],
+            "send_presence": [],
             "on_message": [],
             "on_presence": [],
             "on_iq": [],
@@ -58,6 +86,33 @@ class XmppClient:
         self.__extensions = {}
         self.__extensions_queue = []
 
+        self.__framer = XmppStreamFramer()
+        self.__capture = None
+        self.__metrics = None
+        self.__profiler = None
+        self.__tracer = None
+        # IQ id: span of the exchange, ended by the result or error
+        self.__iq_spans = {}
+        # Whether a hook held back the message being sent on the thread
+        self.__send_held = threading.local()
+        # Spans are added by the sending threads and removed by the reader thread
+        self.__iq_spans_lock = threading.Lock()
+        self.__allocations = None
+        self.__recorder = None
+        self.__dump_on_disconnect = False
+        self.__keepalive = None
+
+        # Set by start()
+        self.__thread = None
+        self.__ready = None
+        # Functions run on the client thread, and the socket pair waking it up for them
+        self.__calls = deque()
+        self.__wakeup = None
+        # Held to add a call, and to close the socket pair, so that no call is added once the late ones are failed
+        self.__calls_lock = threading.Lock()
+        # Set by stop() before the connection is made
+        self.__stopping = False
+
 
     @property    
     def extensions(self):
@@ -67,25 +122,132 @@ class XmppClient:
             
         return extensions_functions
 
+    @property
+    def extension_features(self) -> Set[str]:
+        """
+        The service discovery features of the connected extensions.
+        """
+        features = set()
+        for extension_ci in list(self.__extensions.values()):
+            features.update(getattr(extension_ci.object, "FEATURES", ()))
+        return features
 
     @property
     def connected(self):
-        return self.__connecte
+        return self.__connected
+
+    @property
+    def metrics(self) -> XmppMetrics | None:
+        """
+        The metrics of the client, None if disabled.
+        """
+        return self.__metrics
+
+    @property
+    def flight_recorder(self) -> XmppFlightRecorder | None:
+        """
+        The flight recorder of the client, None if disabled.
+        """
+        return self.__recorder
+
+    @property
+    def keepalive(self) -> XmppKeepalive | None:
+        """
+        The keepalive of the client, None if disabled.
+        """
+        return self.__keepalive
+
+    @property
+    def rtt(self) -> float | None:
+        """
+        The smoothed round-trip time to the server in seconds, measured by the keepalive pings.
+        None if the keepalive is disabled or no ping was answered yet.
+        """
+        keepalive = self.__keepalive
+        return keepalive.rtt if keepalive is not None else None
+
+    @property
+    def tracer(self) -> XmppTracer | None:
+        """
+        The tracer of the client, None if disabled.
+        """
+        return self.__tracer
+
+    @property
+    def profiler(self) -> XmppProfiler | None:
+        """
+        The profiler of the extension and feature hooks and handlers, None if disabled.
+        """
+        return self.__profiler
     
 
     def _trigger_handlers(self, event:str, *args, **kwargs):
-        logger.debug(f"Triggering '{event}' handlers...")
+        logger.debug("Triggering '%s' handlers...", event)
+        metrics = self.__metrics
+        if metrics is None:
+            for handler in self.__handlers[event]:
+                handler(*args, **kwargs)
+            return
+
+        start = time.perf_counter()
         for handler in self.__handlers[event]:
             handler(*args, **kwargs)
+        metrics.observe("xmpp_handler_seconds", time.perf_counter() - start, event)
     
     def _trigger_hooks(self, event:str, value, *args, **kwargs):
-        logger.debug(f"Triggering '{event}' hooks...")
-        for hook in self.__hooks[event]:
+        logger.debug("Triggering '%s' hooks...", event)
+        metrics = self.__metrics
+        tracer = self.__tracer
+        if metrics is None and tracer is None:
+            return self.__run_hooks(self.__hooks[event], value, *args, **kwargs)
+
+        start = time.perf_counter()
+        if tracer is not None and tracer.current() is not None:
+            value = self.__run_hooks_traced(tracer, event, self.__hooks[event], value, *args, **kwargs)
+        else:
+            value = self.__run_hooks(self.__hooks[event], value, *args, **kwargs)
+        if metrics is not None:
+            metrics.observe("xmpp_hook_seconds", time.perf_counter() - start, event)
+        return value
+
+    def __run_hooks(self, hooks:List[Callable], value, *args, **kwargs):
+        for hook in hooks:
             value = hook(value, *args, **kwargs)
             if not value:
                 return None
         return value
 
+    def __run_hooks_traced(self, tracer:XmppTracer, event:str, hooks:List[Callable], value, *args, **kwargs):
+        for hook in hooks:
+            with tracer.span(f"hook {event}", {"hook": getattr(hook, "__qualname__", repr(hook))}) as span:
+                value = hook(value, *args, **kwargs)
+                if not value:
+                    span.set_attribute("held", True)
+                    return None
+        return value
+
+    def _mark_send_held(self):
+        """
+        Marks the message being sent on this thread as held back by a hook, in its trace.
+        """
+        self.__send_held.value = True
+
+    def _resume_hooks(self, event:str, after_hook:Callable, value, *args, **kwargs):
+        """
+        Runs the hooks registered after the given hook.
+        Used by hooks that hold a value back and finish processing it later.
+        """
+        logger.debug("Resuming '%s' hooks...", event)
+        hooks = self.__hooks[event]
+        # Hooks registered through a client interface are wrapped for profiling
+        for index, hook in enumerate(hooks):
+            if hook == after_hook or getattr(hook, "__wrapped__", None) == after_hook:
+                tracer = self.__tracer
+                if tracer is not None and tracer.current() is not None:
+                    return self.__run_hooks_traced(tracer, event, hooks[index + 1:], value, *args, **kwargs)
+                return self.__run_hooks(hooks[index + 1:], value, *args, **kwargs)
+        raise ValueError(f"Hook {after_hook} is not registered for '{event}'")
+
     
     def send_message(self, *args, **kwargs):
         """
@@ -114,12 +276,32 @@ class XmppClient:
         message.xml.add_child(XmlElement("body"))
         message.body.xml.add_child(XmlTextElement(content))
 
-        for hook in self.__hooks["send_message"]:
-            message = hook(message, *args, **kwargs)
-
-        if not message:
+        self.__send_message(message, *args, **kwargs)
+    
+    def __send_message(self, message:XmppMessage, *args, **kwargs):
+        tracer = self.__tracer
+        if tracer is None:
+            message = self._trigger_hooks("send_message", message, *args, **kwargs)
+            if not message:
+                return
+            self._send_xml(message.xml)
             return
-        self._send_xml(message.xml)
+
+        with tracer.span("send_message", {"to": message.to_jid, "id": message.id}) as span:
+            # Sends made by the hooks have their own flag
+            previous, self.__send_held.value = getattr(self.__send_held, "value", False), False
+            try:
+                message = self._trigger_hooks("send_message", message, *args, **kwargs)
+                held = self.__send_held.value
+            finally:
+                self.__send_held.value = previous
+
+            if not message:
+                # A hook that sent it itself, or dropped it, returns None as well
+                if span is not None and held:
+                    span.set_attribute("held", True)
+                return
+            self._send_xml(message.xml)
     
     def reply_to_message(self, *args, **kwargs):
         """
@@ -163,12 +345,7 @@ class XmppClient:
         else:
             message.reply.xml.add_attribute(XmlAttribute("to", jid))
 
-        for hook in self.__hooks["send_message"]:
-            message = hook(message, *args, **kwargs)
-
-        if not message:
-            return
-        self._send_xml(message.xml)
+        self.__send_message(message, *args, **kwargs)
 
     def edit_message(self, *args, **kwargs):
         """
@@ -203,12 +380,7 @@ class XmppClient:
         message.replace.xml.add_attribute(XmlAttribute("xmlns", "urn:xmpp:message-correct:0"))
         message.replace.xml.add_attribute(XmlAttribute("id", message_id))
 
-        for hook in self.__hooks["send_message"]:
-            message = hook(message, *args, **kwargs)
-
-        if not message:
-            return
-        self._send_xml(message.xml)
+        self.__send_message(message, *args, **kwargs)
 
 
     def on_connect(self, handler:Callable) -> Callable:
@@ -222,7 +394,7 @@ class XmppClient:
         Returns:
             Callable: The handler (not changed).
         """
-        self.__handlers["connected"].append(handler)
+        self.__register(self.__handlers, "connected", handler)
         return handler
     
     def on_disconnect(self, handler:Callable) -> Callable:
@@ -236,7 +408,7 @@ class XmppClient:
         Returns:
             Callable: The handler (not changed).
         """
-        self.__handlers["disconnected"].append(handler)
+        self.__register(self.__handlers, "disconnected", handler)
         return handler
     
     def on_ready(self, handler:Callable) -> Callable:
@@ -255,7 +427,7 @@ class XmppClient:
             ... def on_ready():
             ...     print(f"Loggened in as {client.jid}")
         """
-        self.__handlers["ready"].append(handler)
+        self.__register(self.__handlers, "ready", handler)
         return handler
 
     def on_message(self, handler:Callable) -> Callable:
@@ -277,7 +449,7 @@ class XmppClient:
             ...
             ...     print(f"Received message from {message.from_jid}: {message.body}")
         """
-        self.__handlers["message"].append(handler)
+        self.__register(self.__handlers, "message", handler)
         return handler
     
     def on_presence(self, handler:Callable) -> Callable:
@@ -291,7 +463,7 @@ class XmppClient:
         Returns:
             Callable: The handler (not changed).
         """
-        self.__handlers["presence"].append(handler)
+        self.__register(self.__handlers, "presence", handler)
         return handler
     
     def on_iq(self, handler:Callable) -> Callable:
@@ -305,7 +477,7 @@ class XmppClient:
         Returns:
             Callable: The handler (not changed).
         """
-        self.__handlers["iq"].append(handler)
+        self.__register(self.__handlers, "iq", handler)
         return handler
 
 
@@ -320,7 +492,7 @@ class XmppClient:
         Returns:
             Callable: The hook (not changed).
         """
-        self.__hooks["on_message"].append(hook)
+        self.__register(self.__hooks, "on_message", hook)
         return hook
     
     def hook_on_presence(self, hook:Callable) -> Callable:
@@ -334,7 +506,7 @@ class XmppClient:
         Returns:
             Callable: The hook (not changed).
         """
-        self.__hooks["on_presence"].append(hook)
+        self.__register(self.__hooks, "on_presence", hook)
         return hook
     
     def hook_on_iq(self, hook:Callable) -> Callable:
@@ -348,7 +520,7 @@ class XmppClient:
         Returns:
             Callable: The hook (not changed).
         """
-        self.__hooks["on_iq"].append(hook)
+        self.__register(self.__hooks, "on_iq", hook)
         return hook
     
     def hook_send_message(self, hook:Callable) -> Callable:
@@ -362,16 +534,122 @@ class XmppClient:
         Returns:
             Callable: The hook (not changed).
         """
-        self.__hooks["send_message"].append(hook)
+        self.__register(self.__hooks, "send_message", hook)
+        return hook
+    
+    def hook_send_presence(self, hook:Callable) -> Callable:
+        """
+        Registers a hook for the send presence event.
+        The hook will be called when the client sends its presence.
+        
+        Args:
+            hook (Callable): The hook to register.
+        
+        Returns:
+            Callable: The hook (not changed).
+        """
+        self.__register(self.__hooks, "send_presence", hook)
         return hook
 
 
+    def __register(self, registry:dict, event:str, callback:Callable):
+        with self.__register_lock:
+            registry[event] = [*registry[event], callback]
+
+
     def _recv_xml(self) -> XmlElement:
         data = self.socket.recv(4096)
-        return XmlParser.parse_elements(data.decode("utf-8"))[0]
+
+        if self.__recorder is not None:
+            self.__recorder.received(data)
+
+        metrics = self.__metrics
+        if metrics is None:
+            element = XmlParser.parse_elements(data.decode("utf-8"))[0]
+        else:
+            metrics.inc("xmpp_bytes_received_total", len(data))
+            metrics.observe("xmpp_read_bytes", len(data))
+            start = time.perf_counter()
+            element = XmlParser.parse_elements(data.decode("utf-8"))[0]
+            metrics.observe("xmpp_parse_seconds", time.perf_counter() - start)
+
+        # Features read the results of their IQs directly, while negotiating
+        if self.__iq_spans:
+            iq_span, error = self.__pop_iq_span(element)
+            if iq_span is not None:
+                iq_span.finish(error)
+        return element
     
     def _send_xml(self, xml:XmlElement):
-        self.socket.sendall(xml.to_string().encode("utf-8"))
+        if self.__tracer is not None:
+            return self.__send_xml_traced(xml)
+        self.__write_xml(xml)
+
+    def __send_xml_traced(self, xml:XmlElement):
+        tracer = self.__tracer
+
+        iq_span = None
+        if xml.name == "iq":
+            iq_type = xml.get_attribute_by_name("type")
+            iq_id = xml.get_attribute_by_name("id")
+            if iq_type and iq_id and iq_type.value in ("get", "set"):
+                payload = xml.children[0] if xml.children else None
+                xmlns = payload.get_attribute_by_name("xmlns") if isinstance(payload, XmlElement) else None
+                iq_span = tracer.start_span(f"iq {iq_type.value}", {"id": iq_id.value, "xmlns": xmlns.value if xmlns else None})
+                if iq_span is not None:
+                    oldest = None
+                    with self.__iq_spans_lock:
+                        self.__iq_spans[iq_id.value] = iq_span
+                        if len(self.__iq_spans) > self.MAX_PENDING_IQ_SPANS:
+                            oldest = self.__iq_spans.pop(next(iter(self.__iq_spans)))
+                    if oldest is not None:
+                        oldest.finish("no response")
+
+        with tracer.activate(iq_span) if iq_span is not None else contextlib.nullcontext():
+            with tracer.span(f"send {xml.name}"):
+                self.__write_xml(xml)
+
+    def __write_xml(self, xml:XmlElement):
+        data = xml.to_string().encode("utf-8")
+        # SASL exchanges carry credentials
+        record = f"<{xml.name}/> (redacted)".encode("utf-8") if xml.name in ("auth", "response") else None
+
+        tracer = self.__tracer
+        if tracer is not None and tracer.current() is not None:
+            with tracer.span("socket write", {"bytes": len(data)}):
+                self.__sendall(data, record)
+        else:
+            self.__sendall(data, record)
+
+        metrics = self.__metrics
+        if metrics is not None:
+            metrics.inc("xmpp_bytes_sent_total", len(data))
+            metrics.inc("xmpp_stanzas_sent_total", 1, xml.name)
+            metrics.observe("xmpp_stanza_sent_bytes", len(data), xml.name)
+            if xml.name == "iq":
+                iq_type = xml.get_attribute_by_name("type")
+                iq_id = xml.get_attribute_by_name("id")
+                if iq_type and iq_id and iq_type.value in ("get", "set"):
+                    metrics.iq_sent(iq_id.value, time.perf_counter())
+
+    def __sendall(self, data:bytes, record:bytes=None):
+        with self.__send_lock:
+            # Recorded under the lock, in the order of the wire
+            recorder = self.__recorder
+            if recorder is not None:
+                recorder.sent(data if record is None else record)
+            self.socket.sendall(data)
+
+        keepalive = self.__keepalive
+        if keepalive is not None:
+            keepalive.last_sent = time.monotonic()
+
+    def _change_socket(self, new_socket):
+        """
+        Replaces the socket, e.g. by its TLS wrapper, once the writes in progress are done.
+        """
+        with self.__send_lock:
+            self.socket = new_socket
 
 
     def _start_xmpp_stream(self):
@@ -383,7 +661,7 @@ class XmppClient:
                 XmlAttribute("xmlns", "jabber:client"), 
                 XmlAttribute("xmlns:stream", "http://etherx.jabber.org/streams"), 
                 XmlAttribute("version", "1.0"), 
-                XmlAttribute("to", self.host)
+                XmlAttribute("to", self.domain)
             ],
             is_closed=False
         )
@@ -393,7 +671,7 @@ class XmppClient:
     def _close_xmpp_stream(self):
         logger.debug(f"Closing XMPP stream...")
 
-        self.socket.sendall(b"</stream:stream>")
+        self.__sendall(b"</stream:stream>")
     
     def _send_presence(self):
         logger.debug(f"Sending presence...")
@@ -402,56 +680,454 @@ class XmppClient:
             "presence",
         )
 
+        presence = self._trigger_hooks("send_presence", presence)
+        if presence is None:
+            return
         self._send_xml(presence)
     
 
     def _listen(self):
         logger.debug(f"Listening for XMPP stanzas...")
 
-        buffer = ""
+        self.__framer = XmppStreamFramer()
+
+        selector = None
+        if self.__wakeup is not None:
+            selector = selectors.DefaultSelector()
+            selector.register(self.socket, selectors.EVENT_READ)
+            selector.register(self.__wakeup[0], selectors.EVENT_READ)
 
+        try:
+            self.__listen(selector)
+        finally:
+            if selector is not None:
+                selector.close()
+
+    def __listen(self, selector:selectors.BaseSelector | None):
         while True:
-            data = self.socket.recv(4096)
+            if selector is not None and not self.__wait_readable(selector):
+                break
+
+            try:
+                data = self.socket.recv(4096)
+            except OSError:
+                # The socket was closed by disconnect() from another thread
+                if not self.__connected:
+                    break
+                raise
+
             if not data:
-                self.disconnect()
+                if self.__connected:
+                    self.__disconnect("closed by the server")
                 break
 
-            buffer += data.decode("utf-8")
+            if self.__recorder is not None:
+                self.__recorder.received(data)
 
-            try:
-                elements = XmlParser.parse_elements(buffer)
-                buffer = ""
-            except Exception:
-                # Incomplete stanza
+            if self.__keepalive is not None:
+                self.__keepalive.last_received = time.monotonic()
+
+            if self.__capture:
+                self.__capture.write(data)
+
+            if self.__metrics is not None:
+                self.__metrics.inc("xmpp_bytes_received_total", len(data))
+                self.__metrics.observe("xmpp_read_bytes", len(data))
+
+            self._feed(data)
+
+    def __wait_readable(self, selector:selectors.BaseSelector) -> bool:
+        # Runs the calls until the socket can be read, False if one of them disconnected the client
+        while True:
+            pending = getattr(self.socket, "pending", None)
+            # Data already decrypted by TLS is not seen by select
+            if pending is not None and pending():
+                return True
+
+            readable = False
+            for key, _ in selector.select():
+                if key.fileobj is self.__wakeup[0]:
+                    self.__run_calls()
+                else:
+                    readable = True
+
+            if not self.__connected:
+                return False
+            if readable:
+                return True
+
+    def __run_calls(self):
+        try:
+            while self.__wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self.__calls:
+            future, function, args, kwargs = self.__calls.popleft()
+            if not future.set_running_or_notify_cancel():
                 continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
 
-            for element in elements:
-                if element.name == "message":
-                    message = XmppMessage(element)
-                    hooks_result = self._trigger_hooks("on_message", message)
-                    if hooks_result is None:
-                        continue
-                    self._trigger_handlers("message", hooks_result)
-
-                elif element.name == "presence":
-                    hooks_result = self._trigger_hooks("on_presence", element)
-                    if hooks_result is None:
-                        continue
-                    self._trigger_handlers("presence", hooks_result)
-                
-                elif element.name == "iq":
-                    hooks_result = self._trigger_hooks("on_iq", element)
-                    if hooks_result is None:
-                        continue
-                    self._trigger_handlers("iq", hooks_result)
+    def _feed(self, data:bytes):
+        """
+        Parses received data and dispatches the complete stanzas.
+        Used by the listen loop and by replays.
+        """
+        metrics = self.__metrics
+        start = time.perf_counter() if metrics is not None else 0
+
+        elements = []
+        for chunk in self.__framer.feed(data):
+            elements.extend(XmlParser.parse_elements(chunk.decode("utf-8")))
+
+        if metrics is not None and elements:
+            metrics.observe("xmpp_parse_seconds", time.perf_counter() - start)
+
+        for element in elements:
+            self._dispatch(element)
+
+    def _dispatch(self, element:XmlElement):
+        metrics = self.__metrics
+        if metrics is not None:
+            metrics.inc("xmpp_stanzas_received_total", 1, element.name)
+            if element.name == "iq":
+                iq_type = element.get_attribute_by_name("type")
+                iq_id = element.get_attribute_by_name("id")
+                if iq_type and iq_id and iq_type.value in ("result", "error"):
+                    metrics.iq_received(iq_id.value, time.perf_counter())
+
+        tracer = self.__tracer
+        if tracer is None:
+            self.__dispatch(element)
+            return
 
-    def connect_feature(self, feature:XmppFeature, permissions: List[XmppPermission] | XmppPermission.ALL) -> None:
+        # A result or error continues the trace of its request
+        iq_span, error = self.__pop_iq_span(element)
+
+        from_jid = element.get_attribute_by_name("from")
+        with tracer.span(f"receive {element.name}", {"from": from_jid.value if from_jid else None}, parent=iq_span):
+            self.__dispatch(element)
+
+        if iq_span is not None:
+            iq_span.finish(error)
+
+    def __pop_iq_span(self, element:XmlElement):
+        # Checked without the lock: the span of a request is added before the request is written,
+        # so it is always there when the response is read
+        if element.name != "iq" or not self.__iq_spans:
+            return None, None
+
+        iq_type = element.get_attribute_by_name("type")
+        iq_id = element.get_attribute_by_name("id")
+        if not iq_type or not iq_id or iq_type.value not in ("result", "error"):
+            return None, None
+        with self.__iq_spans_lock:
+            iq_span = self.__iq_spans.pop(iq_id.value, None)
+        return iq_span, "error" if iq_type.value == "error" else None
+
+    def __dispatch(self, element:XmlElement):
+        if element.name == "message":
+            message = XmppMessage(element)
+            hooks_result = self._trigger_hooks("on_message", message)
+            if hooks_result is None:
+                return
+            self._trigger_handlers("message", hooks_result)
+
+        elif element.name == "presence":
+            hooks_result = self._trigger_hooks("on_presence", element)
+            if hooks_result is None:
+                return
+            self._trigger_handlers("presence", hooks_result)
+        
+        elif element.name == "iq":
+            # Pings and their answers
+            keepalive = self.__keepalive
+            if keepalive is not None and keepalive.on_iq(element):
+                return
+
+            hooks_result = self._trigger_hooks("on_iq", element)
+            if hooks_result is None:
+                return
+            self._trigger_handlers("iq", hooks_result)
+
+    def enable_metrics(self, metrics:XmppMetrics=None) -> XmppMetrics:
+        """
+        Enables the counters and histograms of stanzas, bytes, parse, hook and handler times and IQ round trips.
+
+        Args:
+            metrics (XmppMetrics): The metrics to update, can be shared by several clients. If none, new ones. (Default: None)
+
+        Returns:
+            XmppMetrics: The metrics.
+
+        Example:
+            >>> metrics = client.enable_metrics()
+            >>> print(metrics.to_prometheus())
+        """
+        self.__metrics = metrics or XmppMetrics()
+        return self.__metrics
+
+    def disable_metrics(self) -> None:
+        """
+        Disables the metrics, the hot paths only check for None afterwards.
+        """
+        self.__metrics = None
+
+    def enable_profiling(self, sample_rate:float=1.0) -> XmppProfiler:
+        """
+        Enables the CPU time accounting of the hooks and handlers of every extension and feature.
+
+        Args:
+            sample_rate (float): The share of the calls timed, the rest is extrapolated. (Default: 1.0)
+
+        Returns:
+            XmppProfiler: The profiler.
+
+        Example:
+            >>> client.enable_profiling(sample_rate=0.01)
+        """
+        self.__profiler = XmppProfiler(sample_rate)
+        return self.__profiler
+
+    def disable_profiling(self) -> None:
+        """
+        Disables the CPU time accounting, keeping nothing of it.
+        """
+        self.__profiler = None
+
+    def profile(self) -> List[dict]:
+        """
+        Gets the CPU time of the hooks and handlers of every extension and feature, the most expensive first.
+
+        Returns:
+            List[dict]: The ``owner`` ID, ``kind``, ``event``, ``calls``, ``exceptions``,
+            ``time`` in seconds and ``time_per_call`` in microseconds of every hook and handler.
+            Empty if profiling is disabled.
+
+        Example:
+            >>> client.enable_profiling()
+            >>> ...
+            >>> for entry in client.profile()[:5]:
+            ...     print(entry["owner"], entry["event"], entry["time"])
+        """
+        if self.__profiler is None:
+            return []
+        return self.__profiler.report()
+
+    def enable_tracing(self, exporter:XmppSpanExporter, sample_rate:float=1.0) -> XmppTracer:
+        """
+        Enables the tracing of sent stanzas, IQ exchanges and received stanzas, with their hooks and socket writes.
+
+        Args:
+            exporter (XmppSpanExporter): The exporter of the spans, like ``JsonLinesExporter`` or ``OpenTelemetryExporter``.
+            sample_rate (float): The share of the traces recorded. (Default: 1.0)
+
+        Returns:
+            XmppTracer: The tracer, to open spans of your own.
+
+        Example:
+            >>> client.enable_tracing(JsonLinesExporter("trace.jsonl"), sample_rate=0.1)
+        """
+        self.__tracer = XmppTracer(exporter, sample_rate)
+        return self.__tracer
+
+    def disable_tracing(self) -> None:
+        """
+        Disables the tracing, ending the spans of unanswered IQs and shutting the exporter down.
+        """
+        tracer = self.__tracer
+        if tracer is None:
+            return
+        self.__tracer = None
+
+        with self.__iq_spans_lock:
+            iq_spans, self.__iq_spans = self.__iq_spans, {}
+        for span in iq_spans.values():
+            span.finish("no response")
+        tracer.shutdown()
+
+    def memory_report(self) -> dict:
+        """
+        Gets the size of the internal caches, queues and buffers of the client and of every extension.
+
+        Returns:
+            dict: ``client`` and ``extensions`` (by extension ID), with the number of ``entries`` and
+            the estimated ``bytes`` of every structure. With allocation tracking enabled, also
+            ``allocations``, the ``bytes`` and ``blocks`` allocated by every extension and feature.
+
+        Example:
+            >>> report = client.memory_report()
+            >>> report["extensions"]["osmiumnet.omemo"]["registered_xmls"]
+            {'entries': 3, 'bytes': 512}
+        """
+        with self.__iq_spans_lock:
+            iq_spans = dict(self.__iq_spans)
+        client = {
+            "framer": measure(self.__framer),
+            "iq_spans": measure(iq_spans),
+        }
+        if self.__metrics is not None:
+            for name, structure in self.__metrics._memory_report().items():
+                client[f"metrics_{name}"] = measure(structure)
+
+        extensions = {}
+        for extension_id, extension_ci in list(self.__extensions.items()):
+            structures = extension_ci.object._memory_report()
+            extensions[extension_id] = {name: measure(structure) for name, structure in structures.items()}
+
+        report = {"client": client, "extensions": extensions}
+        if self.__allocations is not None:
+            report["allocations"] = self.__allocations.snapshot()
+        return report
+
+    def enable_allocation_tracking(self, frames:int=25) -> XmppAllocationTracker:
+        """
+        Starts ``tracemalloc``, so that ``memory_report()`` attributes the allocated memory to extensions and features.
+        Tracing allocations slows down the whole process.
+
+        Args:
+            frames (int): The number of frames stored per allocation, deep enough to reach the extension code. (Default: 25)
+
+        Returns:
+            XmppAllocationTracker: The tracker.
+        """
+        self.disable_allocation_tracking()
+
+        self.__allocations = XmppAllocationTracker(frames)
+        for owners in (self.__features, self.__extensions):
+            for owner_id, owner_ci in owners.items():
+                self.__allocations.add_owner(owner_id, owner_ci.object)
+        self.__allocations.start()
+        return self.__allocations
+
+    def disable_allocation_tracking(self) -> None:
+        """
+        Stops ``tracemalloc``, if it was started by ``enable_allocation_tracking()``.
+        """
+        if self.__allocations is not None:
+            self.__allocations.stop()
+            self.__allocations = None
+
+    def enable_flight_recorder(self, size:int=256, output:str | TextIO=None, dump_on_disconnect:bool=False) -> XmppFlightRecorder:
+        """
+        Keeps the last raw data received and sent, without formatting it, to dump it for post-mortems.
+        The records are dumped when ``connect()`` raises and when the server closes the stream,
+        e.g. after a stream error, and on demand with ``dump_flight_recorder()``.
+
+        Args:
+            size (int): The number of reads and writes kept. (Default: 256)
+            output (str | TextIO): Where dumps are written, a path to append to or an open text file. If none, they are logged. (Default: None)
+            dump_on_disconnect (bool): Whether to also dump on every ``disconnect()``. (Default: False)
+
+        Returns:
+            XmppFlightRecorder: The flight recorder.
+
+        Example:
+            >>> client.enable_flight_recorder(size=512, output="xmpp-postmortem.log")
+        """
+        self.__recorder = XmppFlightRecorder(size, output)
+        self.__dump_on_disconnect = dump_on_disconnect
+        return self.__recorder
+
+    def enable_keepalive(self, interval:float=60, ping_interval:float=120, timeout:float=30) -> XmppKeepalive:
+        """
+        Sends whitespace keepalives and XEP-0199 pings once the client is ready, and disconnects
+        when a ping gets no answer in time, instead of waiting on a dead connection.
+        The round-trip times of the pings are available in ``rtt``.
+
+        Args:
+            interval (float): Seconds without writing before a whitespace keepalive, none to not send them. (Default: 60)
+            ping_interval (float): Seconds between pings, none to not ping. (Default: 120)
+            timeout (float): Seconds to wait for the answer to a ping. (Default: 30)
+
+        Returns:
+            XmppKeepalive: The keepalive.
+
+        Example:
+            >>> client.enable_keepalive(interval=30, ping_interval=60, timeout=10)
+        """
+        self.disable_keepalive()
+        self.__keepalive = XmppKeepalive(interval, ping_interval, timeout)
+        if self.__connected:
+            self.__start_keepalive()
+        return self.__keepalive
+
+    def disable_keepalive(self) -> None:
+        """
+        Stops sending keepalives and pings.
+        """
+        keepalive, self.__keepalive = self.__keepalive, None
+        if keepalive is not None:
+            keepalive.stop()
+
+    def __start_keepalive(self):
+        self.__keepalive.start(self.__sendall, self._send_xml, self.__on_dead_connection, self.domain)
+
+    def __on_dead_connection(self, reason:str):
+        if not self.__connected:
+            return
+
+        self.__connected = False
+        try:
+            # Fails the writes blocked on the full socket buffer
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__disconnect(reason)
+
+    def disable_flight_recorder(self) -> None:
+        """
+        Disables the flight recorder, dropping its records.
+        """
+        self.__recorder = None
+
+    def dump_flight_recorder(self, reason:str=None, output:str | TextIO=None) -> None:
+        """
+        Writes the records of the flight recorder, if enabled.
+
+        Args:
+            reason (str): Why the records are dumped, put in the header. (Default: None)
+            output (str | TextIO): Where to write them instead of the recorder output. (Default: None)
+        """
+        if self.__recorder is not None:
+            self.__recorder.dump(reason, output)
+
+    def start_capture(self, path:str, redact:bool | Callable = False) -> None:
+        """
+        Starts writing the received stream to a capture file, with the time of every read.
+        Only the stanzas after the stream negotiation are captured, after TLS and without credentials.
+        The capture stops on disconnect.
+
+        Args:
+            path (str): The path of the capture file.
+            redact (bool | Callable): Whether to replace the character data (bodies, statuses, payloads) with ``x``,
+                or a function redacting a chunk of bytes. (Default: False)
+
+        Example:
+            >>> client.start_capture("presence-storm.cap", redact=True)
+        """
+        self.stop_capture()
+        self.__capture = XmppCaptureWriter(path, redact)
+
+    def stop_capture(self) -> None:
+        """
+        Stops the capture and closes its file.
+        """
+        if self.__capture:
+            self.__capture.close()
+            self.__capture = None
+
+    def connect_feature(self, feature:XmppFeature, permissions: List[XmppPermission] | XmppPermission) -> None:
         """
         Connects the given feature to the XMPP client.
 
         Args:
             feature (XmppFeature): The feature to connect.
-            permissions (List[XmppPermission] | XmppPermission.ALL): The permissions to grant.
+            permissions (List[XmppPermission] | XmppPermission): The permissions to grant, at least its ``REQUIRED_PERMISSIONS``.
         
         Example:
             >>> client.connect_feature(BindFeature("osmxmpp"), XmppPermission.ALL)
@@ -462,17 +1138,21 @@ class XmppClient:
         XmppValidation.validate_id(feature.ID)
 
         feature_ci = XmppClientInterface(self, feature, permissions)
+        self.__check_required_permissions("Feature", feature, feature_ci)
 
         feature._connect_ci(feature_ci)
         self.__features[feature.ID] = feature_ci
         self.__features_queue.append(feature.ID)
 
-    def connect_features(self, features_with_permissions: List[Tuple[XmppFeature, List[XmppPermission] | XmppPermission.ALL]] ) -> None:
+        if self.__allocations is not None:
+            self.__allocations.add_owner(feature.ID, feature)
+
+    def connect_features(self, features_with_permissions: List[Tuple[XmppFeature, List[XmppPermission] | XmppPermission]] ) -> None:
         """
         Connects the given features to the XMPP client.
 
         Args:
-            features_with_permissions (List[Tuple[XmppFeature, List[XmppPermission] | XmppPermission.ALL]]): The features with permissions to connect
+            features_with_permissions (List[Tuple[XmppFeature, List[XmppPermission] | XmppPermission]]): The features with permissions to connect
         
         Example:
             >>> client.connect_features([
@@ -485,13 +1165,13 @@ class XmppClient:
             self.connect_feature(feature_with_permissions[0], feature_with_permissions[1]) 
 
 
-    def connect_extension(self, extension:XmppExtension, permissions: List[XmppPermission] | XmppPermission.ALL) -> None:
+    def connect_extension(self, extension:XmppExtension, permissions: List[XmppPermission] | XmppPermission) -> None:
         """
         Connects the given extension to the XMPP client.
 
         Args:
             extension (XmppExtension): The extension to connect.
-            permissions (List[XmppPermission] | XmppPermission.ALL): The permissions to grant.
+            permissions (List[XmppPermission] | XmppPermission): The permissions to grant, at least its ``REQUIRED_PERMISSIONS``.
         
         Example:
             >>> client.connect_extension(SomeExtension(), XmppPermission.ALL)
@@ -502,20 +1182,24 @@ class XmppClient:
         XmppValidation.validate_id(extension.ID)
 
         extension_ci = XmppClientInterface(self, extension, permissions)
+        self.__check_required_permissions("Extension", extension, extension_ci)
         
         extension._connect_ci(extension_ci)
 
         self.__extensions[extension.ID] = extension_ci
         self.__extensions_queue.append(extension.ID)
 
+        if self.__allocations is not None:
+            self.__allocations.add_owner(extension.ID, extension)
+
         self.__extensions[extension.ID].object._process()
     
-    def connect_extensions(self, extensions_with_permissions: List[Tuple[XmppExtension, List[XmppPermission] | XmppPermission.ALL]] ) -> None:
+    def connect_extensions(self, extensions_with_permissions: List[Tuple[XmppExtension, List[XmppPermission] | XmppPermission]] ) -> None:
         """
         Connects the given extensions to the XMPP client.
 
         Args:
-            extensions_with_permissions (List[Tuple[XmppExtension, List[XmppPermission] | XmppPermission.ALL]]): The extensions with permissions to connect
+            extensions_with_permissions (List[Tuple[XmppExtension, List[XmppPermission] | XmppPermission]]): The extensions with permissions to connect
         
         Example:
             >>> client.connect_extensions([
@@ -528,13 +1212,34 @@ class XmppClient:
             self.connect_extension(extension_with_permissions[0], extension_with_permissions[1])
 
 
+    def __check_required_permissions(self, kind:str, owner, ci:XmppClientInterface):
+        required = getattr(owner, "REQUIRED_PERMISSIONS", None)
+        if not required:
+            return
+
+        missing = XmppPermission.combine(required) & ~ci.permissions
+        if missing:
+            raise Exception(f"{kind} '{owner.ID}' requires the {missing} permissions")
+
     def connect(self) -> None:
         """
         Connects to the XMPP server.
         """
+        try:
+            self.__connect()
+        except Exception as e:
+            if self.__recorder is not None:
+                self.__recorder.dump(f"{type(e).__name__}: {e}")
+            raise
+
+    def __connect(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.socket:
             self.socket.connect((self.host, self.port))
 
+            if self.__stopping:
+                logger.debug("Stopped while connecting")
+                return
+
             self.__connected = True
 
             logger.info(f"Connected to {self.host}:{self.port}")
@@ -584,6 +1289,12 @@ class XmppClient:
 
             self._trigger_handlers("ready")
 
+            if self.__keepalive is not None:
+                self.__start_keepalive()
+
+            if self.__ready is not None and not self.__ready.done():
+                self.__ready.set_result(None)
+
             self._listen()
             self.socket.close()
     
@@ -595,13 +1306,161 @@ class XmppClient:
         if not self.__connected:
             raise Exception("XmppClient is not connected")
 
-        self._close_xmpp_stream()
-        self.socket.close()
+        self.__disconnect(None)
+
+    def __disconnect(self, reason:str | None):
+        # Cleared first, so the listen loop takes the server closing the stream as expected
         self.__connected = False
+        if self.__keepalive is not None:
+            self.__keepalive.stop()
+        try:
+            self._close_xmpp_stream()
+        except OSError:
+            # The server already closed the connection
+            pass
+        self.socket.close()
+        self.stop_capture()
+
+        wakeup = self.__wakeup
+        if wakeup is not None:
+            # The client thread waits on the closed socket, select does not return for it
+            self.__wake(wakeup)
+
+        if self.__recorder is not None and (reason is not None or self.__dump_on_disconnect):
+            self.__recorder.dump(reason or "disconnected")
 
         self._trigger_handlers("disconnected")
         logger.info(f"Disconnected from {self.host}:{self.port}")
     
 
+    def start(self) -> Future:
+        """
+        Connects to the XMPP server in a background thread, which then reads the stream and runs the handlers.
+
+        Returns:
+            Future: Done once the client is ready, or with the exception that stopped the connection before.
+
+        Example:
+            >>> client.start().result(timeout=30)
+            >>> client.send_message("john@jabber.org", "Hello, John!")
+            >>> client.stop()
+        """
+
+        if self.__thread is not None and self.__thread.is_alive():
+            raise Exception("XmppClient is already started")
+
+        self.__ready = Future()
+        self.__ready.set_running_or_notify_cancel()
+        self.__stopping = False
+        wakeup = socket.socketpair()
+        wakeup[0].setblocking(False)
+        wakeup[1].setblocking(False)
+        with self.__calls_lock:
+            self.__wakeup = wakeup
+
+        self.__thread = threading.Thread(target=self.__run, args=(self.__ready,), name=f"XmppClient {self.host}", daemon=True)
+        self.__thread.start()
+        return self.__ready
+
+    def __run(self, ready:Future):
+        try:
+            self.connect()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif self.__connected:
+                logger.error(f"XmppClient thread stopped: {e}")
+        finally:
+            if not ready.done():
+                ready.set_exception(Exception("XmppClient was stopped before it was ready"))
+
+            with self.__calls_lock:
+                wakeup, self.__wakeup = self.__wakeup, None
+                calls = list(self.__calls)
+                self.__calls.clear()
+            wakeup[0].close()
+            wakeup[1].close()
+
+            # Calls made too late
+            for future, _, _, _ in calls:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(Exception("XmppClient is stopped"))
+
+    def call_soon_threadsafe(self, function:Callable, *args, **kwargs) -> Future:
+        """
+        Runs a function on the client thread, between two reads of the stream.
+        The functions run in the order of the calls, once the client is ready.
+
+        Args:
+            function (Callable): The function.
+            *args: The arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            Future: Done with the result of the function, or its exception.
+
+        Example:
+            >>> client.call_soon_threadsafe(client.send_message, "john@jabber.org", "Hello, John!")
+        """
+
+        future = Future()
+        with self.__calls_lock:
+            wakeup = self.__wakeup
+            if wakeup is None:
+                raise Exception("XmppClient is not started")
+            self.__calls.append((future, function, args, kwargs))
+
+        self.__wake(wakeup)
+        return future
+
+    def __wake(self, wakeup:Tuple[socket.socket, socket.socket]):
+        try:
+            wakeup[1].send(b"\0")
+        except BlockingIOError:
+            # The client thread has wakeups to read already
+            pass
+        except OSError:
+            # Stopped meanwhile, late calls are failed by the client thread
+            pass
+
+    def stop(self, timeout:float=None) -> bool:
+        """
+        Stops a client started with ``start``: runs the calls already made, closes the stream once
+        the stanzas being sent are written, and waits for the client thread.
+
+        Args:
+            timeout (float): The seconds to wait for the client thread. If none, waits until it ends. (Default: None)
+
+        Returns:
+            bool: Whether the client thread ended.
+        """
+
+        thread = self.__thread
+        if thread is None:
+            raise Exception("XmppClient is not started")
+
+        if not self.__ready.done():
+            # Still connecting or negotiating, the calls only run once ready.
+            # Recorded first: without a connected socket to shut down, connect() checks it
+            self.__stopping = True
+            self.__connected = False
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except (OSError, AttributeError):
+                pass
+        elif self.__connected:
+            try:
+                self.call_soon_threadsafe(self.__stop)
+            except Exception:
+                # The client thread is ending
+                pass
+
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def __stop(self):
+        if self.__connected:
+            self.__disconnect(None)
+
     def __repr__(self):
         return f"<XmppClient {self.host}:{self.port}>"
@@ -1,10 +1,12 @@
 from .abc import XmppExtension
 from .omemo import OmemoExtension 
 from .service.discovery import ServiceDiscoveryExtension
+from .service.caps import CapsExtension
 
 
 __all__ = [
     "XmppExtension",
     "OmemoExtension",
     "ServiceDiscoveryExtension",
+    "CapsExtension",
 ]
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List
 
 
 class XmppExtension(ABC):
@@ -8,9 +9,12 @@ class XmppExtension(ABC):
 
     Attributes:
         ID (str): The ID of the extension implementation.
+        FEATURES (List[str]): The service discovery features of the extension, advertised by the caps extension.
     """
 
     ID = None
+
+    FEATURES: List[str] = []
     
     @abstractmethod
     def _connect_ci(self, ci) -> None:
@@ -27,4 +31,12 @@ class XmppExtension(ABC):
         """
         Processes the extension.
         """
-        ...
\ No newline at end of file
+        ...
+    def _memory_report(self) -> dict:
+        """
+        Gets the internal caches, queues and buffers of the extension, for ``client.memory_report()``.
+
+        Returns:
+            dict: The structures by name, anything with a length.
+        """
+        return {}
@@ -1,6 +1,17 @@
 from .base import OmemoExtension
+from .cache import OmemoCache, MemoryOmemoCache, SqliteOmemoCache
+from .encoding import OmemoKeyEncoding
+from .prekeys import OmemoPrekeyManager
+from .storage import SqliteOmemoStorage, OmemoSessionState
 
 __all__ = [
-    "OmemoExtension"
+    "OmemoExtension",
+    "OmemoCache",
+    "MemoryOmemoCache",
+    "SqliteOmemoCache",
+    "OmemoKeyEncoding",
+    "OmemoPrekeyManager",
+    "SqliteOmemoStorage",
+    "OmemoSessionState",
 ]
 
@@ -1,28 +1,58 @@
 import os
 import base64
-import json
 import time
 import random
 import struct
 import secrets
+import threading
+import contextlib
 
-from typing import Callable, List, Tuple, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple, Dict, Set
 
 from osmxml import XmlParser, XmlElement, XmlAttribute, XmlTextElement
 
 from osmomemo import Omemo, OmemoBundle, XKeyPair, EdKeyPair
 from osmomemo.storage import OmemoStorage
 
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PublicKey
+
 from ..abc import XmppExtension
 from ...message import XmppMessage
 from ...permission import XmppPermission
+from ...jid import bare_jid
+
+from .xml import OmemoXml, PAYLOAD_PLACEHOLDER
+from .payload import OmemoPayload
+from .encoding import OmemoKeyEncoding
+from .prekeys import OmemoPrekeyManager
+from .cache import OmemoCache, MemoryOmemoCache
+
+import logging
 
-from .xml import OmemoXml
+
+logger = logging.getLogger(__name__)
 
 
 class OmemoExtension(XmppExtension):
     """
     XEP-0384: OMEMO Encryption implementation.
+
+    The body is encrypted once with AES-GCM in the ``<payload>``, the keys only carry its key.
+    osmxmpp 1.0.1 and earlier put the body itself in the keys and can't read these messages,
+    whatever the key encoding. Their messages are still decrypted.
+
+    Attributes:
+        bundle (OmemoBundle): The own OMEMO bundle.
+        storage (OmemoStorage): The OMEMO sessions storage, e.g. SqliteOmemoStorage. If it has a ``flush`` method, it is called before every sent message.
+        cache (OmemoCache): The contacts device lists and bundles cache. (Default: MemoryOmemoCache)
+        workers (int): The number of threads wrapping message keys for recipient devices in parallel. 0 wraps on the calling thread. (Default: 0)
+        decrypt_workers (int): The number of threads decrypting incoming messages off the reader thread. Messages of one sender are still delivered in order. 0 decrypts on the reader thread. (Default: 0)
+        init_timeout (float): The number of seconds messages to a contact are held while its missing device list and bundles are fetched. After that they are encrypted for the devices that are known. (Default: 10)
+        key_encoding (str): The encoding of sent keys, ``json`` or the smaller and faster to decode ``binary`` protobuf layout. Both are accepted on receive. (Default: ``json``)
+        prekeys (OmemoPrekeyManager): The one-time prekey pool manager of the bundle. (Default: OmemoPrekeyManager)
     """
 
     ID = "osmiumnet.omemo"
@@ -33,21 +63,121 @@ class OmemoExtension(XmppExtension):
         XmppPermission.SEND_XML,
         XmppPermission.LISTEN_ON_READY,
         XmppPermission.LISTEN_ON_IQ,
+        XmppPermission.LISTEN_ON_PRESENCE,
         XmppPermission.HOOK_ON_MESSAGE,
         XmppPermission.HOOK_SEND_MESSAGE,
     ]
 
-    def __init__(self, bundle: OmemoBundle, storage: OmemoStorage):
+    # Contacts send device list updates only to clients that ask for them
+    FEATURES: List[str] = [
+        "urn:xmpp:omemo:2:devices+notify",
+    ]
+
+    # Seconds messages to a contact without a device list fail before it is fetched again
+    NO_DEVICES_TTL = 60
+
+    def __init__(
+                self,
+                bundle: OmemoBundle,
+                storage: OmemoStorage,
+                cache: OmemoCache = None,
+                workers: int = 0,
+                decrypt_workers: int = 0,
+                init_timeout: float = 10,
+                key_encoding: str = OmemoKeyEncoding.JSON,
+                prekeys: OmemoPrekeyManager = None,
+            ):
         self.__bundle = bundle
         self.__omemo = Omemo(self.__bundle, storage)
 
+        # Storages grouping writes must persist the ratchet before a message leaves
+        self.__flush_storage = getattr(storage, "flush", None)
+
+        self.__prekeys = prekeys if prekeys is not None else OmemoPrekeyManager()
+        self.__prekeys._connect(self.__bundle, self.__publish_bundle, self.__on_prekeys_changed)
+
         self.__registered_xmls: Dict[str, str] = {}
 
-        self.__contact_bundles = {}
+        if (key_encoding not in (OmemoKeyEncoding.JSON, OmemoKeyEncoding.BINARY)):
+            raise ValueError(f"Unknown key encoding '{key_encoding}'")
+        self.__key_encoding = key_encoding
+
+        self.__cache = cache if cache is not None else MemoryOmemoCache()
+
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="omemo") if workers > 0 else None
+
+        # Sender bare JID -> (message, enqueued at) waiting for decryption
+        self.__decrypt_executor = ThreadPoolExecutor(max_workers=decrypt_workers, thread_name_prefix="omemo-decrypt") if decrypt_workers > 0 else None
+        self.__decrypt_queues: Dict[str, deque] = {}
+        self.__decrypt_lock = threading.Lock()
+        self.__decrypt_stats = {
+            "queue_depth": 0,
+            "decrypted": 0,
+            "failed": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+
+        # Recipient bare JID -> (message, held at, args, kwargs) waiting for device lists and bundles
+        self.__init_timeout = init_timeout
+        self.__pending_sends: Dict[str, deque] = {}
+        self.__pending_timers: Dict[str, threading.Timer] = {}
+        self.__flushing: Set[str] = set()
+
+        # Request ID -> (bare JID, requested bundles or None for the device list)
+        self.__fetches: Dict[str, Tuple[str, List[int] | None]] = {}
+        # (bare JID, device) pairs without a published bundle
+        self.__unavailable: Set[Tuple[str, int]] = set()
+        # Bare JID -> monotonic time until which its failed device list fetch is not retried.
+        # Kept in memory only, a failure may be transient and must not stay in a persistent cache
+        self.__no_devices: Dict[str, float] = {}
+
+        self.__send_lock = threading.RLock()
+
+        # Recipient bare JID -> lock held from the ratchet steps of a message until it is written:
+        # chains only go forward, so a peer can't decrypt messages written in another order than
+        # they were encrypted. Messages to other recipients are encrypted meanwhile
+        self.__recipient_locks: Dict[str, threading.RLock] = {}
+        # (bare JID, device) -> lock of its session, a ratchet step reads the session and writes it back
+        self.__session_locks: Dict[Tuple[str, int], threading.Lock] = {}
+        self.__session_locks_lock = threading.Lock()
+        self.__send_stats = {
+            "held": 0,
+            "sent": 0,
+            "failed": 0,
+            "hold_total": 0.0,
+            "hold_max": 0.0,
+        }
+
+        # Room bare JID -> occupant nick -> real bare JID, from muc#user presences
+        self.__rooms: Dict[str, Dict[str, str]] = {}
+
+        self.__handlers = {
+            "on_send_failed": [],
+            "on_prekeys_changed": [],
+        }
 
     def _connect_ci(self, ci):
         self.__ci = ci
 
+    def _memory_report(self):
+        report = {
+            "registered_xmls": self.__registered_xmls,
+            "decrypt_queues": self.__decrypt_queues,
+            "pending_sends": self.__pending_sends,
+            "pending_timers": self.__pending_timers,
+            "fetches": self.__fetches,
+            "unavailable": self.__unavailable,
+            "no_devices": self.__no_devices,
+            "rooms": self.__rooms,
+            "session_locks": self.__session_locks,
+            "recipient_locks": self.__recipient_locks,
+        }
+        # Only a cache in memory is measured, not a database
+        if (isinstance(self.__cache, MemoryOmemoCache)):
+            report["cache"] = self.__cache
+        return report
+
     def _process(self):
         # Listeners
         @self.__ci.on_ready
@@ -58,15 +188,21 @@ class OmemoExtension(XmppExtension):
         def on_iq(iq):
             self.__on_iq(iq)
 
+        @self.__ci.on_presence
+        def on_presence(presence: XmlElement):
+            self.__on_presence(presence)
+
 
         # Hooks
         @self.__ci.hook_on_message
         def hook_on_message(message: XmppMessage):
             return self.__hook_on_message(message)
+        self.__message_hook = hook_on_message
 
         @self.__ci.hook_send_message
         def hook_send_message(message: XmppMessage, *args, **kwargs):
-            return self.__hook_send_message(message)
+            return self.__hook_send_message(message, *args, **kwargs)
+        self.__send_hook = hook_send_message
 
 
         # Variables
@@ -74,31 +210,94 @@ class OmemoExtension(XmppExtension):
 
         self.__ci.variables.function(self.fetch_bundles)
 
+        self.__ci.variables.function(self.get_cache_stats)
+
+        self.__ci.variables.function(self.get_decryption_stats)
+
+        self.__ci.variables.function(self.get_send_stats)
+
+        self.__ci.variables.function(self.get_prekey_stats)
+
+        self.__ci.variables.function(self.get_room_occupants)
+
+    def on_send_failed(self, handler:Callable):
+        """
+        Registers a handler for the ``on_send_failed`` event.
+
+        Handler will be called with the message and the reason when a message
+        could not be encrypted for any device of the recipient. Such messages are never sent.
+
+        Args:
+            handler (Callable): The handler to register.
+
+        Returns:
+            Callable: The handler (unchanged).
+
+        Example:
+            >>> @client.extensions["osmiumnet.omemo"].on_send_failed
+            ... def on_send_failed(message, reason):
+            ...     print(f"Message to {message.to_jid} was not sent: {reason}")
+        """
+
+        self.__handlers["on_send_failed"].append(handler)
+        return handler
+
+    def on_prekeys_changed(self, handler:Callable):
+        """
+        Registers a handler for the ``on_prekeys_changed`` event.
+
+        Handler will be called with the IDs of the consumed and of the generated one-time prekeys
+        whenever the bundle prekeys change, so the bundle can be saved with them.
+
+        Args:
+            handler (Callable): The handler to register.
+
+        Returns:
+            Callable: The handler (unchanged).
+
+        Example:
+            >>> @client.extensions["osmiumnet.omemo"].on_prekeys_changed
+            ... def on_prekeys_changed(consumed, generated):
+            ...     save_bundle(bundle)
+        """
+
+        self.__handlers["on_prekeys_changed"].append(handler)
+        return handler
+
     def publish_bundle_information(self):
         """
         Publishes the bundle information.
+        The one-time prekey pool is refilled first if it is low.
 
         Example:
             >>> client.extensions["osmiumnet.omemo"].publish_bundle_information()
         """
 
+        self.__prekeys.ensure()
+
         xml = OmemoXml.publish_device(self.__ci.get_jid(False), self.__bundle.get_device_id())
         self.__send_registered_xml(xml, "publish_device:func")
 
-    def fetch_bundles(self, jid):
+    def fetch_bundles(self, jid, force: bool = False):
         """
         Fetches the bundles from the given JID.
+        Cached device lists and bundles are not fetched again, unless forced.
 
         Args:
             jid (str | List[str]): The JID(s) to fetch the bundles from.
+            force (bool): Whether to fetch the device list even if it is cached. (Default: False)
         
         Example:
             >>> client.extensions["osmiumnet.omemo"].fetch_bundles("john@jabber.org")
         """
 
         def _fetch(jid: str):
-            xml = OmemoXml.fetch_devices(self.__ci.get_jid(), jid)
-            self.__send_registered_xml(xml, "fetch_devices:func")
+            jid = bare_jid(jid)
+            if (not force and self.__cache.get_devices(jid) is not None):
+                self.__fetch_missing_bundles(jid)
+                return
+
+            self.__fetch_devices(jid)
 
         if (isinstance(jid, list)):
             for j in jid:
@@ -106,6 +305,135 @@ class OmemoExtension(XmppExtension):
         else:
             _fetch(jid)
 
+    def get_cache_stats(self) -> Dict[str, int]:
+        """
+        Gets the device lists and bundles cache counters.
+
+        Returns:
+            Dict[str, int]: The ``hits`` and ``misses`` counters.
+
+        Example:
+            >>> client.extensions["osmiumnet.omemo"].get_cache_stats()
+            {'hits': 42, 'misses': 3}
+        """
+
+        return self.__cache.stats()
+
+    def get_decryption_stats(self) -> Dict[str, int | float]:
+        """
+        Gets the incoming messages decryption metrics.
+
+        Returns:
+            Dict[str, int | float]: ``queue_depth`` (messages waiting for decryption), ``decrypted``, ``failed``,
+            and ``latency_avg``/``latency_max`` in seconds from receiving to delivering a message.
+
+        Example:
+            >>> client.extensions["osmiumnet.omemo"].get_decryption_stats()
+            {'queue_depth': 0, 'decrypted': 120, 'failed': 0, 'latency_avg': 0.004, 'latency_max': 0.03}
+        """
+
+        with self.__decrypt_lock:
+            stats = self.__decrypt_stats.copy()
+
+        latency_total = stats.pop("latency_total")
+        processed = stats["decrypted"] + stats["failed"]
+        stats["latency_avg"] = latency_total / processed if processed else 0.0
+        return stats
+
+    def get_send_stats(self) -> Dict[str, int | float]:
+        """
+        Gets the outgoing messages metrics.
+
+        Returns:
+            Dict[str, int | float]: ``pending`` (messages waiting for bundles), ``held`` (messages that had to wait), ``sent``, ``failed``,
+            and ``hold_avg``/``hold_max`` in seconds a held message waited for its recipient bundles,
+            i.e. the time to the first encrypted message for a new contact.
+
+        Example:
+            >>> client.extensions["osmiumnet.omemo"].get_send_stats()
+            {'pending': 0, 'held': 2, 'sent': 57, 'failed': 0, 'hold_avg': 0.12, 'hold_max': 0.15}
+        """
+
+        with self.__send_lock:
+            stats = self.__send_stats.copy()
+            stats["pending"] = sum(len(queue) for queue in self.__pending_sends.values())
+
+        hold_total = stats.pop("hold_total")
+        stats["hold_avg"] = hold_total / stats["held"] if stats["held"] else 0.0
+        return stats
+
+    def get_prekey_stats(self) -> Dict[str, int]:
+        """
+        Gets the one-time prekey pool metrics.
+
+        Returns:
+            Dict[str, int]: ``available`` prekeys, ``consumed``, ``generated``, ``refills``,
+            ``publish_requests`` and the bundle ``publishes`` actually sent.
+
+        Example:
+            >>> client.extensions["osmiumnet.omemo"].get_prekey_stats()
+            {'consumed': 80, 'generated': 180, 'refills': 2, 'publish_requests': 81, 'publishes': 3, 'available': 100}
+        """
+
+        return self.__prekeys.stats()
+
+    def get_room_occupants(self, room: str) -> Set[str]:
+        """
+        Gets the real bare JIDs of the room occupants, which group messages are encrypted for.
+        Only occupants whose real JID the room discloses are known.
+
+        Messages of type ``groupchat`` are encrypted for every device of every occupant.
+        The recipients can also be given explicitly with the ``omemo_recipients`` keyword argument.
+
+        Args:
+            room (str): The bare JID of the room.
+
+        Returns:
+            Set[str]: The real bare JIDs.
+
+        Example:
+            >>> client.extensions["osmiumnet.omemo"].get_room_occupants("team@conference.jabber.org")
+            >>> client.send_message("team@conference.jabber.org", "Hello!", type="groupchat")
+            >>> client.send_message("team@conference.jabber.org", "Hello!", type="groupchat", omemo_recipients={"john@jabber.org"})
+        """
+
+        with self.__send_lock:
+            return set(self.__rooms.get(room, {}).values())
+
+    def __publish_bundle(self, excluded: Set[str]):
+        xml = OmemoXml.publish_bundle_information(self.__ci.get_jid(False), self.__bundle, excluded)
+        self.__send_registered_xml(xml, "publish_bundle_information")
+
+    def __on_prekeys_changed(self, consumed: List[str], generated: List[str]):
+        for handler in self.__handlers["on_prekeys_changed"]:
+            handler(consumed, generated)
+
+    def __fetch_devices(self, jid: str):
+        xml = OmemoXml.fetch_devices(self.__ci.get_jid(), jid)
+        with self.__send_lock:
+            self.__fetches[xml.get_attribute_by_name("id").value] = (jid, None)
+        self.__send_registered_xml(xml, "fetch_devices:func")
+
+    def __fetch_missing_bundles(self, jid: str):
+        with self.__send_lock:
+            requested = set()
+            for fetch_jid, devices in self.__fetches.values():
+                if (fetch_jid == jid and devices):
+                    requested.update(devices)
+
+            devices = [
+                device for device in self.__cache.get_missing_bundles(jid)
+                if device not in requested and (jid, device) not in self.__unavailable
+            ]
+            if (not devices):
+                return
+
+            # All missing bundles of the contact are requested at once
+            xml = OmemoXml.fetch_bundles(self.__ci.get_jid(), jid, devices)
+            self.__fetches[xml.get_attribute_by_name("id").value] = (jid, devices)
+
+        self.__send_registered_xml(xml, "fetch_bundles")
+
     def __send_registered_xml(self, xml: XmlElement, name: str):
         self.__register_xml(xml, name)
         self.__ci.send_xml(xml)
@@ -136,266 +464,549 @@ class OmemoExtension(XmppExtension):
     def __on_ready(self):
         pass
 
+    def __on_presence(self, presence: XmlElement):
+        from_attr = presence.get_attribute_by_name("from")
+        if (from_attr is None or "/" not in from_attr.value):
+            return
+
+        real_jid = OmemoXml.parse_muc_user(presence)
+        if (real_jid is None):
+            return
+
+        room, nick = bare_jid(from_attr.value), from_attr.value.partition("/")[2]
+        type_attr = presence.get_attribute_by_name("type")
+
+        with self.__send_lock:
+            if (type_attr and type_attr.value == "unavailable"):
+                occupants = self.__rooms.get(room)
+                if (occupants is not None):
+                    occupants.pop(nick, None)
+                    if (not occupants):
+                        del self.__rooms[room]
+            else:
+                self.__rooms.setdefault(room, {})[nick] = bare_jid(real_jid)
+
+    def __get_sender(self, jid: str) -> str | None:
+        room, nick = bare_jid(jid), jid.partition("/")[2]
+
+        with self.__send_lock:
+            occupants = self.__rooms.get(room)
+            if (occupants is None):
+                return room
+            return occupants.get(nick)
+
     def __on_iq(self, iq):
         is_registered, name = self.__get_xml_registration(iq)
 
         if (not is_registered):
             return
 
+        with self.__send_lock:
+            fetch = self.__fetches.pop(iq.get_attribute_by_name("id").value, None)
+
         if (name == "publish_device:func"):
-            xml = OmemoXml.publish_bundle_information(self.__ci.get_jid(False), self.__bundle)
-            self.__send_registered_xml(xml, "publish_bundle_information")
+            self.__prekeys.publish()
         elif (name == "fetch_devices:func"):
-            self.__parse_devices_response(iq)
-
-            # Fetch bundles for contacts devices that are not cached yet
-            for contact_jid, devices in self.__contact_bundles.items():
-                for contact_device, bundle in self.__contact_bundles[contact_jid].items():
-                    if (bundle == {}):
-                        xml = OmemoXml.fetch_bundles(self.__ci.get_jid(), contact_jid, contact_device)
-                        self.__send_registered_xml(xml, "fetch_bundles")
+            contact_jid = self.__parse_devices_response(iq)
+
+            if (contact_jid is None and fetch):
+                # No device list published, or the fetch failed: messages fail for a while, then fetch again
+                with self.__send_lock:
+                    self.__no_devices[fetch[0]] = time.monotonic() + self.NO_DEVICES_TTL
+
+            # Fetch bundles for contact devices that are not cached yet
+            if (contact_jid):
+                self.__fetch_missing_bundles(contact_jid)
         elif (name == "fetch_bundles"):
-            self.__parse_bundle_response(iq)
+            devices = self.__parse_bundle_response(iq)
+
+            if (fetch):
+                with self.__send_lock:
+                    for device in set(fetch[1]) - set(devices):
+                        self.__unavailable.add((fetch[0], device))
+
+        if (fetch):
+            self.__flush_waiting()
 
     def __hook_on_message(self, message: XmppMessage):
-        final_message = None
+        jid_from = bare_jid(message.from_jid)
 
-        jid_from = message.from_jid.split("/")[0]
-        if (message.encrypted):
-            # Find and store JID keys
-            device_keys = None
-            for jid_keys in message.encrypted.header.xml.children:
-                jid = jid_keys.get_attribute_by_name("jid").value
-                if (self.__ci.get_jid(False) == jid):
-                    device_keys = jid_keys
-                    break
-
-            if (not device_keys):
-                return message
+        # Device lists and bundles are refreshed from PEP notifications
+        event = message.xml.get_child_by_name("event")
+        if (event):
+            self.__process_pep_event(jid_from, event)
 
-            # Find and store that device key
-            device_key = None
-            for key in device_keys.children:
-                rid = key.get_attribute_by_name("rid").value
-                device_rid = self.__bundle.get_device_id()
-                if (device_rid == int(rid)):
-                    device_key = key
-                    break
+        if (not message.encrypted):
+            return message
 
+        if (self.__decrypt_executor is None):
+            return self.__decrypt_message(message)
+
+        # Hold the message back, it is delivered once decrypted
+        self.__enqueue_decryption(jid_from, message)
+        return None
+
+    def __enqueue_decryption(self, jid_from: str, message: XmppMessage):
+        with self.__decrypt_lock:
+            self.__decrypt_stats["queue_depth"] += 1
+
+            queue = self.__decrypt_queues.get(jid_from)
+            if (queue is not None):
+                # The sender is already being drained, keep its order
+                queue.append((message, time.monotonic()))
+                return
+
+            self.__decrypt_queues[jid_from] = deque([(message, time.monotonic())])
+
+        self.__decrypt_executor.submit(self.__drain_decryption, jid_from)
+
+    def __drain_decryption(self, jid_from: str):
+        while True:
+            with self.__decrypt_lock:
+                queue = self.__decrypt_queues[jid_from]
+                if (not queue):
+                    del self.__decrypt_queues[jid_from]
+                    return
+                message, enqueued_at = queue.popleft()
+
+            failed = False
+            try:
+                message = self.__decrypt_message(message)
+            except Exception as e:
+                logger.error(f"Could not decrypt message from '{jid_from}': {e}")
+                failed = True
+
+            with self.__decrypt_lock:
+                latency = time.monotonic() - enqueued_at
+                self.__decrypt_stats["queue_depth"] -= 1
+                self.__decrypt_stats["failed" if failed else "decrypted"] += 1
+                self.__decrypt_stats["latency_total"] += latency
+                self.__decrypt_stats["latency_max"] = max(self.__decrypt_stats["latency_max"], latency)
+
+            try:
+                self.__ci.resume_on_message(self.__message_hook, message)
+            except Exception as e:
+                logger.error(f"Error in message handlers: {e}")
+
+    def __decrypt_message(self, message: XmppMessage) -> XmppMessage:
+        final_message = None
+
+        jid_from = self.__get_sender(message.from_jid)
+        if (jid_from is None):
+            logger.warning(f"Could not decrypt message from '{message.from_jid}', the real JID of the occupant is not known")
+            return message
+
+        if (message.encrypted):
+            # Only our own key is looked up, the keys of other devices are never decoded
+            device_key = OmemoXml.find_key(
+                        message.encrypted.header.xml,
+                        self.__ci.get_jid(False),
+                        self.__bundle.get_device_id()
+            )
             if (not device_key):
                 return message
 
             key_data = device_key.children[0].to_string()
             device_from = int(message.encrypted.header.xml.get_attribute_by_name("sid").value)
 
-            devices = self.__omemo.get_device_list(jid_from)
-            if (type(devices) == list):
-                key_data_js = json.loads(base64.b64decode(key_data).decode('utf-8'))
-
-                wrapped = key_data_js["k"]
-                payload = key_data_js["p"]
-
-                wrapped_key_bytes = base64.b64decode(wrapped.encode("utf-8"))
-                payload_bytes = base64.b64decode(payload.encode("utf-8"))
-
-                de_message = self.__omemo.receive_message(
-                            jid=jid_from, 
-                            device=device_from,
-                            wrapped_message_key=wrapped_key_bytes, 
-                            payload=payload_bytes
-                )
+            payload = message.encrypted.payload
+            kex = device_key.get_attribute_by_name("kex")
+            if (not kex or kex.value != "true"):
+                wrapped_key_bytes, payload_key_bytes = OmemoKeyEncoding.decode_key(key_data)
+
+                with self.__session_lock(jid_from, device_from):
+                    de_message = self.__omemo.receive_message(
+                                jid=jid_from, 
+                                device=device_from,
+                                wrapped_message_key=wrapped_key_bytes, 
+                                payload=payload_key_bytes
+                    )
 
                 final_massage = message
-                final_massage.body = de_message.decode("utf-8")
+                final_massage.body = self.__open_payload(de_message, payload)
             else:
-                de_message = self.__receive_init_message(jid_from, device_from, key_data)
+                with self.__session_lock(jid_from, device_from):
+                    de_message = self.__receive_init_message(jid_from, device_from, key_data)
 
                 if (de_message):
                     final_massage = message
-                    final_massage.body = de_message
+                    final_massage.body = self.__open_payload(de_message, payload)
 
         return final_message if final_message else message 
 
-    def __hook_send_message(self, message: XmppMessage):
-        final_message = None
+    def __hook_send_message(self, message: XmppMessage, *args, **kwargs):
+        if (message.body is None):
+            return message
+
+        jid_to = bare_jid(message.to_jid)
+        recipients = self.__get_recipients(message, kwargs)
+
+        # A held message is sent later, in the trace of the send that held it
+        tracer = self.__ci.get_tracer()
+        span = tracer.current() if tracer is not None else None
+
+        with self.__send_lock:
+            queue = self.__pending_sends.get(jid_to)
+            if (queue is not None):
+                # Keep the order behind the held messages
+                queue.append((message, time.monotonic(), args, kwargs, span))
+                self.__ci.mark_send_held()
+                return None
+
+            missing = {jid: self.__get_missing(jid) for jid in recipients}
+            hold = any(kind in ("devices", "bundles") for kind in missing.values())
+            if (hold):
+                # Hold the message back, it is sent once the bundles arrive
+                self.__pending_sends[jid_to] = deque([(message, time.monotonic(), args, kwargs, span)])
+
+                timer = threading.Timer(self.__init_timeout, self.__flush_pending, args=(jid_to, True))
+                timer.daemon = True
+                self.__pending_timers[jid_to] = timer
+                timer.start()
+
+        for jid, kind in missing.items():
+            if (kind in ("devices", "refresh")):
+                self.__fetch_devices(jid)
+            elif (kind == "bundles"):
+                self.__fetch_missing_bundles(jid)
+
+        if (hold):
+            logger.debug(f"Holding message to '{jid_to}' until the bundles of its recipients arrive")
+            self.__ci.mark_send_held()
+            return None
+
+        # Sent here, like a held message, so that no other message is encrypted before it is written
+        self.__send_encrypted(message, recipients, None, args, kwargs)
+        return None
+
+    def __send_encrypted(self, message: XmppMessage, recipients: Set[str], held: float | None, args: Tuple, kwargs: Dict):
+        tracer = self.__ci.get_tracer()
+        with contextlib.ExitStack() as stack:
+            # Taken in the same order by every sender, two messages can't wait on each other
+            for lock in self.__recipient_locks_of(recipients):
+                stack.enter_context(lock)
+
+            if (tracer is not None):
+                with tracer.span("omemo encrypt", {"to": message.to_jid, "recipients": len(recipients), "held": held}):
+                    message = self.__encrypt_message(message, recipients, held)
+            else:
+                message = self.__encrypt_message(message, recipients, held)
+            if (message):
+                self.__ci.resume_send_message(self.__send_hook, message, *args, **kwargs)
 
-        jid_to = message.to_jid.split("/")[0]
-        body = message.body
-        encrypted_message = None
+    def __get_recipients(self, message: XmppMessage, kwargs: Dict) -> Set[str]:
+        # An explicit set of bare JIDs, e.g. the members of a private room
+        recipients = kwargs.get("omemo_recipients")
+        if (recipients is not None):
+            return {bare_jid(jid) for jid in recipients}
 
-        devices = self.__omemo.get_device_list(jid_to)
-        if (type(devices) == list):
-            xml_keys = XmlElement("keys", [XmlAttribute("jid", jid_to)])
-            payload = ""
-            for device in devices:
-                wrapped_key_bytes, payload_bytes = self.__omemo.send_message(
-                            jid=jid_to,
-                            device=device,
-                            message_bytes=body.encode("utf-8")
-                )
+        jid_to = bare_jid(message.to_jid)
 
-                wrapped = base64.b64encode(wrapped_key_bytes).decode("utf-8")
-                payload = base64.b64encode(payload_bytes).decode("utf-8")
+        type_attr = message.xml.get_attribute_by_name("type")
+        if (type_attr and type_attr.value == "groupchat"):
+            with self.__send_lock:
+                return set(self.__rooms.get(jid_to, {}).values())
 
-                key_data_blob = json.dumps({
-                    "k": wrapped,
-                    "p": payload
-                }).encode('utf-8')
+        return {jid_to}
 
-                key_data = base64.b64encode(key_data_blob).decode('utf-8')
+    def __get_missing(self, jid_to: str) -> str | None:
+        sessions = self.__omemo.get_device_list(jid_to) or []
 
-                xml_keys.add_child(
-                    XmlElement(
-                        "key", 
-                        [XmlAttribute("rid", device)],
-                        [XmlTextElement(key_data)]
-                    )
-                )
+        fetching = any(fetch_jid == jid_to for fetch_jid, _ in self.__fetches.values())
 
-            encrypted_message = OmemoXml.send_message(
-                        self.__ci.get_jid(),
-                        jid_to,
-                        self.__bundle.get_device_id(),
-                        [xml_keys]
-            )
-        elif (devices is None):
-            encrypted_message = self.__send_init_message(jid_to, body)
+        devices = self.__cache.get_devices(jid_to)
+        if (devices is None):
+            if (sessions):
+                # Known sessions are enough, new devices are picked up in the background
+                return None if fetching else "refresh"
+            if (self.__no_devices.get(jid_to, 0) > time.monotonic()):
+                return None
+            self.__no_devices.pop(jid_to, None)
+            return "devices"
 
-        if (encrypted_message):
-            if (not final_message):
-                final_message = message
-            # Wrap encrypted message into message
-            final_message.xml.add_child(encrypted_message.get_child_by_name("encrypted"))
-            final_message.xml.remove_child_by_name("body")
-            final_message.xml.add_child(encrypted_message.get_child_by_name("body"))
+        if (fetching):
+            return "bundles"
 
-        return final_message if final_message else message 
+        for device in devices:
+            if (device in sessions or (jid_to, device) in self.__unavailable):
+                continue
+            if (self.__cache.get_bundle(jid_to, device) is None):
+                return "bundles"
+
+        return None
+
+    def __flush_waiting(self):
+        with self.__send_lock:
+            jids = list(self.__pending_sends)
+
+        for jid_to in jids:
+            self.__flush_pending(jid_to)
+
+    def __flush_pending(self, jid_to: str, timeout: bool = False):
+        with self.__send_lock:
+            if (jid_to not in self.__pending_sends or jid_to in self.__flushing):
+                return
+
+            recipients = set()
+            for message, _, _, kwargs, _ in self.__pending_sends[jid_to]:
+                recipients |= self.__get_recipients(message, kwargs)
+
+            if (not timeout):
+                for fetch_jid, _ in self.__fetches.values():
+                    if (fetch_jid in recipients):
+                        return
+            else:
+                logger.warning(f"Timed out waiting for the bundles of the recipients of '{jid_to}'")
+
+                # Late responses are still cached, but nothing waits for them anymore
+                for request_id, (fetch_jid, _) in list(self.__fetches.items()):
+                    if (fetch_jid in recipients):
+                        del self.__fetches[request_id]
+
+            timer = self.__pending_timers.pop(jid_to, None)
+            self.__flushing.add(jid_to)
+
+        if (timer):
+            timer.cancel()
+
+        # Messages held meanwhile are appended to the queue, drain it in order
+        while True:
+            with self.__send_lock:
+                queue = self.__pending_sends[jid_to]
+                if (not queue):
+                    del self.__pending_sends[jid_to]
+                    self.__flushing.discard(jid_to)
+                    return
+                message, held_at, args, kwargs, span = queue.popleft()
+
+            tracer = self.__ci.get_tracer()
+            try:
+                with tracer.activate(span) if tracer is not None and span is not None else contextlib.nullcontext():
+                    self.__send_encrypted(message, self.__get_recipients(message, kwargs), time.monotonic() - held_at, args, kwargs)
+            except Exception as e:
+                logger.error(f"Could not send message to '{jid_to}': {e}")
+
+    def __encrypt_message(self, message: XmppMessage, recipients: Set[str], held: float = None) -> XmppMessage | None:
+        jid_to = bare_jid(message.to_jid)
+
+        own_jid = self.__ci.get_jid(False)
+        own_device = self.__bundle.get_device_id()
+
+        # Every (JID, device) pair is keyed once, however many occupants share the JID
+        targets = []
+        for jid in sorted(recipients):
+            sessions = self.__omemo.get_device_list(jid) or []
+            devices = list(sessions)
+            for device in self.__cache.get_devices(jid) or []:
+                if (device not in devices):
+                    devices.append(device)
+
+            for device in devices:
+                if (jid == own_jid and device == own_device):
+                    continue
+
+                if (device in sessions):
+                    targets.append((jid, device, None))
+                    continue
+
+                # Devices without a session get a key exchange in the same message
+                bundle = self.__cache.get_bundle(jid, device)
+                if (bundle is not None):
+                    targets.append((jid, device, bundle))
+
+        if (not targets):
+            with self.__send_lock:
+                self.__send_stats["failed"] += 1
+
+            reason = f"No OMEMO devices of '{jid_to}' are available"
+            logger.warning(reason)
+            for handler in self.__handlers["on_send_failed"]:
+                handler(message, reason)
+            return None
+
+        # Encrypt the body once, wrap only its key for every device
+        message_key, payload_bytes = OmemoPayload.encrypt(message.body.encode("utf-8"))
+
+        xml_keys: Dict[str, XmlElement] = {}
+        for jid, device, kex, key_data in self.__wrap_keys(targets, message_key):
+            if (jid not in xml_keys):
+                xml_keys[jid] = XmlElement("keys", [XmlAttribute("jid", jid)])
+
+            attributes = [XmlAttribute("rid", device)]
+            if (kex):
+                attributes.append(XmlAttribute("kex", "true"))
+            xml_keys[jid].add_child(XmlElement("key", attributes, [XmlTextElement(key_data)]))
+
+        if (self.__flush_storage):
+            self.__flush_storage()
+
+        encrypted_message = OmemoXml.send_message(
+                    self.__ci.get_jid(),
+                    jid_to,
+                    own_device,
+                    list(xml_keys.values()),
+                    base64.b64encode(payload_bytes).decode("utf-8")
+        )
+
+        # Wrap encrypted message into message
+        message.xml.add_child(encrypted_message.get_child_by_name("encrypted"))
+        message.xml.remove_child_by_name("body")
+        message.xml.add_child(encrypted_message.get_child_by_name("body"))
+
+        with self.__send_lock:
+            self.__send_stats["sent"] += 1
+            if (held is not None):
+                self.__send_stats["held"] += 1
+                self.__send_stats["hold_total"] += held
+                self.__send_stats["hold_max"] = max(self.__send_stats["hold_max"], held)
+
+        return message
+
+    def __wrap_keys(self, targets: List[Tuple[str, int, Dict | None]], message_key: bytes) -> List[Tuple[str, int, bool, str]]:
+        def wrap(target: Tuple[str, int, Dict | None]) -> Tuple[str, int, bool, str]:
+            jid, device, bundle = target
+            # Messages sent from several threads must not step the same ratchet at once,
+            # or they would reuse its chain key
+            with self.__session_lock(jid, device):
+                if (bundle is not None):
+                    return jid, device, True, self.__wrap_init_key(jid, device, bundle, message_key)
+
+                wrapped_key_bytes, key_bytes = self.__omemo.send_message(
+                            jid=jid,
+                            device=device,
+                            message_bytes=message_key
+                )
+
+            return jid, device, False, OmemoKeyEncoding.encode_key(wrapped_key_bytes, key_bytes, self.__key_encoding)
+
+        # Ratchets of different devices are independent, so they can step in parallel
+        if (self.__executor and len(targets) > 1):
+            return list(self.__executor.map(wrap, targets))
+        return [wrap(target) for target in targets]
+
+    def __recipient_locks_of(self, recipients: Set[str]) -> List[threading.RLock]:
+        with self.__session_locks_lock:
+            locks = []
+            for jid in sorted(recipients):
+                lock = self.__recipient_locks.get(jid)
+                if (lock is None):
+                    lock = self.__recipient_locks[jid] = threading.RLock()
+                locks.append(lock)
+            return locks
+
+    def __session_lock(self, jid: str, device: int) -> threading.Lock:
+        with self.__session_locks_lock:
+            lock = self.__session_locks.get((jid, device))
+            if (lock is None):
+                lock = self.__session_locks[(jid, device)] = threading.Lock()
+            return lock
+
+    def __open_payload(self, decrypted: bytes, payload: str | None) -> str:
+        # Messages without payload carry the body itself in the key
+        if (not payload or payload == PAYLOAD_PLACEHOLDER):
+            return decrypted.decode("utf-8")
+
+        payload_bytes = base64.b64decode(payload.encode("utf-8"))
+        return OmemoPayload.decrypt(decrypted, payload_bytes).decode("utf-8")
 
     # Parse device information from IQ response
-    def __parse_devices_response(self, iq):
+    def __parse_devices_response(self, iq) -> str | None:
         try:
             # Check if this is a devices response
             pubsub = iq.get_child_by_name("pubsub")
             if (not pubsub):
-                return
-                
-            items = pubsub.get_child_by_name("items")
-            if (not items or items.get_attribute_by_name("node").value != "urn:xmpp:omemo:2:devices"):
-                return
-                
-            item = items.get_child_by_name("item")
-            if (not item):
-                return
+                return None
 
-            devices = item.get_child_by_name("devices")
+            devices = OmemoXml.parse_devices(pubsub.get_child_by_name("items"))
             if (not devices):
-                return
-            
-            contact_jid = iq.get_attribute_by_name("from").value.split("/")[0]
-            if contact_jid not in self.__contact_bundles:
-                self.__contact_bundles[contact_jid] = {}
-
-            for device in devices.children:
-                device_id = int(device.get_attribute_by_name("id").value)
-                self.__contact_bundles[contact_jid][device_id] = {}
+                return None
+
+            contact_jid = bare_jid(iq.get_attribute_by_name("from").value)
+            item_id, device_ids = devices
+            self.__cache.set_devices(contact_jid, device_ids, item_id)
+            self.__no_devices.pop(contact_jid, None)
+            return contact_jid
         except Exception as e:
-            print(f"Error parsing devices: {e}")
+            logger.error(f"Error parsing devices: {e}")
         
     # Parse bundle information from IQ response
-    def __parse_bundle_response(self, iq):
+    def __parse_bundle_response(self, iq) -> List[int]:
+        devices = []
         try:
             # Check if this is a bundle response
             pubsub = iq.get_child_by_name("pubsub")
             if (not pubsub):
-                return
-                
-            items = pubsub.get_child_by_name("items")
-            if (not items or items.get_attribute_by_name("node").value != "urn:xmpp:omemo:2:bundles"):
-                return
-                
-            item = items.get_child_by_name("item")
-            if (not item):
-                return
-                
-            bundle = item.get_child_by_name("bundle")
-            if (not bundle):
-                return
-                
-            # Extract bundle information
-            device_id = int(item.get_attribute_by_name("id").value)
-            contact_jid = iq.get_attribute_by_name("from").value.split("/")[0]
-            
-            bundle_data = {
-                "spk": bundle.get_child_by_name("spk").children[0].to_string().strip(),
-                "spks": bundle.get_child_by_name("spks").children[0].to_string().strip(), 
-                "ik": bundle.get_child_by_name("ik").children[0].to_string().strip(),
-                "opks": {}
-            }
-            
-            prekeys_elem = bundle.get_child_by_name("prekeys")
-            if prekeys_elem:
-                for pk in prekeys_elem.children:
-                    pk_id = pk.get_attribute_by_name("id").value
-                    pk_data = pk.children[0].to_string()
-                    bundle_data["opks"][pk_id] = pk_data
-            
-            # Store the bundle
-            if contact_jid not in self.__contact_bundles:
-                self.__contact_bundles[contact_jid] = {}
-            self.__contact_bundles[contact_jid][device_id] = bundle_data
+                return devices
+
+            # Store the bundles
+            contact_jid = bare_jid(iq.get_attribute_by_name("from").value)
+            for device_id, bundle_data in OmemoXml.parse_bundles(pubsub.get_child_by_name("items")):
+                self.__cache.set_bundle(contact_jid, device_id, bundle_data, str(device_id))
+                devices.append(device_id)
         except Exception as e:
-            print(f"Error parsing bundle: {e}")
-
-
-    def __send_init_message(self, jid_to: str, message: str):
-        if (jid_to in self.__contact_bundles):
-            # TODO: many devices
-            device_to = list(self.__contact_bundles[jid_to].keys())[0]
-            bundle_to = self.__contact_bundles[jid_to][device_to]
-            
-            # Choose random opk id
-            opk_id = random.choice(list(bundle_to["opks"].keys())) 
-
-            ek_pub, en_message = self.__omemo.create_init_message(
-                    jid=jid_to,
-                    device=device_to,
-                    message_bytes=message.encode("utf-8"),
-                    indentity_key=EdKeyPair.base64_to_public_key(bundle_to["ik"]),
-                    signed_prekey=XKeyPair.base64_to_public_key(bundle_to["spk"]),
-                    prekey_signature=base64.b64decode(bundle_to["spks"].encode("utf-8")),
-                    onetime_prekey=XKeyPair.base64_to_public_key(bundle_to["opks"][opk_id])
-            )
-            
-            key_data_blob = json.dumps({
-                "ik": self.__bundle.get_indentity().get_base64_public_key(),
-                "ek": XKeyPair.public_key_to_base64(ek_pub),
-                "spk_id": "0",
-                "opk_id": opk_id,
-                "ct": base64.b64encode(en_message).decode("utf-8") 
-            }).encode('utf-8')
-
-            key_data = base64.b64encode(key_data_blob).decode('utf-8')
-
-            xml_message = OmemoXml.send_init_message(
-                    jid=self.__ci.get_jid(),
-                    jid_to=jid_to,
-                    device=self.__bundle.get_device_id(),
-                    device_to=device_to,
-                    key_data=key_data 
-            )
-            
-            return xml_message
+            logger.error(f"Error parsing bundle: {e}")
+        return devices
 
-    def __receive_init_message(self, jid_from: str, device_from: int, wrapped: str):
+    # Parse device list and bundle PEP notifications
+    def __process_pep_event(self, jid_from: str, event: XmlElement):
+        xmlns = event.get_attribute_by_name("xmlns")
+        if (not xmlns or xmlns.value != "http://jabber.org/protocol/pubsub#event"):
+            return
+
+        try:
+            items = event.get_child_by_name("items")
+
+            devices = OmemoXml.parse_devices(items)
+            if (devices):
+                item_id, device_ids = devices
+                self.__cache.set_devices(jid_from, device_ids, item_id)
+                self.__no_devices.pop(jid_from, None)
+                self.__fetch_missing_bundles(jid_from)
+                return
+
+            bundle = OmemoXml.parse_bundle(items)
+            if (bundle):
+                device_id, bundle_data = bundle
+                self.__cache.set_bundle(jid_from, device_id, bundle_data, str(device_id))
+                with self.__send_lock:
+                    self.__unavailable.discard((jid_from, device_id))
+        except Exception as e:
+            logger.error(f"Error parsing PEP event: {e}")
+
+
+    def __wrap_init_key(self, jid_to: str, device_to: int, bundle_to: Dict, message_key: bytes) -> str:
+        # Choose random opk id
+        opk_id = random.choice(list(bundle_to["opks"].keys())) 
+
+        ek_pub, en_message = self.__omemo.create_init_message(
+                jid=jid_to,
+                device=device_to,
+                message_bytes=message_key,
+                indentity_key=EdKeyPair.base64_to_public_key(bundle_to["ik"]),
+                signed_prekey=XKeyPair.base64_to_public_key(bundle_to["spk"]),
+                prekey_signature=base64.b64decode(bundle_to["spks"].encode("utf-8")),
+                onetime_prekey=XKeyPair.base64_to_public_key(bundle_to["opks"][opk_id])
+        )
+
+        return OmemoKeyEncoding.encode_key_exchange(
+                ik=EdKeyPair.public_key_to_bytes(self.__bundle.get_indentity().get_public_key()),
+                ek=XKeyPair.public_key_to_bytes(ek_pub),
+                spk_id="0",
+                opk_id=opk_id,
+                ct=en_message,
+                encoding=self.__key_encoding
+        )
+
+    def __receive_init_message(self, jid_from: str, device_from: int, wrapped: str) -> bytes | None:
         message = None
-        if (jid_from in self.__contact_bundles):
-            key_data_js = json.loads(base64.b64decode(wrapped).decode('utf-8'))
+        if (wrapped):
+            key_exchange = OmemoKeyEncoding.decode_key_exchange(wrapped)
 
-            en_message = base64.b64decode(key_data_js["ct"].encode("utf-8"))
-            indentity_key = EdKeyPair.base64_to_public_key(key_data_js["ik"])
-            ephemeral_key = XKeyPair.base64_to_public_key(key_data_js["ek"])
-            spk_id = key_data_js["spk_id"]
-            opk_id = key_data_js["opk_id"]
+            en_message = key_exchange["ct"]
+            indentity_key = Ed25519PublicKey.from_public_bytes(key_exchange["ik"])
+            ephemeral_key = X25519PublicKey.from_public_bytes(key_exchange["ek"])
+            spk_id = key_exchange["spk_id"]
+            opk_id = key_exchange["opk_id"]
 
             de_message = self.__omemo.accept_init_message(
                     jid=jid_from,
@@ -407,7 +1018,10 @@ class OmemoExtension(XmppExtension):
                     opk_id=opk_id
             )
 
-            message = de_message.decode("utf-8")
+            message = de_message
+
+            # The prekey can't be used again, contacts get a bundle without it
+            self.__prekeys.consume(opk_id)
 
         return message
 
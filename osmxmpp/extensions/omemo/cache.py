@@ -0,0 +1,250 @@
+import json
+import time
+import sqlite3
+import threading
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+
+class OmemoCache(ABC):
+    """
+    Cache of contacts device lists and bundles.
+
+    Every entry is stored with the pubsub item ID it came from and the time it was stored,
+    so it can be refreshed from PEP notifications instead of being fetched again.
+
+    Attributes:
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups not answered from the cache.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get_devices(self, jid: str) -> List[int] | None:
+        """
+        Gets the cached device list of the JID.
+
+        Args:
+            jid (str): The bare JID.
+
+        Returns:
+            List[int] | None: The device IDs, None if not cached.
+        """
+        ...
+
+    @abstractmethod
+    def set_devices(self, jid: str, devices: List[int], item_id: str = None, timestamp: float = None) -> None:
+        """
+        Stores the device list of the JID.
+        Bundles of devices that are no longer listed are removed.
+
+        Args:
+            jid (str): The bare JID.
+            devices (List[int]): The device IDs.
+            item_id (str): The pubsub item ID. (Default: None)
+            timestamp (float): The time the list was received. (Default: now)
+        """
+        ...
+
+    @abstractmethod
+    def get_bundle(self, jid: str, device: int) -> Dict | None:
+        """
+        Gets the cached bundle of the device.
+
+        Args:
+            jid (str): The bare JID.
+            device (int): The device ID.
+
+        Returns:
+            Dict | None: The bundle data, None if not cached.
+        """
+        ...
+
+    @abstractmethod
+    def set_bundle(self, jid: str, device: int, bundle: Dict, item_id: str = None, timestamp: float = None) -> None:
+        """
+        Stores the bundle of the device.
+
+        Args:
+            jid (str): The bare JID.
+            device (int): The device ID.
+            bundle (Dict): The bundle data.
+            item_id (str): The pubsub item ID. (Default: None)
+            timestamp (float): The time the bundle was received. (Default: now)
+        """
+        ...
+
+    @abstractmethod
+    def get_item(self, jid: str, device: int = None) -> Tuple[str, float] | None:
+        """
+        Gets the pubsub item ID and timestamp of the cached device list, or bundle if device is given.
+
+        Args:
+            jid (str): The bare JID.
+            device (int): The device ID. (Default: None)
+
+        Returns:
+            Tuple[str, float] | None: The item ID and timestamp, None if not cached.
+        """
+        ...
+
+    def get_missing_bundles(self, jid: str) -> List[int]:
+        """
+        Gets the devices of the JID whose bundles are not cached.
+
+        Args:
+            jid (str): The bare JID.
+
+        Returns:
+            List[int]: The device IDs.
+        """
+
+        devices = self.get_devices(jid) or []
+        return [device for device in devices if self.get_bundle(jid, device) is None]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the cache counters.
+
+        Returns:
+            Dict[str, int]: The ``hits`` and ``misses`` counters.
+        """
+
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _record(self, value):
+        if (value is None):
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+class MemoryOmemoCache(OmemoCache):
+    """
+    In-memory cache of contacts device lists and bundles. Lost on restart.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # jid -> (item id, timestamp, devices)
+        self.__devices: Dict[str, Tuple[str, float, List[int]]] = {}
+        # (jid, device) -> (item id, timestamp, bundle)
+        self.__bundles: Dict[Tuple[str, int], Tuple[str, float, Dict]] = {}
+
+        self.__lock = threading.Lock()
+
+    def get_devices(self, jid):
+        entry = self.__devices.get(jid)
+        return self._record(list(entry[2]) if entry else None)
+
+    def set_devices(self, jid, devices, item_id=None, timestamp=None):
+        with self.__lock:
+            old_entry = self.__devices.get(jid)
+            self.__devices[jid] = (item_id, timestamp or time.time(), list(devices))
+
+            if (old_entry):
+                for device in set(old_entry[2]) - set(devices):
+                    self.__bundles.pop((jid, device), None)
+
+    def get_bundle(self, jid, device):
+        entry = self.__bundles.get((jid, device))
+        return self._record(entry[2] if entry else None)
+
+    def set_bundle(self, jid, device, bundle, item_id=None, timestamp=None):
+        with self.__lock:
+            self.__bundles[(jid, device)] = (item_id, timestamp or time.time(), bundle)
+
+    def get_item(self, jid, device=None):
+        entry = self.__devices.get(jid) if device is None else self.__bundles.get((jid, device))
+        return (entry[0], entry[1]) if entry else None
+
+    def __len__(self):
+        return len(self.__devices) + len(self.__bundles)
+
+
+class SqliteOmemoCache(OmemoCache):
+    """
+    SQLite cache of contacts device lists and bundles, kept across restarts.
+    Can share the database file with the OMEMO storage.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS omemo_cache_devices ("
+                "jid TEXT PRIMARY KEY, item_id TEXT, timestamp REAL, devices TEXT)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS omemo_cache_bundles ("
+                "jid TEXT, device INTEGER, item_id TEXT, timestamp REAL, bundle TEXT, "
+                "PRIMARY KEY (jid, device))"
+            )
+
+    def get_devices(self, jid):
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT devices FROM omemo_cache_devices WHERE jid = ?", (jid,)
+            ).fetchone()
+        return self._record(json.loads(row[0]) if row else None)
+
+    def set_devices(self, jid, devices, item_id=None, timestamp=None):
+        devices = list(devices)
+        placeholders = ", ".join("?" for _ in devices)
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO omemo_cache_devices VALUES (?, ?, ?, ?)",
+                (jid, item_id, timestamp or time.time(), json.dumps(devices))
+            )
+            self.__connection.execute(
+                f"DELETE FROM omemo_cache_bundles WHERE jid = ? AND device NOT IN ({placeholders})",
+                (jid, *devices)
+            )
+
+    def get_bundle(self, jid, device):
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT bundle FROM omemo_cache_bundles WHERE jid = ? AND device = ?", (jid, device)
+            ).fetchone()
+        return self._record(json.loads(row[0]) if row else None)
+
+    def set_bundle(self, jid, device, bundle, item_id=None, timestamp=None):
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO omemo_cache_bundles VALUES (?, ?, ?, ?, ?)",
+                (jid, device, item_id, timestamp or time.time(), json.dumps(bundle))
+            )
+
+    def get_item(self, jid, device=None):
+        with self.__lock:
+            if (device is None):
+                row = self.__connection.execute(
+                    "SELECT item_id, timestamp FROM omemo_cache_devices WHERE jid = ?", (jid,)
+                ).fetchone()
+            else:
+                row = self.__connection.execute(
+                    "SELECT item_id, timestamp FROM omemo_cache_bundles WHERE jid = ? AND device = ?", (jid, device)
+                ).fetchone()
+        return tuple(row) if row else None
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,191 @@
+import json
+import base64
+
+from typing import Dict, Tuple
+
+
+class OmemoKeyEncoding:
+    """
+    Encoding of the ``<key>`` element contents.
+
+    ``json`` is the original encoding: a JSON object with base64 fields, base64-encoded again.
+    ``binary`` follows the XEP-0384 protobuf layout and is base64-encoded once:
+
+    - key: ``OMEMOAuthenticatedMessage`` with the wrapped key (1) and the key payload (2).
+    - key exchange: ``OMEMOKeyExchange`` with the one-time prekey ID (1), the signed prekey ID (2),
+      the raw identity key (3), the raw ephemeral key (4) and the encrypted message (5).
+
+    Both are always accepted on receive, JSON content starts with ``{``. The encoding does
+    not make messages readable by older versions, see :class:`OmemoExtension`.
+    """
+
+    JSON = "json"
+    BINARY = "binary"
+
+    @staticmethod
+    def encode_key(wrapped: bytes, payload: bytes, encoding: str = JSON) -> str:
+        """
+        Encodes a message key.
+
+        Args:
+            wrapped (bytes): The wrapped message key.
+            payload (bytes): The key payload.
+            encoding (str): ``json`` or ``binary``. (Default: ``json``)
+
+        Returns:
+            str: The ``<key>`` element text.
+        """
+
+        if (encoding == OmemoKeyEncoding.BINARY):
+            data = _field_bytes(1, wrapped) + _field_bytes(2, payload)
+        else:
+            data = json.dumps({
+                "k": base64.b64encode(wrapped).decode("utf-8"),
+                "p": base64.b64encode(payload).decode("utf-8")
+            }).encode("utf-8")
+
+        return base64.b64encode(data).decode("utf-8")
+
+    @staticmethod
+    def decode_key(key_data: str) -> Tuple[bytes, bytes]:
+        """
+        Decodes a message key.
+
+        Args:
+            key_data (str): The ``<key>`` element text.
+
+        Returns:
+            Tuple[bytes, bytes]: The wrapped message key and the key payload.
+        """
+
+        data = base64.b64decode(key_data)
+        if (data[:1] == b"{"):
+            key_data_js = json.loads(data.decode("utf-8"))
+            return base64.b64decode(key_data_js["k"]), base64.b64decode(key_data_js["p"])
+
+        fields = _parse_fields(data)
+        return fields[1], fields[2]
+
+    @staticmethod
+    def encode_key_exchange(
+                ik: bytes,
+                ek: bytes,
+                spk_id: str,
+                opk_id: str,
+                ct: bytes,
+                encoding: str = JSON,
+            ) -> str:
+        """
+        Encodes a key exchange.
+
+        Args:
+            ik (bytes): The raw sender identity key.
+            ek (bytes): The raw ephemeral key.
+            spk_id (str): The used signed prekey ID.
+            opk_id (str): The used one-time prekey ID.
+            ct (bytes): The encrypted message.
+            encoding (str): ``json`` or ``binary``. (Default: ``json``)
+
+        Returns:
+            str: The ``<key kex="true">`` element text.
+        """
+
+        if (encoding == OmemoKeyEncoding.BINARY):
+            data = (
+                _field_id(1, opk_id)
+                + _field_id(2, spk_id)
+                + _field_bytes(3, ik)
+                + _field_bytes(4, ek)
+                + _field_bytes(5, ct)
+            )
+        else:
+            data = json.dumps({
+                "ik": base64.b64encode(ik).decode("utf-8"),
+                "ek": base64.b64encode(ek).decode("utf-8"),
+                "spk_id": spk_id,
+                "opk_id": opk_id,
+                "ct": base64.b64encode(ct).decode("utf-8")
+            }).encode("utf-8")
+
+        return base64.b64encode(data).decode("utf-8")
+
+    @staticmethod
+    def decode_key_exchange(key_data: str) -> Dict[str, bytes | str]:
+        """
+        Decodes a key exchange.
+
+        Args:
+            key_data (str): The ``<key kex="true">`` element text.
+
+        Returns:
+            Dict[str, bytes | str]: The raw ``ik``, ``ek`` and ``ct``, and the ``spk_id`` and ``opk_id``.
+        """
+
+        data = base64.b64decode(key_data)
+        if (data[:1] == b"{"):
+            key_data_js = json.loads(data.decode("utf-8"))
+            return {
+                "ik": base64.b64decode(key_data_js["ik"]),
+                "ek": base64.b64decode(key_data_js["ek"]),
+                "spk_id": key_data_js["spk_id"],
+                "opk_id": key_data_js["opk_id"],
+                "ct": base64.b64decode(key_data_js["ct"]),
+            }
+
+        fields = _parse_fields(data)
+        return {
+            "ik": fields[3],
+            "ek": fields[4],
+            "spk_id": str(fields[2]) if isinstance(fields[2], int) else fields[2].decode("utf-8"),
+            "opk_id": str(fields[1]) if isinstance(fields[1], int) else fields[1].decode("utf-8"),
+            "ct": fields[5],
+        }
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while (value > 0x7f):
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _field_bytes(number: int, value: bytes) -> bytes:
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+def _field_id(number: int, value: str) -> bytes:
+    # Prekey IDs are uint32 in XEP-0384, other IDs are kept as strings
+    if (value.isdigit() and str(int(value)) == value):
+        return _varint(number << 3) + _varint(int(value))
+    return _field_bytes(number, value.encode("utf-8"))
+
+def _parse_fields(data: bytes) -> Dict[int, bytes | int]:
+    fields = {}
+    position = 0
+    length = len(data)
+
+    while (position < length):
+        tag, position = _read_varint(data, position)
+        number, wire_type = tag >> 3, tag & 0x07
+
+        if (wire_type == 0):
+            fields[number], position = _read_varint(data, position)
+        elif (wire_type == 2):
+            size, position = _read_varint(data, position)
+            fields[number] = data[position:position + size]
+            position += size
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+
+    return fields
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if (not byte & 0x80):
+            return value, position
+        shift += 7
@@ -0,0 +1,49 @@
+import os
+
+from typing import Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class OmemoPayload:
+    """
+    Message payload encryption.
+
+    The payload is encrypted once with a random per-message key,
+    and only that key is wrapped for every recipient device.
+    """
+
+    KEY_SIZE = 32
+    NONCE_SIZE = 12
+
+    @staticmethod
+    def encrypt(message_bytes: bytes) -> Tuple[bytes, bytes]:
+        """
+        Encrypts the message with a new per-message key.
+
+        Args:
+            message_bytes (bytes): The message to encrypt.
+
+        Returns:
+            Tuple[bytes, bytes]: The per-message key and the encrypted payload.
+        """
+
+        key = AESGCM.generate_key(bit_length=OmemoPayload.KEY_SIZE * 8)
+        nonce = os.urandom(OmemoPayload.NONCE_SIZE)
+        return key, nonce + AESGCM(key).encrypt(nonce, message_bytes, None)
+
+    @staticmethod
+    def decrypt(key: bytes, payload: bytes) -> bytes:
+        """
+        Decrypts the payload with the per-message key.
+
+        Args:
+            key (bytes): The per-message key.
+            payload (bytes): The encrypted payload.
+
+        Returns:
+            bytes: The decrypted message.
+        """
+
+        nonce, ct = payload[:OmemoPayload.NONCE_SIZE], payload[OmemoPayload.NONCE_SIZE:]
+        return AESGCM(key).decrypt(nonce, ct, None)
@@ -0,0 +1,172 @@
+import threading
+
+from typing import Callable, Dict, List, Set
+
+from osmomemo import OmemoBundle, XKeyPair
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class OmemoPrekeyManager:
+    """
+    One-time prekey pool of the own bundle.
+
+    Prekeys used by incoming key exchanges are left out of the next published bundle, their
+    private keys are kept until the publish after that, for contacts still using the old bundle.
+    When fewer than ``low_water`` are left, the pool is refilled to ``pool_size`` in one batch.
+    Bundle republishes are debounced, so a burst of new sessions causes a single publish.
+
+    Attributes:
+        low_water (int): The number of prekeys below which the pool is refilled. (Default: 25)
+        pool_size (int): The number of prekeys the pool is refilled to. (Default: 100)
+        publish_delay (float): The number of seconds republishes are collected for. (Default: 1.0)
+    """
+
+    def __init__(self, low_water: int = 25, pool_size: int = 100, publish_delay: float = 1.0):
+        if (pool_size <= low_water):
+            raise ValueError("pool_size must be greater than low_water")
+
+        self.__low_water = low_water
+        self.__pool_size = pool_size
+        self.__publish_delay = publish_delay
+
+        self.__bundle: OmemoBundle = None
+        self.__publish: Callable = None
+        self.__changed: Callable = None
+
+        # Consumed since the last publish, and left out of the last publish
+        self.__consumed: Set[str] = set()
+        self.__retired: Set[str] = set()
+
+        # The highest prekey ID seen, removed ones included
+        self.__last_id = -1
+
+        self.__timer: threading.Timer | None = None
+        self.__lock = threading.RLock()
+
+        self.__stats = {
+            "consumed": 0,
+            "generated": 0,
+            "refills": 0,
+            "publish_requests": 0,
+            "publishes": 0,
+        }
+
+    def _connect(self, bundle: OmemoBundle, publish: Callable, changed: Callable):
+        self.__bundle = bundle
+        self.__publish = publish
+        self.__changed = changed
+
+    def consume(self, opk_id: str):
+        """
+        Removes a prekey used by an incoming key exchange, refilling the pool if needed.
+
+        Args:
+            opk_id (str): The prekey ID.
+        """
+
+        with self.__lock:
+            if (opk_id in self.__consumed or opk_id in self.__retired):
+                return
+            if (opk_id not in self.__bundle.get_onetime_prekeys()):
+                return
+
+            self.__consumed.add(opk_id)
+            self.__stats["consumed"] += 1
+            generated = self.__refill() if self.__available() < self.__low_water else []
+
+        self.__changed([opk_id], generated)
+        self.request_publish()
+
+    def ensure(self) -> bool:
+        """
+        Refills the pool if it is below the low-water mark.
+
+        Returns:
+            bool: True if prekeys were generated, False otherwise.
+        """
+
+        with self.__lock:
+            if (self.__available() >= self.__low_water):
+                return False
+            generated = self.__refill()
+
+        self.__changed([], generated)
+        return True
+
+    def request_publish(self):
+        """
+        Schedules a bundle publish. Requests made before it is sent are merged into it.
+        """
+
+        with self.__lock:
+            self.__stats["publish_requests"] += 1
+            if (self.__timer is not None):
+                return
+
+            self.__timer = threading.Timer(self.__publish_delay, self.publish)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def publish(self):
+        """
+        Publishes the bundle now, cancelling the scheduled publish.
+        """
+
+        with self.__lock:
+            if (self.__timer is not None):
+                self.__timer.cancel()
+                self.__timer = None
+
+            # Contacts had a whole publish to see the retired prekeys are gone
+            prekeys = self.__bundle.get_onetime_prekeys()
+            for opk_id in self.__retired:
+                prekeys.pop(opk_id, None)
+                if (opk_id.isdigit()):
+                    self.__last_id = max(self.__last_id, int(opk_id))
+
+            self.__retired = self.__consumed
+            self.__consumed = set()
+
+            # The bundle is serialized under the lock, so it never changes meanwhile
+            self.__stats["publishes"] += 1
+            self.__publish(self.__retired)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the pool counters.
+
+        Returns:
+            Dict[str, int]: ``available`` prekeys, ``consumed``, ``generated``, ``refills``,
+            ``publish_requests`` and the bundle ``publishes`` actually sent.
+        """
+
+        with self.__lock:
+            stats = self.__stats.copy()
+            stats["available"] = self.__available()
+        return stats
+
+    def __available(self) -> int:
+        return len(self.__bundle.get_onetime_prekeys()) - len(self.__consumed) - len(self.__retired)
+
+    def __refill(self) -> List[str]:
+        prekeys = self.__bundle.get_onetime_prekeys()
+
+        # IDs are never reused, a reused ID could match a stale bundle of a contact
+        next_id = max([int(opk_id) for opk_id in prekeys if opk_id.isdigit()] + [self.__last_id]) + 1
+
+        generated = []
+        for opk_id in range(next_id, next_id + self.__pool_size - self.__available()):
+            prekeys[str(opk_id)] = XKeyPair.generate()
+            generated.append(str(opk_id))
+
+        self.__stats["generated"] += len(generated)
+        self.__stats["refills"] += 1
+        if (generated):
+            self.__last_id = int(generated[-1])
+
+        logger.debug(f"Generated {len(generated)} one-time prekeys")
+        return generated
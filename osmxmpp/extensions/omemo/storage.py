@@ -0,0 +1,264 @@
+import time
+import atexit
+import base64
+import sqlite3
+import threading
+
+from typing import Dict, List, Set, Tuple
+
+from osmomemo.storage import OmemoStorage
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class OmemoSessionState:
+    """
+    Session state of a contact device, as returned by ``SqliteOmemoStorage.get_session``.
+
+    Attributes:
+        timestamp (float): The time the session was created.
+        receive_secret_key (str): The base64 receiving chain key.
+        send_secret_key (str): The base64 sending chain key.
+        receive_nonce (str): The base64 receiving nonce.
+        send_nonce (str): The base64 sending nonce.
+    """
+
+    __slots__ = ("timestamp", "receive_secret_key", "send_secret_key", "receive_nonce", "send_nonce")
+
+    def __init__(self, timestamp: float, receive_secret_key: str, send_secret_key: str, receive_nonce: str, send_nonce: str):
+        self.timestamp = timestamp
+        self.receive_secret_key = receive_secret_key
+        self.send_secret_key = send_secret_key
+        self.receive_nonce = receive_nonce
+        self.send_nonce = send_nonce
+
+    def copy(self) -> "OmemoSessionState":
+        return OmemoSessionState(
+            self.timestamp,
+            self.receive_secret_key,
+            self.send_secret_key,
+            self.receive_nonce,
+            self.send_nonce
+        )
+
+    def __repr__(self):
+        return f"<OmemoSessionState timestamp={self.timestamp!r}>"
+
+
+class SqliteOmemoStorage(OmemoStorage):
+    """
+    SQLite OMEMO sessions storage in WAL mode, a drop-in replacement of ``OmemoStorage``.
+
+    Sessions are kept in memory and every ratchet step only marks them dirty.
+    Dirty sessions are written in a single transaction every ``commit_interval``
+    seconds, or on ``flush``. A crash loses at most the steps of the last interval,
+    the database itself always holds the last committed state.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+        commit_interval (float): The number of seconds writes are grouped for. 0 commits every write. (Default: 1.0)
+    """
+
+    def __init__(self, path: str, commit_interval: float = 1.0):
+        # The SQLAlchemy engine of OmemoStorage is not used
+        self.__path = path
+        self.__commit_interval = commit_interval
+
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS omemo_devices ("
+                "jid TEXT, device INTEGER, PRIMARY KEY (jid, device))"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS omemo_sessions ("
+                "jid TEXT, device INTEGER, timestamp REAL, "
+                "receive_secret_key TEXT, send_secret_key TEXT, receive_nonce TEXT, send_nonce TEXT, "
+                "PRIMARY KEY (jid, device))"
+            )
+
+        # jid -> device -> session state, None until the session is added
+        self.__sessions: Dict[str, Dict[int, OmemoSessionState | None]] = {}
+        self.__dirty_devices: Set[Tuple[str, int]] = set()
+        self.__dirty_sessions: Set[Tuple[str, int]] = set()
+
+        self.__lock = threading.RLock()
+        self.__timer: threading.Timer | None = None
+        self.__closed = False
+
+        self.__stats = {
+            "writes": 0,
+            "commits": 0,
+        }
+
+        self.__load()
+
+        # Writes of the last interval are not lost on a normal exit
+        atexit.register(self.flush)
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def add_device(self, jid: str, device: int) -> None:
+        with self.__lock:
+            devices = self.__sessions.setdefault(jid, {})
+            if (device in devices):
+                return
+            devices[device] = None
+            self.__dirty_devices.add((jid, device))
+            self.__write()
+
+    def add_session(
+                self,
+                jid: str,
+                device: int,
+                receive_secret_key: str,
+                send_secret_key: str,
+                receive_nonce: str,
+                send_nonce: str,
+            ) -> None:
+        with self.__lock:
+            devices = self.__sessions.get(jid)
+            if (devices is None or device not in devices):
+                raise Exception("Thas JID or device does not exist in the database.")
+
+            devices[device] = OmemoSessionState(
+                time.time(),
+                receive_secret_key,
+                send_secret_key,
+                receive_nonce,
+                send_nonce
+            )
+            self.__dirty_sessions.add((jid, device))
+            self.__write()
+
+    def get_device_list(self, jid: str) -> List[int]:
+        with self.__lock:
+            devices = self.__sessions.get(jid)
+            if (devices is None):
+                raise Exception("That JID does not exist in the database.")
+            return list(devices)
+
+    def get_session(self, jid: str, device: int) -> OmemoSessionState | None:
+        with self.__lock:
+            devices = self.__sessions.get(jid)
+            if (devices is None or device not in devices):
+                raise Exception("Thas JID or device does not exist in the database.")
+
+            session = devices[device]
+            return session.copy() if session else None
+
+    def set_receive_nonce(self, jid: str, device: int, nonce: str) -> None:
+        self.__update(jid, device, "receive_nonce", nonce)
+
+    def set_send_nonce(self, jid: str, device: int, nonce: str | bytes) -> None:
+        # Omemo passes the raw nonce here, the column always holds base64
+        if (isinstance(nonce, bytes)):
+            nonce = base64.b64encode(nonce).decode("utf-8")
+        self.__update(jid, device, "send_nonce", nonce)
+
+    def update_receive_secret(self, jid: str, device: int, secret: str):
+        self.__update(jid, device, "receive_secret_key", secret)
+
+    def update_send_secret(self, jid: str, device: int, secret: str):
+        self.__update(jid, device, "send_secret_key", secret)
+
+    def flush(self):
+        """
+        Commits the pending writes now.
+        """
+
+        with self.__lock:
+            if (self.__timer is not None):
+                self.__timer.cancel()
+                self.__timer = None
+
+            if (self.__closed or not (self.__dirty_devices or self.__dirty_sessions)):
+                return
+
+            devices = [(jid, device) for jid, device in self.__dirty_devices]
+            sessions = []
+            for jid, device in self.__dirty_sessions:
+                session = self.__sessions[jid][device]
+                sessions.append((
+                    jid,
+                    device,
+                    session.timestamp,
+                    session.receive_secret_key,
+                    session.send_secret_key,
+                    session.receive_nonce,
+                    session.send_nonce,
+                ))
+
+            with self.__connection:
+                self.__connection.executemany("INSERT OR IGNORE INTO omemo_devices VALUES (?, ?)", devices)
+                self.__connection.executemany("INSERT OR REPLACE INTO omemo_sessions VALUES (?, ?, ?, ?, ?, ?, ?)", sessions)
+
+            self.__dirty_devices.clear()
+            self.__dirty_sessions.clear()
+            self.__stats["commits"] += 1
+
+    def close(self):
+        """
+        Commits the pending writes and closes the database connection.
+        """
+
+        with self.__lock:
+            self.flush()
+            self.__closed = True
+            self.__connection.close()
+
+        atexit.unregister(self.flush)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the storage counters.
+
+        Returns:
+            Dict[str, int]: The ``writes`` (session changes), ``commits`` (transactions) and ``pending`` (uncommitted sessions) counters.
+        """
+
+        with self.__lock:
+            stats = self.__stats.copy()
+            stats["pending"] = len(self.__dirty_devices | self.__dirty_sessions)
+        return stats
+
+    def __load(self):
+        for jid, device in self.__connection.execute("SELECT jid, device FROM omemo_devices"):
+            self.__sessions.setdefault(jid, {})[device] = None
+
+        for jid, device, *state in self.__connection.execute("SELECT * FROM omemo_sessions"):
+            self.__sessions.setdefault(jid, {})[device] = OmemoSessionState(*state)
+
+    def __update(self, jid: str, device: int, name: str, value: str):
+        with self.__lock:
+            devices = self.__sessions.get(jid)
+            if (devices is None or device not in devices):
+                raise Exception("Thas JID or device does not exist in the database.")
+
+            session = devices[device]
+            if (session is None):
+                raise Exception("No session for this device.")
+
+            setattr(session, name, value)
+            self.__dirty_sessions.add((jid, device))
+            self.__write()
+
+    def __write(self):
+        self.__stats["writes"] += 1
+
+        if (self.__commit_interval <= 0):
+            self.flush()
+            return
+
+        if (self.__timer is None):
+            self.__timer = threading.Timer(self.__commit_interval, self.flush)
+            self.__timer.daemon = True
+            self.__timer.start()
@@ -1,6 +1,6 @@
 import uuid
 
-from typing import List
+from typing import List, Tuple, Dict, Set
 
 from osmxml import XmlParser
 from osmxml import XmlElement
@@ -10,6 +10,10 @@ from osmxml import XmlTextElement
 from osmomemo import OmemoBundle
 
 
+# Payload of messages whose body is encrypted inside the key elements
+PAYLOAD_PLACEHOLDER = "ciphertext-of-sce-envelope"
+
+
 class OmemoXml:
     @staticmethod
     def send_presence(jid_to: str) -> XmlElement:
@@ -86,7 +90,7 @@ class OmemoXml:
         return XmlParser.parse_elements(xml_str)[0]
 
     @staticmethod
-    def publish_bundle_information(jid: str, bundle: OmemoBundle) -> XmlElement:
+    def publish_bundle_information(jid: str, bundle: OmemoBundle, excluded: Set[str] = None) -> XmlElement:
         device_id = bundle.get_device_id()
         ik = bundle.get_indentity().get_base64_public_key() 
         spk = bundle.get_prekey().get_base64_public_key()
@@ -104,6 +108,7 @@ class OmemoXml:
                         XmlTextElement(opk.get_base64_public_key())
                     ]
                 ) for i, opk in bundle.get_onetime_prekeys().items()
+                if not excluded or i not in excluded
             ]
         ).to_string()
 
@@ -142,12 +147,14 @@ class OmemoXml:
         return XmlParser.parse_elements(xml_str)[0]
 
     @staticmethod
-    def fetch_bundles(jid: str, jid_to: str, device_to: int) -> XmlElement:
+    def fetch_bundles(jid: str, jid_to: str, device_to: int | List[int]) -> XmlElement:
+        devices_to = device_to if isinstance(device_to, list) else [device_to]
+        xml_str_items = "\n".join([f"<item id='{device}'/>" for device in devices_to])
         xml_str = f"""
         <iq type='get' from='{jid}' to='{jid_to}' id='{OmemoXml.make_id()}'>
           <pubsub xmlns='http://jabber.org/protocol/pubsub'>
             <items node='urn:xmpp:omemo:2:bundles'>
-              <item id='{device_to}'/>
+              {xml_str_items}
             </items>
           </pubsub>
         </iq>
@@ -161,6 +168,7 @@ class OmemoXml:
                 device: int, 
                 device_to: int,
                 key_data: str,
+                payload: str = None,
             ) -> XmlElement:
         xml_str = f"""
         <message from="{jid}" to="{jid_to}" type="chat" id="{OmemoXml.make_id()}">
@@ -173,7 +181,7 @@ class OmemoXml:
                     </keys>
                 </header>
                 <payload>
-                     {XmlTextElement("ciphertext-of-sce-envelope").to_string()}
+                     {XmlTextElement(payload or PAYLOAD_PLACEHOLDER).to_string()}
                 </payload>
             </encrypted>
             <body>
@@ -189,6 +197,7 @@ class OmemoXml:
                 jid_to: str, 
                 device: int, 
                 keys: List[XmlElement],
+                payload: str = None,
             ) -> XmlElement:
         xml_str_keys = "\n".join([nkey.to_string(raw=False) for nkey in keys]) 
         xml_str = f"""
@@ -198,7 +207,7 @@ class OmemoXml:
                     {xml_str_keys}
                 </header>
                 <payload>
-                     {XmlTextElement("ciphertext-of-sce-envelope").to_string()}
+                     {XmlTextElement(payload or PAYLOAD_PLACEHOLDER).to_string()}
                 </payload>
             </encrypted>
             <body>
@@ -208,6 +217,106 @@ class OmemoXml:
         """
         return XmlParser.parse_elements(xml_str)[0]
 
+    @staticmethod
+    def parse_muc_user(presence: XmlElement) -> str | None:
+        for x in presence.children:
+            if (x.name != "x"):
+                continue
+
+            xmlns = x.get_attribute_by_name("xmlns")
+            if (not xmlns or xmlns.value != "http://jabber.org/protocol/muc#user"):
+                continue
+
+            item = x.get_child_by_name("item")
+            if (item is None):
+                return None
+
+            jid = item.get_attribute_by_name("jid")
+            return jid.value if jid else None
+
+        return None
+
+    @staticmethod
+    def find_key(header: XmlElement, jid: str, device: int) -> XmlElement | None:
+        rid = str(device)
+        for keys in header.children:
+            if (keys.name != "keys"):
+                continue
+
+            jid_attr = keys.get_attribute_by_name("jid")
+            if (not jid_attr or jid_attr.value != jid):
+                continue
+
+            # Only the keys of our JID are scanned, comparing the rid as text
+            for key in keys.children:
+                if (key.name != "key"):
+                    continue
+
+                rid_attr = key.get_attribute_by_name("rid")
+                if (rid_attr and rid_attr.value.strip() == rid):
+                    return key
+            return None
+
+        return None
+
+    @staticmethod
+    def parse_devices(items: XmlElement) -> Tuple[str, List[int]] | None:
+        if (not items or items.get_attribute_by_name("node").value != "urn:xmpp:omemo:2:devices"):
+            return None
+
+        item = items.get_child_by_name("item")
+        if (not item):
+            return None
+
+        devices = item.get_child_by_name("devices")
+        if (not devices):
+            return None
+
+        item_id = item.get_attribute_by_name("id")
+        return (
+            item_id.value if item_id else None,
+            [int(device.get_attribute_by_name("id").value) for device in devices.children]
+        )
+
+    @staticmethod
+    def parse_bundle(items: XmlElement) -> Tuple[int, Dict] | None:
+        bundles = OmemoXml.parse_bundles(items)
+        return bundles[0] if bundles else None
+
+    @staticmethod
+    def parse_bundles(items: XmlElement) -> List[Tuple[int, Dict]]:
+        if (not items or items.get_attribute_by_name("node").value != "urn:xmpp:omemo:2:bundles"):
+            return []
+
+        bundles = []
+        for item in items.children:
+            if (item.name != "item"):
+                continue
+
+            bundle = item.get_child_by_name("bundle")
+            if (not bundle):
+                continue
+
+            device_id = int(item.get_attribute_by_name("id").value)
+
+            bundle_data = {
+                "spk": bundle.get_child_by_name("spk").children[0].to_string().strip(),
+                "spks": bundle.get_child_by_name("spks").children[0].to_string().strip(),
+                "ik": bundle.get_child_by_name("ik").children[0].to_string().strip(),
+                "opks": {}
+            }
+
+            prekeys_elem = bundle.get_child_by_name("prekeys")
+            if prekeys_elem:
+                for pk in prekeys_elem.children:
+                    pk_id = pk.get_attribute_by_name("id").value
+                    pk_data = pk.children[0].to_string()
+                    bundle_data["opks"][pk_id] = pk_data
+
+            bundles.append((device_id, bundle_data))
+
+        return bundles
+
     @staticmethod
     def make_id():
         return str(uuid.uuid4()) 
@@ -1,17 +1,35 @@
-from typing import Callable, List, Tuple, Dict
+import time
+import threading
+
+from collections import deque
+from typing import Callable, List, Tuple, Dict, Set, Iterable
 
 from osmxml import XmlElement
 
 from ...abc import XmppExtension
 from ....message import XmppMessage
 from ....permission import XmppPermission
+from ....jid import bare_jid
 
 from .xml import SubscriptionXml
 
+import logging
+
+
+logger = logging.getLogger(__name__)
+
 
 class SubscriptionExtension(XmppExtension):
     """
     XEP-0379: Pre-Authenticated Roster Subscription implementation.
+
+    Subscriptions are reconciled in bulk: the set of ensured JIDs is diffed against
+    the roster, and the resulting stanzas are sent from a background thread in
+    rate-limited batches, so the reader is never blocked.
+
+    Attributes:
+        batch_size (int): The maximum number of JIDs processed per batch. (Default: 50)
+        batch_interval (float): The delay in seconds between two batches. (Default: 1.0)
     """
 
     ID = "osmiumnet.roster.subscription"
@@ -20,21 +38,39 @@ class SubscriptionExtension(XmppExtension):
     REQUIRED_PERMISSIONS: List[XmppPermission] = [
         XmppPermission.GET_JID,
         XmppPermission.SEND_XML,
-        XmppPermission.LISTEN_ON_READY,
         XmppPermission.LISTEN_ON_PRESENCE,
-        XmppPermission.LISTEN_ON_IQ,
+        XmppPermission.HOOK_ON_IQ,
     ]
 
-    def __init__(self):
-        self.__ensure_list: List[str] = [] 
+    def __init__(self, batch_size: int = 50, batch_interval: float = 1.0):
+        self.__ensure_set: Set[str] = set()
+
+        self.__batch_size = batch_size
+        self.__batch_interval = batch_interval
+
+        # Pending (action, jid) pairs, consumed by the sender thread
+        self.__outbox: deque = deque()
+        self.__outbox_lock = threading.Lock()
+        self.__sender_thread: threading.Thread | None = None
+
+        self.__progress_done = 0
+        self.__progress_total = 0
+        self.__generation = 0
 
         self.__handlers = {
             "on_check_subscriptions": [],
+            "on_reconcile_progress": [],
         }
      
     def _connect_ci(self, ci):
         self.__ci = ci
 
+    def _memory_report(self):
+        return {
+            "ensure_set": self.__ensure_set,
+            "outbox": self.__outbox,
+        }
+
     def _process(self):
         # Listeners
         @self.__ci.on_presence
@@ -49,10 +85,14 @@ class SubscriptionExtension(XmppExtension):
         # Variables
         self.__ci.variables.function(self.on_check_subscriptions)
 
+        self.__ci.variables.function(self.on_reconcile_progress)
+
         self.__ci.variables.function(self.check_for_subscriptions)
 
         self.__ci.variables.function(self.ensure_subscription)
 
+        self.__ci.variables.function(self.get_reconcile_progress)
+
     def on_check_subscriptions(self, handler:Callable):
         """
         Registers a handler for the ``on_check_subscriptions`` event.
@@ -74,9 +114,32 @@ class SubscriptionExtension(XmppExtension):
         self.__handlers["on_check_subscriptions"].append(handler)
         return handler
 
+    def on_reconcile_progress(self, handler:Callable):
+        """
+        Registers a handler for the ``on_reconcile_progress`` event.
+
+        Handler will be called from the sender thread after every batch
+        with the number of processed JIDs and the total number of JIDs to process.
+
+        Args:
+            handler (Callable): The handler to register.
+
+        Returns:
+            Callable: The handler (unchanged).
+
+        Example:
+            >>> @client.extensions["osmiumnet.roster.subscription"].on_reconcile_progress
+            ... def on_reconcile_progress(done, total):
+            ...     print(f"Reconciled {done}/{total} subscriptions")
+        """
+
+        self.__handlers["on_reconcile_progress"].append(handler)
+        return handler
+
     def check_for_subscriptions(self):
         """
         Sends a subscription check request.
+        The roster result is reconciled with the ensured JIDs.
 
         Example:
             >>> client.extensions["osmiumnet.roster.subscription"].check_for_subscriptions()
@@ -85,25 +148,47 @@ class SubscriptionExtension(XmppExtension):
         xml = SubscriptionXml.check_for_subscription(self.__ci.get_jid(False))
         self.__ci.send_xml(xml)
 
-    def ensure_subscription(self, jid_to: str):
+    def ensure_subscription(self, jid_to: str | Iterable[str]):
         """
-        Ensures that the JID is subscribed.
+        Ensures that the JID(s) are subscribed.
 
         Args:
-            jid_to (str): The JID to ensure.
+            jid_to (str | Iterable[str]): The JID(s) to ensure.
 
         Example:
             >>> client.extensions["osmiumnet.roster.subscription"].ensure_subscription("john@jabber.org")
+            >>> client.extensions["osmiumnet.roster.subscription"].ensure_subscription(["john@jabber.org", "jane@jabber.org"])
+        """
+
+        if (isinstance(jid_to, str)):
+            jid_to = [jid_to]
+
+        self.__ensure_set.update(bare_jid(jid) for jid in jid_to)
+
+    def get_reconcile_progress(self) -> Tuple[int, int]:
+        """
+        Gets the progress of the current reconciliation.
+
+        Returns:
+            Tuple[int, int]: The number of processed JIDs and the total number of JIDs to process.
+
+        Example:
+            >>> done, total = client.extensions["osmiumnet.roster.subscription"].get_reconcile_progress()
         """
-        self.__ensure_list.append(jid_to)
+
+        return self.__progress_done, self.__progress_total
 
 
     def __on_presence(self, presence: XmlElement):
         if(SubscriptionXml.send_subscribe_filter(presence)):
-            # If it receives subscribe request, and jid in ensure list,
+            # If it receives subscribe request, and jid in ensure set,
             # it sends subscribed to it
-            jid = presence.get_attribute_by_name("from")
-            if (jid in self.__ensure_list):
+            jid_attr = presence.get_attribute_by_name("from")
+            if (jid_attr is None):
+                return
+
+            jid = bare_jid(jid_attr.value)
+            if (jid in self.__ensure_set):
                 # Send subscribed
                 xml = SubscriptionXml.send_subscribed(jid)
                 self.__ci.send_xml(xml)
@@ -125,37 +210,32 @@ class SubscriptionExtension(XmppExtension):
         
         query = iq.get_child_by_name("query")
         
-        # Get subscribed query children
-        subscribed_children_list = []
-        ask_children_list = []
+        # Get subscribed and asked query children
+        subscribed_set = set()
+        ask_set = set()
         for query_child in query.children:
             if (query_child.name == "item"):
-                jid = query_child.get_attribute_by_name("jid").value
+                # Compared with the ensured JIDs, which are normalized
+                jid = bare_jid(query_child.get_attribute_by_name("jid").value)
                 # Check subscription status
-                subscription_status = query_child.get_attribute_by_name("subscription").value
+                subscription_attr = query_child.get_attribute_by_name("subscription")
+                subscription_status = subscription_attr.value if subscription_attr else "none"
                 if (subscription_status == "both"):
-                    subscribed_children_list.append(jid)
+                    subscribed_set.add(jid)
                 elif (subscription_status == "none"):
-                    ask =  query_child.get_attribute_by_name("ask").value
-                    if (ask == "subscribe"):
-                        ask_children_list.append(jid)
-
-        # If jid from ensure list is not subsribed, it sends subscription to it
-        for ensure_jid in self.__ensure_list:
-            if (ensure_jid not in subscribed_children_list):
-                # Send to subscribe
-                xml = SubscriptionXml.send_subscribe(ensure_jid)
-                self.__ci.send_xml(xml)
+                    ask_attr = query_child.get_attribute_by_name("ask")
+                    if (ask_attr and ask_attr.value == "subscribe"):
+                        ask_set.add(jid)
 
-                xml = SubscriptionXml.send_presence(ensure_jid)
-                self.__ci.send_xml(xml)
+        # Jids from ensure set that are not subscribed yet get a subscription,
+        # asked jids from ensure set get subscribed
+        to_subscribe = sorted(self.__ensure_set - subscribed_set - ask_set)
+        to_subscribed = sorted(self.__ensure_set & ask_set)
 
-        # If jid from ask list is in ensure list, it sends subscribed to it
-        for ask_child in ask_children_list:
-            if (ask_child in self.__ensure_list):
-                # Send subscribed
-                xml = SubscriptionXml.send_subscribed(ensure_jid)
-                self.__ci.send_xml(xml)
+        self.__reconcile(
+            [("subscribe", jid) for jid in to_subscribe] +
+            [("subscribed", jid) for jid in to_subscribed]
+        )
 
         # Trigger event
         handlers = self.__handlers["on_check_subscriptions"] 
@@ -163,3 +243,65 @@ class SubscriptionExtension(XmppExtension):
             handler(iq)
         
         return True
+
+
+    # Rate-limited batch sending
+    def __reconcile(self, actions: List[Tuple[str, str]]):
+        with self.__outbox_lock:
+            # New roster state supersedes the previous reconciliation
+            self.__outbox.clear()
+            self.__outbox.extend(actions)
+
+            self.__progress_done = 0
+            self.__progress_total = len(actions)
+            self.__generation += 1
+
+            if (not actions):
+                return
+
+            logger.debug(f"Reconciling {len(actions)} subscriptions...")
+
+            if (self.__sender_thread is None):
+                self.__sender_thread = threading.Thread(target=self.__run_sender, daemon=True)
+                self.__sender_thread.start()
+
+    def __run_sender(self):
+        while True:
+            with self.__outbox_lock:
+                count = min(self.__batch_size, len(self.__outbox))
+                batch = [self.__outbox.popleft() for _ in range(count)]
+                generation = self.__generation
+
+                if (not batch):
+                    self.__sender_thread = None
+                    return
+
+            try:
+                for action, jid in batch:
+                    if (action == "subscribe"):
+                        self.__ci.send_xml(SubscriptionXml.send_subscribe(jid))
+                        self.__ci.send_xml(SubscriptionXml.send_presence(jid))
+                    elif (action == "subscribed"):
+                        self.__ci.send_xml(SubscriptionXml.send_subscribed(jid))
+            except Exception as e:
+                logger.error(f"Subscription reconciliation stopped: {e}")
+                with self.__outbox_lock:
+                    self.__outbox.clear()
+                    self.__sender_thread = None
+                return
+
+            with self.__outbox_lock:
+                if (generation == self.__generation):
+                    self.__progress_done += len(batch)
+                done, total = self.__progress_done, self.__progress_total
+                has_more = len(self.__outbox) > 0
+
+            # A failing handler must not stop the sender, nothing would start it again
+            for handler in self.__handlers["on_reconcile_progress"]:
+                try:
+                    handler(done, total)
+                except Exception as e:
+                    logger.error(f"Error in reconcile progress handler: {e}")
+
+            if (has_more):
+                time.sleep(self.__batch_interval)
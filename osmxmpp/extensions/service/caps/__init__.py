@@ -0,0 +1,8 @@
+from .base import CapsExtension
+from .cache import CapsCache
+
+__all__ = [
+    "CapsExtension",
+    "CapsCache",
+]
+
@@ -0,0 +1,351 @@
+import threading
+
+from typing import List, Tuple, Dict, Set
+
+from osmxml import XmlElement
+
+from ...abc import XmppExtension
+from ....permission import XmppPermission
+
+from ..discovery.xml import DiscoveryXml
+from .xml import CapsXml
+from .cache import CapsCache
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class CapsExtension(XmppExtension):
+    """
+    XEP-0115: Entity Capabilities implementation.
+
+    Advertises the client's own ``ver`` hash in outgoing presences, answers disco#info
+    queries for it, and resolves ``ver`` hashes from incoming presences with a single
+    disco#info query per unknown hash.
+
+    Attributes:
+        node (str): The node URI of the client software. (Default: "https://github.com/osmiumnet/osmxmpp")
+        identities (List[Tuple[str, str, str, str]]): The client identities as (category, type, lang, name).
+        features (List[str]): The client features, besides the ``FEATURES`` of the connected extensions.
+        cache (CapsCache): The verification string cache. (Default: in-memory CapsCache)
+        timeout (float): The number of seconds to wait for the disco#info of a ``ver`` hash. (Default: 30)
+    """
+
+    ID = "osmiumnet.service.caps"
+
+    # List of required permissions
+    REQUIRED_PERMISSIONS: List[XmppPermission] = [
+        XmppPermission.SEND_XML,
+        XmppPermission.LISTEN_ON_PRESENCE,
+        XmppPermission.HOOK_ON_IQ,
+        XmppPermission.HOOK_SEND_PRESENCE,
+        XmppPermission.LISTEN_ON_DISCONNECT,
+    ]
+
+    def __init__(
+                self,
+                node: str = "https://github.com/osmiumnet/osmxmpp",
+                identities: List[Tuple[str, str, str, str]] = None,
+                features: List[str] = None,
+                cache: CapsCache = None,
+                timeout: float = 30,
+            ):
+        self.__node = node
+        self.__identities = identities if identities is not None else [("client", "pc", "", "osmxmpp")]
+        self.__features = set(features) if features is not None else set()
+        self.__features.update([
+            "http://jabber.org/protocol/caps",
+            "http://jabber.org/protocol/disco#info",
+        ])
+        self.__ver = CapsXml.make_ver(self.__identities, list(self.__features))
+
+        self.__cache = cache if cache is not None else CapsCache()
+
+        # Full JID -> ver
+        self.__jid_vers: Dict[str, str] = {}
+
+        # Requested ver -> waiting full JIDs, and request ID -> ver
+        self.__pending_vers: Dict[str, Set[str]] = {}
+        self.__pending_requests: Dict[str, str] = {}
+        # Request ID -> timer giving up on it
+        self.__timeout = timeout
+        self.__timers: Dict[str, threading.Timer] = {}
+
+        self.__lock = threading.Lock()
+
+    def _connect_ci(self, ci):
+        self.__ci = ci
+
+    def _memory_report(self):
+        return {
+            "cache": self.__cache,
+            "jid_vers": self.__jid_vers,
+            "pending_vers": self.__pending_vers,
+            "pending_requests": self.__pending_requests,
+            "timers": self.__timers,
+        }
+
+    def _process(self):
+        # Listeners
+        @self.__ci.on_presence
+        def on_presence(presence: XmlElement):
+            self.__on_presence(presence)
+
+        @self.__ci.on_disconnect
+        def on_disconnect():
+            self.__on_disconnect()
+
+        # Hooks
+        @self.__ci.hook_on_iq
+        def hook_on_iq(iq: XmlElement):
+            return self.__hook_on_iq(iq)
+
+        @self.__ci.hook_send_presence
+        def hook_send_presence(presence: XmlElement):
+            return self.__hook_send_presence(presence)
+
+        # Variables
+        self.__ci.variables.function(self.supports)
+
+        self.__ci.variables.function(self.get_features)
+
+        self.__ci.variables.function(self.add_feature)
+
+        self.__ci.variables.function(self.get_ver)
+
+    def supports(self, jid: str, feature: str) -> bool | None:
+        """
+        Checks if the entity supports the given feature.
+        A bare JID supports the feature if any of its known resources does.
+
+        Args:
+            jid (str): The JID of the entity.
+            feature (str): The feature to check.
+
+        Returns:
+            bool | None: Whether the feature is supported, None if the entity capabilities are not known yet.
+
+        Example:
+            >>> client.extensions["osmiumnet.service.caps"].supports("john@jabber.org/phone", "urn:xmpp:omemo:2")
+        """
+
+        features = self.get_features(jid)
+        if (features is None):
+            return None
+        return feature in features
+
+    def get_features(self, jid: str) -> Set[str] | None:
+        """
+        Gets the known features of the entity.
+
+        Args:
+            jid (str): The JID of the entity. If bare, features of all its known resources are merged.
+
+        Returns:
+            Set[str] | None: The features, None if the entity capabilities are not known yet.
+
+        Example:
+            >>> client.extensions["osmiumnet.service.caps"].get_features("john@jabber.org")
+        """
+
+        ver = self.__jid_vers.get(jid)
+        if (ver is not None):
+            entry = self.__cache.get(ver)
+            return set(entry[1]) if entry else None
+
+        if ("/" in jid):
+            return None
+
+        features = None
+        prefix = f"{jid}/"
+        for full_jid, ver in list(self.__jid_vers.items()):
+            if (not full_jid.startswith(prefix)):
+                continue
+
+            entry = self.__cache.get(ver)
+            if (entry):
+                features = (features or set()) | entry[1]
+        return features
+
+    def add_feature(self, feature: str):
+        """
+        Adds a feature to the advertised client features.
+        The new ``ver`` hash is sent with the next presence.
+
+        Args:
+            feature (str): The feature to add.
+
+        Example:
+            >>> client.extensions["osmiumnet.service.caps"].add_feature("urn:xmpp:receipts")
+        """
+
+        self.__features.add(feature)
+        self.__ver = CapsXml.make_ver(self.__identities, list(self.__features))
+
+    def get_ver(self) -> str:
+        """
+        Gets the client's own verification string.
+
+        Returns:
+            str: The verification string.
+        """
+
+        self.__sync_features()
+        return self.__ver
+
+
+    def __on_presence(self, presence: XmlElement):
+        jid_attr = presence.get_attribute_by_name("from")
+        if (jid_attr is None):
+            return
+        jid = jid_attr.value
+
+        type_attr = presence.get_attribute_by_name("type")
+        if (type_attr and type_attr.value == "unavailable"):
+            with self.__lock:
+                self.__jid_vers.pop(jid, None)
+            return
+
+        caps = CapsXml.parse_caps(presence)
+        if (caps is None):
+            return
+
+        node, ver, hash_name = caps
+        # Legacy caps without hash can't be verified
+        if (hash_name != "sha-1"):
+            return
+
+        with self.__lock:
+            self.__jid_vers[jid] = ver
+            if (ver in self.__cache):
+                return
+
+            if (ver in self.__pending_vers):
+                self.__pending_vers[ver].add(jid)
+                return
+
+            xml = DiscoveryXml.info(jid, f"{node}#{ver}")
+            request_id = xml.get_attribute_by_name("id").value
+            self.__pending_vers[ver] = {jid}
+            self.__pending_requests[request_id] = ver
+
+            timer = threading.Timer(self.__timeout, self.__on_timeout, args=(request_id,))
+            timer.daemon = True
+            self.__timers[request_id] = timer
+            timer.start()
+
+        logger.debug(f"Resolving caps '{ver}' from '{jid}'...")
+        try:
+            self.__ci.send_xml(xml)
+        except Exception as e:
+            self.__fail(request_id, f"Could not resolve caps '{ver}': {e}")
+
+    def __hook_on_iq(self, iq: XmlElement):
+        iq_type = iq.get_attribute_by_name("type")
+        iq_id = iq.get_attribute_by_name("id")
+        iq_type = iq_type.value if iq_type else None
+        iq_id = iq_id.value if iq_id else None
+
+        if (iq_type == "get" and DiscoveryXml.info_filter(iq)):
+            if (self.__answer_info(iq, iq_id)):
+                return
+            return iq
+
+        # Error results may come without the query
+        with self.__lock:
+            ver = self.__pending_requests.pop(iq_id, None)
+            if (ver is None):
+                return iq
+            waiting_jids = self.__pending_vers.pop(ver, set())
+            timer = self.__timers.pop(iq_id, None)
+
+        if (timer is not None):
+            timer.cancel()
+
+        if (iq_type != "result" or iq.get_child_by_name("query") is None):
+            self.__forget(ver, waiting_jids)
+            return
+
+        identities, features, forms = DiscoveryXml.parse_info(iq.get_child_by_name("query"))
+        if (CapsXml.make_ver(identities, features, forms) != ver):
+            logger.warning(f"Caps verification failed for '{ver}'")
+            self.__forget(ver, waiting_jids)
+            return
+
+        self.__cache.put(ver, identities, features)
+
+    def __sync_features(self):
+        # Extensions may be connected after this one, so their features are gathered when needed
+        features = self.__features | self.__ci.get_extension_features()
+        if (features != self.__features):
+            self.__features = features
+            self.__ver = CapsXml.make_ver(self.__identities, list(self.__features))
+
+    def __forget(self, ver: str, jids: Set[str]):
+        # The ver could not be resolved, a later presence with it is resolved again
+        with self.__lock:
+            for jid in jids:
+                if (self.__jid_vers.get(jid) == ver):
+                    del self.__jid_vers[jid]
+
+    def __on_timeout(self, request_id: str):
+        ver = self.__pending_requests.get(request_id)
+        if (ver is not None):
+            self.__fail(request_id, f"No answer to the disco#info of caps '{ver}' in {self.__timeout}s")
+
+    def __fail(self, request_id: str, reason: str):
+        with self.__lock:
+            timer = self.__timers.pop(request_id, None)
+            ver = self.__pending_requests.pop(request_id, None)
+            if (ver is None):
+                return
+            waiting_jids = self.__pending_vers.pop(ver, set())
+
+        if (timer is not None):
+            timer.cancel()
+
+        logger.warning(reason)
+        self.__forget(ver, waiting_jids)
+
+    def __on_disconnect(self):
+        with self.__lock:
+            timers = list(self.__timers.values())
+            self.__timers.clear()
+            self.__pending_requests.clear()
+            self.__pending_vers.clear()
+            # Presences are received again after reconnecting
+            self.__jid_vers.clear()
+
+        for timer in timers:
+            timer.cancel()
+
+    def __hook_send_presence(self, presence: XmlElement):
+        # Only available presences carry capabilities
+        if (presence.get_attribute_by_name("type") is None):
+            self.__sync_features()
+            presence.add_child(CapsXml.caps(self.__node, self.__ver))
+        return presence
+
+    def __answer_info(self, iq: XmlElement, iq_id: str) -> bool:
+        query = iq.get_child_by_name("query")
+        node_attr = query.get_attribute_by_name("node")
+        node = node_attr.value if node_attr else None
+
+        self.__sync_features()
+
+        # Other nodes are left to other extensions
+        if (node is not None and node != f"{self.__node}#{self.__ver}"):
+            return False
+
+        from_attr = iq.get_attribute_by_name("from")
+        xml = DiscoveryXml.info_result(
+            from_attr.value if from_attr else None,
+            iq_id,
+            self.__identities,
+            sorted(self.__features),
+            node
+        )
+        self.__ci.send_xml(xml)
+        return True
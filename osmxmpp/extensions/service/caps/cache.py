@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+
+from collections import OrderedDict
+from typing import List, Tuple, FrozenSet
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class CapsCache:
+    """
+    LRU cache of resolved verification strings.
+
+    Keys are ``ver`` hashes, values are the identities and features they stand for.
+    Since a ``ver`` hash is verified against its disco#info result before it is stored,
+    entries never expire and can be safely shared between sessions on disk.
+
+    Attributes:
+        max_size (int): The maximum number of verification strings to keep. (Default: 1024)
+        path (str): The JSON file to persist the cache to. (Default: None)
+    """
+
+    def __init__(self, max_size: int = 1024, path: str = None):
+        self.__max_size = max_size
+        self.__path = path
+
+        self.__entries: OrderedDict[str, Tuple[List[Tuple[str, str, str, str]], FrozenSet[str]]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+        if (self.__path and os.path.exists(self.__path)):
+            self.__load()
+
+    def get(self, ver: str) -> Tuple[List[Tuple[str, str, str, str]], FrozenSet[str]] | None:
+        """
+        Gets the identities and features of the verification string.
+
+        Args:
+            ver (str): The verification string.
+
+        Returns:
+            Tuple[List[Tuple[str, str, str, str]], FrozenSet[str]] | None: The identities and features, None if unknown.
+        """
+
+        with self.__lock:
+            entry = self.__entries.get(ver)
+            if (entry is not None):
+                self.__entries.move_to_end(ver)
+            return entry
+
+    def put(self, ver: str, identities: List[Tuple[str, str, str, str]], features: List[str]):
+        """
+        Stores the identities and features of the verification string.
+
+        Args:
+            ver (str): The verification string.
+            identities (List[Tuple[str, str, str, str]]): The identities.
+            features (List[str]): The features.
+        """
+
+        with self.__lock:
+            self.__entries[ver] = ([tuple(identity) for identity in identities], frozenset(features))
+            self.__entries.move_to_end(ver)
+
+            while (len(self.__entries) > self.__max_size):
+                self.__entries.popitem(last=False)
+
+            if (self.__path):
+                self.__save()
+
+    def __contains__(self, ver: str) -> bool:
+        return ver in self.__entries
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+    def __load(self):
+        try:
+            with open(self.__path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load caps cache '{self.__path}': {e}")
+            return
+
+        for ver, entry in data.items():
+            self.__entries[ver] = ([tuple(identity) for identity in entry["identities"]], frozenset(entry["features"]))
+
+        while (len(self.__entries) > self.__max_size):
+            self.__entries.popitem(last=False)
+
+    def __save(self):
+        data = {
+            ver: {"identities": identities, "features": sorted(features)}
+            for ver, (identities, features) in self.__entries.items()
+        }
+
+        tmp_path = f"{self.__path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.__path)
+        except OSError as e:
+            logger.warning(f"Could not save caps cache '{self.__path}': {e}")
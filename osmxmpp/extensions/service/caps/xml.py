@@ -0,0 +1,66 @@
+import base64
+import hashlib
+
+from typing import Dict, List, Tuple
+
+from osmxml import XmlElement
+from osmxml import XmlAttribute
+
+
+CAPS_NS = "http://jabber.org/protocol/caps"
+
+
+class CapsXml:
+    @staticmethod
+    def caps(node: str, ver: str) -> XmlElement:
+        return XmlElement(
+            "c",
+            [
+                XmlAttribute("xmlns", CAPS_NS),
+                XmlAttribute("hash", "sha-1"),
+                XmlAttribute("node", node),
+                XmlAttribute("ver", ver),
+            ]
+        )
+
+    @staticmethod
+    def parse_caps(presence: XmlElement) -> Tuple[str, str, str] | None:
+        for child in presence.children:
+            if (child.name != "c"):
+                continue
+
+            xmlns = child.get_attribute_by_name("xmlns")
+            if ((xmlns is None) or (xmlns.value != CAPS_NS)):
+                continue
+
+            node = child.get_attribute_by_name("node")
+            ver = child.get_attribute_by_name("ver")
+            hash_name = child.get_attribute_by_name("hash")
+            if (node is None or ver is None):
+                return None
+
+            return node.value, ver.value, hash_name.value if hash_name else None
+        return None
+
+    @staticmethod
+    def make_ver(identities: List[Tuple[str, str, str, str]], features: List[str], forms: List[Dict[str, List[str]]] = None) -> str:
+        # XEP-0115 §5.1: identities sorted by category/type/lang, then sorted features
+        ver_str = ""
+        for category, identity_type, lang, name in sorted(identities):
+            ver_str += f"{category}/{identity_type}/{lang or ''}/{name or ''}<"
+        for feature in sorted(set(features)):
+            ver_str += f"{feature}<"
+
+        # Then the extended forms sorted by FORM_TYPE, their fields sorted by var and the values of each sorted,
+        # forms without a FORM_TYPE are left out
+        typed_forms = [form for form in forms or [] if form.get("FORM_TYPE")]
+        for form in sorted(typed_forms, key=lambda form: form["FORM_TYPE"][0]):
+            ver_str += f"{form['FORM_TYPE'][0]}<"
+            for var in sorted(form):
+                if (var == "FORM_TYPE"):
+                    continue
+                ver_str += f"{var}<"
+                for value in sorted(form[var]):
+                    ver_str += f"{value}<"
+
+        return base64.b64encode(hashlib.sha1(ver_str.encode("utf-8")).digest()).decode("utf-8")
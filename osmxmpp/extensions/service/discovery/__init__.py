@@ -1,6 +1,9 @@
 from .base import ServiceDiscoveryExtension
+from .result import DiscoveryInfo, DiscoveryItems
 
 __all__ = [
-    "ServiceDiscoveryExtension"
+    "ServiceDiscoveryExtension",
+    "DiscoveryInfo",
+    "DiscoveryItems",
 ]
 
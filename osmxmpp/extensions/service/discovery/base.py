@@ -1,15 +1,37 @@
-from typing import Callable, List, Tuple, Dict
+import time
+import threading
+
+from collections import deque
+from typing import Callable, List, Tuple, Dict, Iterable
+
+from osmxml import XmlElement
 
 from ...abc import XmppExtension
 from ....message import XmppMessage
 from ....permission import XmppPermission
 
 from .xml import DiscoveryXml
+from .result import DiscoveryInfo, DiscoveryItems
+
+import logging
+
+
+logger = logging.getLogger(__name__)
 
 
 class ServiceDiscoveryExtension(XmppExtension):
     """
     XEP-0030: Service Discovery implementation.
+
+    Results are cached for ``cache_ttl`` seconds, at most ``cache_size`` of them, and concurrent
+    requests for the same (jid, node) share a single IQ. Requests not answered in ``timeout``
+    seconds, or still waiting when the client disconnects, complete with None.
+
+    Attributes:
+        cache_ttl (float): The number of seconds results are cached for. (Default: 300)
+        cache_size (int): The number of results cached, the oldest are dropped first. (Default: 1000)
+        max_concurrency (int): The default number of requests a crawl keeps in flight. (Default: 8)
+        timeout (float): The number of seconds to wait for an answer. (Default: 30)
     """
 
     ID = "osmiumnet.service.discovery"
@@ -17,14 +39,38 @@ class ServiceDiscoveryExtension(XmppExtension):
     # List of required permissions
     REQUIRED_PERMISSIONS: List[XmppPermission] = [
         XmppPermission.SEND_XML,
+        XmppPermission.HOOK_ON_IQ,
+        XmppPermission.LISTEN_ON_DISCONNECT,
     ]
 
-    def __init__(self):
-        pass
-     
+    def __init__(self, cache_ttl: float = 300, max_concurrency: int = 8, timeout: float = 30, cache_size: int = 1000):
+        self.__cache_ttl = cache_ttl
+        self.__cache_size = cache_size
+        self.__max_concurrency = max_concurrency
+        self.__timeout = timeout
+
+        # (kind, jid, node) -> (expires at, result), in the order they expire
+        self.__cache: Dict[Tuple[str, str, str], Tuple[float, DiscoveryInfo | DiscoveryItems]] = {}
+
+        # (kind, jid, node) -> waiting callbacks, and request ID -> (kind, jid, node)
+        self.__in_flight: Dict[Tuple[str, str, str], List[Callable]] = {}
+        self.__requests: Dict[str, Tuple[str, str, str]] = {}
+        # Request ID -> timer completing it with None
+        self.__timers: Dict[str, threading.Timer] = {}
+
+        self.__lock = threading.Lock()
+
     def _connect_ci(self, ci):
         self.__ci = ci
-    
+
+    def _memory_report(self):
+        return {
+            "cache": self.__cache,
+            "in_flight": self.__in_flight,
+            "requests": self.__requests,
+            "timers": self.__timers,
+        }
+
     def discover(self):
         """
         Sends a service discovery request.
@@ -36,7 +82,293 @@ class ServiceDiscoveryExtension(XmppExtension):
         xml = DiscoveryXml.discover()
         self.__ci.send_xml(xml)
 
+    def get_info(self, jid: str, callback: Callable, node: str = None):
+        """
+        Requests the disco#info of the entity.
+
+        Args:
+            jid (str): The JID of the entity.
+            callback (Callable): Called with the DiscoveryInfo, or None if the request failed.
+            node (str): The node to query. (Default: None)
+
+        Example:
+            >>> def on_info(info):
+            ...     print(info.features)
+            >>> client.extensions["osmiumnet.service.discovery"].get_info("jabber.org", on_info)
+        """
+
+        self.__request("info", jid, node, callback)
+
+    def get_items(self, jid: str, callback: Callable, node: str = None):
+        """
+        Requests the disco#items of the entity.
+
+        Args:
+            jid (str): The JID of the entity.
+            callback (Callable): Called with the DiscoveryItems, or None if the request failed.
+            node (str): The node to query. (Default: None)
+
+        Example:
+            >>> def on_items(items):
+            ...     print(items.items)
+            >>> client.extensions["osmiumnet.service.discovery"].get_items("jabber.org", on_items)
+        """
+
+        self.__request("items", jid, node, callback)
+
+    def crawl(self, jids: str | Iterable[str], callback: Callable, max_depth: int = 1, max_concurrency: int = None):
+        """
+        Crawls the disco#items tree of the entities, requesting disco#info of every found item.
+
+        Up to ``max_concurrency`` requests are kept in flight, so the crawl takes
+        about as many round trips as the tree is deep.
+
+        Args:
+            jids (str | Iterable[str]): The JID(s) to start from.
+            callback (Callable): Called with the ``{(jid, node): DiscoveryInfo}`` and ``{(jid, node): DiscoveryItems}`` dicts once the crawl is done.
+            max_depth (int): How many levels of items to follow. (Default: 1)
+            max_concurrency (int): The number of requests kept in flight. (Default: the extension ``max_concurrency``)
+
+        Example:
+            >>> def on_crawled(infos, items):
+            ...     for (jid, node), info in infos.items():
+            ...         if info.has_identity("conference", "text"):
+            ...             print(f"MUC service: {jid}")
+            >>> client.extensions["osmiumnet.service.discovery"].crawl(["jabber.org", "jabber.ru"], on_crawled)
+        """
+
+        if (isinstance(jids, str)):
+            jids = [jids]
+
+        crawl = _DiscoveryCrawl(
+            self.__request,
+            callback,
+            max_depth,
+            max_concurrency if max_concurrency is not None else self.__max_concurrency
+        )
+        crawl.start(jids)
+
+    def clear_cache(self):
+        """
+        Clears the discovery results cache.
+        """
+
+        with self.__lock:
+            self.__cache.clear()
+
     def _process(self):
+        # Listeners
+        @self.__ci.on_disconnect
+        def on_disconnect():
+            self.__on_disconnect()
+
+        # Hooks
+        @self.__ci.hook_on_iq
+        def hook_on_iq(iq: XmlElement):
+            return self.__hook_on_iq(iq)
+
         # Variables
         self.__ci.variables.function(self.discover)
 
+        self.__ci.variables.function(self.get_info)
+
+        self.__ci.variables.function(self.get_items)
+
+        self.__ci.variables.function(self.crawl)
+
+        self.__ci.variables.function(self.clear_cache)
+
+
+    def __request(self, kind: str, jid: str, node: str | None, callback: Callable):
+        key = (kind, jid, node)
+
+        with self.__lock:
+            cached = self.__cache.get(key)
+            if (cached and cached[0] > time.monotonic()):
+                result = cached[1]
+            else:
+                result = None
+                if (key in self.__in_flight):
+                    self.__in_flight[key].append(callback)
+                    return
+
+                xml = DiscoveryXml.info(jid, node) if kind == "info" else DiscoveryXml.items(jid, node)
+                request_id = xml.get_attribute_by_name("id").value
+                self.__in_flight[key] = [callback]
+                self.__requests[request_id] = key
+
+                timer = threading.Timer(self.__timeout, self.__on_timeout, args=(request_id,))
+                timer.daemon = True
+                self.__timers[request_id] = timer
+                timer.start()
+
+        if (result is not None):
+            callback(result)
+            return
+
+        logger.debug(f"Requesting disco#{kind} of '{jid}' ({node})...")
+        try:
+            self.__ci.send_xml(xml)
+        except Exception as e:
+            self.__fail(request_id, f"Could not request disco#{kind} of '{jid}' ({node}): {e}")
+
+    def __hook_on_iq(self, iq: XmlElement):
+        id_attr = iq.get_attribute_by_name("id")
+        if (id_attr is None):
+            return iq
+
+        with self.__lock:
+            key = self.__requests.pop(id_attr.value, None)
+            timer = self.__timers.pop(id_attr.value, None)
+        if (key is None):
+            return iq
+
+        if (timer is not None):
+            timer.cancel()
+
+        kind, jid, node = key
+        result = None
+
+        type_attr = iq.get_attribute_by_name("type")
+        if (type_attr and type_attr.value == "result"):
+            query = iq.get_child_by_name("query")
+            if (query is not None):
+                if (kind == "info"):
+                    identities, features, forms = DiscoveryXml.parse_info(query)
+                    result = DiscoveryInfo(jid, node, identities, features, forms)
+                else:
+                    result = DiscoveryItems(jid, node, DiscoveryXml.parse_items(query))
+
+        with self.__lock:
+            if (result is not None):
+                self.__cache_result(key, result)
+            callbacks = self.__in_flight.pop(key, [])
+
+        for callback in callbacks:
+            callback(result)
+
+        return None
+
+    def __cache_result(self, key: Tuple[str, str, str], result: DiscoveryInfo | DiscoveryItems):
+        now = time.monotonic()
+
+        # Every entry lives as long, a refreshed one moves to the end to keep the order of expiry
+        self.__cache.pop(key, None)
+        self.__cache[key] = (now + self.__cache_ttl, result)
+
+        while (self.__cache):
+            oldest = next(iter(self.__cache))
+            if (self.__cache[oldest][0] > now and len(self.__cache) <= self.__cache_size):
+                break
+            del self.__cache[oldest]
+
+    def __on_timeout(self, request_id: str):
+        key = self.__requests.get(request_id)
+        if (key is not None):
+            # A late answer is not an answer to a known request anymore, and is passed on
+            self.__fail(request_id, f"No answer to disco#{key[0]} of '{key[1]}' ({key[2]}) in {self.__timeout}s")
+
+    def __fail(self, request_id: str, reason: str):
+        with self.__lock:
+            timer = self.__timers.pop(request_id, None)
+            key = self.__requests.pop(request_id, None)
+            if (key is None):
+                return
+            callbacks = self.__in_flight.pop(key, [])
+
+        if (timer is not None):
+            timer.cancel()
+
+        logger.warning(reason)
+        for callback in callbacks:
+            callback(None)
+
+    def __on_disconnect(self):
+        with self.__lock:
+            timers = list(self.__timers.values())
+            callbacks = [callback for waiting in self.__in_flight.values() for callback in waiting]
+            self.__timers.clear()
+            self.__requests.clear()
+            self.__in_flight.clear()
+
+        for timer in timers:
+            timer.cancel()
+
+        # The answers will never come
+        for callback in callbacks:
+            callback(None)
+
+
+class _DiscoveryCrawl:
+    def __init__(self, request: Callable, callback: Callable, max_depth: int, max_concurrency: int):
+        self.__request = request
+        self.__callback = callback
+        self.__max_depth = max_depth
+        self.__max_concurrency = max(1, max_concurrency)
+
+        self.__queue: deque = deque()
+        self.__seen = set()
+        self.__running = 0
+        self.__pumping = False
+        self.__finished = False
+
+        self.__infos: Dict[Tuple[str, str], DiscoveryInfo] = {}
+        self.__items: Dict[Tuple[str, str], DiscoveryItems] = {}
+
+        self.__lock = threading.Lock()
+
+    def start(self, jids: Iterable[str]):
+        with self.__lock:
+            for jid in jids:
+                self.__enqueue(jid, None, 0)
+        self.__pump()
+
+    def __enqueue(self, jid: str, node: str | None, depth: int):
+        kinds = ["info", "items"] if depth < self.__max_depth else ["info"]
+        for kind in kinds:
+            key = (kind, jid, node)
+            if (key in self.__seen):
+                continue
+            self.__seen.add(key)
+            self.__queue.append((kind, jid, node, depth))
+
+    def __pump(self):
+        with self.__lock:
+            if (self.__pumping):
+                return
+            self.__pumping = True
+
+        # Completions arriving meanwhile only update the state, this loop picks them up
+        while True:
+            with self.__lock:
+                tasks = []
+                while (self.__running < self.__max_concurrency and self.__queue):
+                    tasks.append(self.__queue.popleft())
+                    self.__running += 1
+
+                if (not tasks):
+                    self.__pumping = False
+                    done = (self.__running == 0 and not self.__finished)
+                    if (done):
+                        self.__finished = True
+                    break
+
+            for kind, jid, node, depth in tasks:
+                self.__request(kind, jid, node, self.__make_done(kind, jid, node, depth))
+
+        if (done):
+            self.__callback(self.__infos, self.__items)
+
+    def __make_done(self, kind: str, jid: str, node: str | None, depth: int) -> Callable:
+        def done(result):
+            with self.__lock:
+                self.__running -= 1
+                if (result is not None):
+                    if (kind == "info"):
+                        self.__infos[(jid, node)] = result
+                    else:
+                        self.__items[(jid, node)] = result
+                        for item_jid, item_node, _ in result.items:
+                            self.__enqueue(item_jid, item_node, depth + 1)
+            self.__pump()
+        return done
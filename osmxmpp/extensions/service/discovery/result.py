@@ -0,0 +1,60 @@
+from typing import Dict, List, Tuple
+
+
+class DiscoveryInfo:
+    """
+    Parsed disco#info result.
+
+    Attributes:
+        jid (str): The queried JID.
+        node (str): The queried node.
+        identities (List[Tuple[str, str, str, str]]): The identities as (category, type, lang, name).
+        features (Set[str]): The features.
+        forms (List[Dict[str, List[str]]]): The XEP-0128 extended information forms, as field var -> values.
+    """
+
+    def __init__(self, jid: str, node: str | None, identities: List[Tuple[str, str, str, str]], features: List[str], forms: List[Dict[str, List[str]]] = None):
+        self.jid = jid
+        self.node = node
+        self.identities = identities
+        self.features = set(features)
+        self.forms = forms or []
+
+    def has_identity(self, category: str, identity_type: str = None) -> bool:
+        """
+        Checks if the entity has the given identity.
+
+        Args:
+            category (str): The identity category.
+            identity_type (str): The identity type. If None, any type matches. (Default: None)
+
+        Returns:
+            bool: True if the entity has the identity, False otherwise.
+        """
+
+        for identity in self.identities:
+            if (identity[0] == category and (identity_type is None or identity[1] == identity_type)):
+                return True
+        return False
+
+    def __repr__(self):
+        return f"<DiscoveryInfo jid='{self.jid}' node='{self.node}' identities={len(self.identities)} features={len(self.features)}>"
+
+
+class DiscoveryItems:
+    """
+    Parsed disco#items result.
+
+    Attributes:
+        jid (str): The queried JID.
+        node (str): The queried node.
+        items (List[Tuple[str, str, str]]): The items as (jid, node, name).
+    """
+
+    def __init__(self, jid: str, node: str | None, items: List[Tuple[str, str, str]]):
+        self.jid = jid
+        self.node = node
+        self.items = items
+
+    def __repr__(self):
+        return f"<DiscoveryItems jid='{self.jid}' node='{self.node}' items={len(self.items)}>"
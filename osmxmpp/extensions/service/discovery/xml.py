@@ -1,22 +1,176 @@
 import uuid
 
+from typing import Dict, List, Tuple
+
 from osmxml import XmlParser
 from osmxml import XmlElement
 from osmxml import XmlAttribute
 from osmxml import XmlTextElement
 
 
+DISCO_INFO_NS = "http://jabber.org/protocol/disco#info"
+DISCO_ITEMS_NS = "http://jabber.org/protocol/disco#items"
+DATA_FORMS_NS = "jabber:x:data"
+
+
 class DiscoveryXml:
     @staticmethod
     def discover() -> XmlElement:
         xml_str = f"""
         <iq type='get' id='{DiscoveryXml.make_id()}'>
-          <query xmlns='http://jabber.org/protocol/disco#info'/>
+          <query xmlns='{DISCO_INFO_NS}'/>
         </iq>
         """
         return XmlParser.parse_elements(xml_str)[0]
 
     @staticmethod
-    def make_id():
-        return str(uuid.uuid4()) 
+    def info(jid_to: str, node: str = None) -> XmlElement:
+        return DiscoveryXml.query(DISCO_INFO_NS, jid_to, node)
+
+    @staticmethod
+    def items(jid_to: str, node: str = None) -> XmlElement:
+        return DiscoveryXml.query(DISCO_ITEMS_NS, jid_to, node)
+
+    @staticmethod
+    def query(xmlns: str, jid_to: str, node: str = None) -> XmlElement:
+        query = XmlElement("query", [XmlAttribute("xmlns", xmlns)])
+        if (node):
+            query.add_attribute(XmlAttribute("node", node))
+
+        return XmlElement(
+            "iq",
+            [
+                XmlAttribute("type", "get"),
+                XmlAttribute("to", jid_to),
+                XmlAttribute("id", DiscoveryXml.make_id()),
+            ],
+            [query]
+        )
+
+    @staticmethod
+    def info_result(
+                jid_to: str,
+                iq_id: str,
+                identities: List[Tuple[str, str, str, str]],
+                features: List[str],
+                node: str = None,
+            ) -> XmlElement:
+        query = XmlElement("query", [XmlAttribute("xmlns", DISCO_INFO_NS)])
+        if (node):
+            query.add_attribute(XmlAttribute("node", node))
+
+        for category, identity_type, lang, name in identities:
+            identity = XmlElement(
+                "identity",
+                [
+                    XmlAttribute("category", category),
+                    XmlAttribute("type", identity_type),
+                ]
+            )
+            if (lang):
+                identity.add_attribute(XmlAttribute("xml:lang", lang))
+            if (name):
+                identity.add_attribute(XmlAttribute("name", name))
+            query.add_child(identity)
+
+        for feature in features:
+            query.add_child(XmlElement("feature", [XmlAttribute("var", feature)]))
+
+        iq = XmlElement("iq", [XmlAttribute("type", "result"), XmlAttribute("id", iq_id)], [query])
+        if (jid_to):
+            iq.add_attribute(XmlAttribute("to", jid_to))
+        return iq
+
+    @staticmethod
+    def info_filter(xml: XmlElement) -> bool:
+        return DiscoveryXml.query_filter(xml, DISCO_INFO_NS)
+
+    @staticmethod
+    def items_filter(xml: XmlElement) -> bool:
+        return DiscoveryXml.query_filter(xml, DISCO_ITEMS_NS)
+
+    @staticmethod
+    def query_filter(xml: XmlElement, xmlns: str) -> bool:
+        if (xml.name != "iq"):
+            return False
+
+        query = xml.get_child_by_name("query")
+        if (query is None):
+            return False
 
+        query_xmlns = query.get_attribute_by_name("xmlns")
+        if ((query_xmlns is None) or (query_xmlns.value != xmlns)):
+            return False
+
+        return True
+
+    @staticmethod
+    def parse_info(query: XmlElement) -> Tuple[List[Tuple[str, str, str, str]], List[str], List[Dict[str, List[str]]]]:
+        identities = []
+        features = []
+        # XEP-0128 extended information, field var -> values
+        forms = []
+
+        for child in query.children:
+            if (child.name == "identity"):
+                identities.append(tuple(
+                    attr.value if attr else ""
+                    for attr in (
+                        child.get_attribute_by_name("category"),
+                        child.get_attribute_by_name("type"),
+                        child.get_attribute_by_name("xml:lang"),
+                        child.get_attribute_by_name("name"),
+                    )
+                ))
+            elif (child.name == "feature"):
+                var = child.get_attribute_by_name("var")
+                if (var):
+                    features.append(var.value)
+            elif (child.name == "x"):
+                xmlns = child.get_attribute_by_name("xmlns")
+                if (xmlns and xmlns.value == DATA_FORMS_NS):
+                    forms.append(DiscoveryXml.parse_form(child))
+
+        return identities, features, forms
+
+    @staticmethod
+    def parse_form(form: XmlElement) -> Dict[str, List[str]]:
+        fields = {}
+
+        for field in form.children:
+            if (not isinstance(field, XmlElement) or field.name != "field"):
+                continue
+
+            var = field.get_attribute_by_name("var")
+            if (var is None):
+                continue
+
+            fields[var.value] = [
+                "".join(text.text for text in value.children if isinstance(text, XmlTextElement))
+                for value in field.children
+                if isinstance(value, XmlElement) and value.name == "value"
+            ]
+
+        return fields
+
+    @staticmethod
+    def parse_items(query: XmlElement) -> List[Tuple[str, str, str]]:
+        items = []
+
+        for child in query.children:
+            if (child.name != "item"):
+                continue
+
+            jid = child.get_attribute_by_name("jid")
+            if (jid is None):
+                continue
+
+            node = child.get_attribute_by_name("node")
+            name = child.get_attribute_by_name("name")
+            items.append((jid.value, node.value if node else None, name.value if name else None))
+
+        return items
+
+    @staticmethod
+    def make_id():
+        return str(uuid.uuid4())
@@ -1,6 +1,6 @@
 from .abc import XmppFeature
 from .tls import TlsFeature
-from .sasl import SaslException, SaslMechanism, SaslFeature, PlainMechanism
+from .sasl import SaslException, SaslMechanism, SaslFeature, PlainMechanism, ScramMechanism, ScramSha1Mechanism, ScramSha256Mechanism
 from .bind import BindFeature
 
 __all__ = [
@@ -12,6 +12,9 @@ __all__ = [
     "SaslMechanism",
     "SaslFeature",
     "PlainMechanism",
+    "ScramMechanism",
+    "ScramSha1Mechanism",
+    "ScramSha256Mechanism",
 
     "BindFeature",
 ]
\ No newline at end of file
@@ -1,4 +1,7 @@
+import os
+import hmac
 import base64
+import hashlib
 from abc import ABC, abstractmethod
 
 from typing import List
@@ -73,6 +76,91 @@ class PlainMechanism(SaslMechanism):
         return data
 
 
+class ScramMechanism(SaslMechanism):
+    """
+    SCRAM SASL mechanism implementation (RFC 5802), without channel binding.
+    Use ``ScramSha1Mechanism`` or ``ScramSha256Mechanism``.
+
+    Attributes:
+        username (str): The username to authenticate with.
+        password (str): The password to authenticate with.
+    
+    Raises:
+        SaslException: If the server signature is invalid.
+    """
+
+    HASH = None
+
+    def __init__(self, username:str, password:str):
+        self.__username = username.replace("=", "=3D").replace(",", "=2C")
+        self.__password = password
+
+    def process(self, ci):
+        nonce = base64.b64encode(os.urandom(18)).decode()
+        client_first_bare = f"n={self.__username},r={nonce}"
+
+        ci.send_xml(self.__sasl_xml("auth", f"n,,{client_first_bare}", [XmlAttribute("mechanism", self.NAME)]))
+        data = ci.recv_xml()
+        if data.name != "challenge":
+            return data
+
+        server_first = base64.b64decode(data.children[0].text).decode("utf-8")
+        fields = dict(field.split("=", 1) for field in server_first.split(","))
+        if not fields["r"].startswith(nonce):
+            raise SaslException("SCRAM server nonce does not extend the client nonce")
+
+        salted_password = hashlib.pbkdf2_hmac(self.HASH, self.__password.encode("utf-8"), base64.b64decode(fields["s"]), int(fields["i"]))
+        client_key = hmac.digest(salted_password, b"Client Key", self.HASH)
+        stored_key = hashlib.new(self.HASH, client_key).digest()
+
+        client_final = f"c=biws,r={fields['r']}"
+        auth_message = f"{client_first_bare},{server_first},{client_final}".encode("utf-8")
+        client_signature = hmac.digest(stored_key, auth_message, self.HASH)
+        proof = bytes(a ^ b for a, b in zip(client_key, client_signature))
+
+        ci.send_xml(self.__sasl_xml("response", f"{client_final},p={base64.b64encode(proof).decode()}"))
+        data = ci.recv_xml()
+        if data.name != "success":
+            return data
+
+        server_key = hmac.digest(salted_password, b"Server Key", self.HASH)
+        server_signature = base64.b64encode(hmac.digest(server_key, auth_message, self.HASH)).decode()
+        server_final = base64.b64decode(data.children[0].text).decode("utf-8") if data.children else ""
+        if not hmac.compare_digest(server_final, f"v={server_signature}"):
+            raise SaslException("Invalid SCRAM server signature")
+
+        return data
+
+    def __sasl_xml(self, name:str, content:str, attributes:list = None) -> XmlElement:
+        return XmlElement(
+            name,
+
+            attributes = [
+                XmlAttribute("xmlns", "urn:ietf:params:xml:ns:xmpp-sasl"),
+            ] + (attributes or []),
+
+            children = [
+                XmlTextElement(base64.b64encode(content.encode("utf-8")).decode()),
+            ]
+        )
+
+class ScramSha1Mechanism(ScramMechanism):
+    """
+    SCRAM-SHA-1 SASL mechanism implementation.
+    """
+
+    NAME = "SCRAM-SHA-1"
+    HASH = "sha1"
+
+class ScramSha256Mechanism(ScramMechanism):
+    """
+    SCRAM-SHA-256 SASL mechanism implementation.
+    """
+
+    NAME = "SCRAM-SHA-256"
+    HASH = "sha256"
+
+
 class SaslFeature(XmppFeature):
     """
     SASL feature implementation.
@@ -38,6 +38,8 @@ class TlsFeature(XmppFeature):
     ]
 
     def __init__(self, ssl_context=None, verify_locations=None):
+        self.__ssl_context = ssl_context
+
         if ssl_context is None:
             logger.debug(f"Creating default SSL context...")
             self.__ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
@@ -68,7 +70,7 @@ class TlsFeature(XmppFeature):
             return None
         
         logger.debug(f"Wrapping socket...")
-        tls_socket = self.__ssl_context.wrap_socket(self.__ci.get_socket(), server_hostname=self.__ci.get_host())
+        tls_socket = self.__ssl_context.wrap_socket(self.__ci.get_socket(), server_hostname=self.__ci.get_domain())
         
         logger.debug(f"Performing TLS handshake...")
         tls_socket.do_handshake()
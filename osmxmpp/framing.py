@@ -0,0 +1,114 @@
+from xml.parsers import expat
+
+from typing import List, Tuple
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class XmppStreamFramer:
+    """
+    Splits the received stream into complete top-level stanzas, before they are parsed.
+
+    Reads can end anywhere, in a tag or in a multibyte character, and the XML parser
+    does not always fail on an incomplete stanza. The framer runs expat over the stream
+    and only gives out stanzas whose end tag was received, the rest stays buffered.
+    """
+
+    # The stream header was read during the negotiation, the framer opens one of its own
+    __ROOT = b"<stream:stream>"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the buffered data, for a new stream.
+        """
+
+        self.__parser = expat.ParserCreate()
+        # expat 2.6 defers parsing an incomplete token until more data comes, an end tag
+        # split over reads would keep its stanza back until the next read
+        if (hasattr(self.__parser, "SetReparseDeferralEnabled")):
+            self.__parser.SetReparseDeferralEnabled(False)
+        self.__parser.StartElementHandler = self.__on_start
+        self.__parser.EndElementHandler = self.__on_end
+
+        self.__buffer = bytearray()
+        # Stream index of the first buffered byte
+        self.__base = len(self.__ROOT)
+
+        self.__depth = 0
+        # Whether the last event was a start tag, an end tag right after it may be an empty-element tag
+        self.__started = False
+        # Buffer indexes of the ends of the completed stanzas, and whether they are empty-element tags
+        self.__ends: List[Tuple[int, bool]] = []
+
+        self.__parser.Parse(self.__ROOT, False)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Adds received data.
+
+        Args:
+            data (bytes): The data, as returned by ``recv``.
+
+        Returns:
+            List[bytes]: The stanzas completed by the data, in order. Consecutive stanzas are
+            given as one chunk, to be parsed at once, but an empty-element stanza is always alone.
+        """
+
+        self.__buffer += data
+        try:
+            self.__parser.Parse(data, False)
+        except expat.ExpatError as e:
+            logger.warning(f"Dropping {len(self.__buffer)} bytes of malformed XML: {e}")
+            self.reset()
+            return []
+
+        if (not self.__ends):
+            return []
+
+        chunks = []
+        position = 0
+        for end, empty in self.__ends:
+            if (empty):
+                start = self.__buffer.rfind(b"<", position, end)
+                if (start > position):
+                    chunks.append(bytes(self.__buffer[position:start]))
+                chunks.append(bytes(self.__buffer[start:end]))
+                position = end
+        end = self.__ends[-1][0]
+        if (end > position):
+            chunks.append(bytes(self.__buffer[position:end]))
+
+        del self.__buffer[:end]
+        self.__base += end
+        self.__ends = []
+        return chunks
+
+    def __len__(self) -> int:
+        """
+        The number of buffered bytes, of stanzas not received completely.
+        """
+
+        return len(self.__buffer)
+
+    def __on_start(self, name, attributes):
+        self.__depth += 1
+        self.__started = True
+
+    def __on_end(self, name):
+        started, self.__started = self.__started, False
+        self.__depth -= 1
+        if (self.__depth != 1):
+            return
+
+        relative = self.__parser.CurrentByteIndex - self.__base
+        # expat gives the end of an empty-element tag, and the start of an end tag
+        if (started and self.__buffer[relative - 2:relative] == b"/>"):
+            self.__ends.append((relative, True))
+        else:
+            self.__ends.append((self.__buffer.index(b">", relative) + 1, False))
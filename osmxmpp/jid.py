@@ -0,0 +1,184 @@
+import unicodedata
+
+from functools import lru_cache
+
+
+# Not allowed in a localpart, RFC 7622 section 3.3.1
+LOCAL_FORBIDDEN = frozenset("\"&'/:<>@")
+# Not allowed in a domainpart, besides spaces and control characters
+DOMAIN_FORBIDDEN = frozenset("\"&'/:<>@\\")
+
+# Octets of every part, RFC 7622 section 3.1
+MAX_PART_SIZE = 1023
+
+# Distinct JIDs kept parsed
+CACHE_SIZE = 4096
+
+
+class Jid(str):
+    """
+    A JID, normalized as in RFC 7622, with its parts parsed once.
+
+    A ``Jid`` is a string, it can be passed anywhere a string JID is accepted and compares
+    equal to its normalized string: the localpart and domainpart are lowercased, and all
+    parts are NFC-normalized. JIDs are interned through an LRU cache, so a JID seen again
+    is neither parsed nor validated again and gives the same object.
+
+    Attributes:
+        local (str | None): The localpart, None for a domain JID.
+        domain (str): The domainpart.
+        resource (str | None): The resourcepart, None for a bare JID.
+        bare (Jid): The JID without its resource, itself if it has none.
+
+    Raises:
+        ValidationException: If the JID is invalid.
+
+    Example:
+        >>> jid = Jid("Juliet@Example.com/balcony")
+        >>> jid
+        Jid('juliet@example.com/balcony')
+        >>> jid.bare, jid.resource
+        (Jid('juliet@example.com'), 'balcony')
+    """
+
+    def __new__(cls, jid: str) -> "Jid":
+        if (type(jid) is Jid):
+            return jid
+        if (not isinstance(jid, str)):
+            _invalid(jid, "is not a string")
+        return _intern(jid)
+
+    def with_resource(self, resource: str) -> "Jid":
+        """
+        Gets the full JID of the bare JID with the given resource.
+
+        Args:
+            resource (str): The resource.
+
+        Returns:
+            Jid: The full JID.
+        """
+
+        return Jid(f"{self.bare}/{resource}")
+
+    @staticmethod
+    def cache_info():
+        """
+        Gets the hits, misses and size of the JID cache.
+        """
+
+        return _intern.cache_info()
+
+    def __repr__(self):
+        return f"Jid({str.__repr__(self)})"
+
+    def __reduce__(self):
+        return (Jid, (str(self),))
+
+
+def bare_jid(jid: str) -> str:
+    """
+    Gets the bare form of a JID received from the network, without raising:
+    normalized if the JID is valid, only cut at the resource otherwise.
+
+    Args:
+        jid (str): The JID.
+
+    Returns:
+        str: The bare JID.
+    """
+
+    try:
+        return Jid(jid).bare
+    except Exception:
+        return jid.split("/")[0]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _intern(jid: str) -> Jid:
+    # RFC 7622 section 3.2: the resource is cut at the first slash, then the local part at the first at sign
+    rest, slash, resource = jid.partition("/")
+    local, at, domain = rest.partition("@")
+    if (not at):
+        local, domain = None, rest
+
+    local = _normalize_local(jid, local) if at else None
+    domain = _normalize_domain(jid, domain)
+    resource = _normalize_resource(jid, resource) if slash else None
+
+    bare = f"{local}@{domain}" if local is not None else domain
+    normalized = f"{bare}/{resource}" if resource is not None else bare
+    if (normalized != jid):
+        # Different spellings of a JID give the same object
+        return _intern(normalized)
+
+    instance = str.__new__(Jid, normalized)
+    instance.local = local
+    instance.domain = domain
+    instance.resource = resource
+    instance.bare = instance if resource is None else _intern(bare)
+    return instance
+
+def _normalize_local(jid: str, local: str) -> str:
+    # UsernameCaseMapped profile: width mapping, lowercase, NFC
+    if (not local.isascii()):
+        local = "".join(_narrow(character) for character in local)
+    local = unicodedata.normalize("NFC", local.lower())
+
+    if (not local):
+        _invalid(jid, "has an empty localpart")
+    if (any(character in LOCAL_FORBIDDEN or _is_space_or_control(character) for character in local)):
+        _invalid(jid, "has a forbidden character in its localpart")
+    _check_size(jid, local, "localpart")
+    return local
+
+def _normalize_domain(jid: str, domain: str) -> str:
+    domain = unicodedata.normalize("NFC", domain.lower())
+    # The root label is not part of the domain
+    if (domain.endswith(".")):
+        domain = domain[:-1]
+
+    if (not domain):
+        _invalid(jid, "has an empty domainpart")
+    if (domain.startswith("[") and domain.endswith("]")):
+        # IPv6 address
+        if (not all(character in "0123456789abcdef:." for character in domain[1:-1])):
+            _invalid(jid, "has an invalid IPv6 domainpart")
+        return domain
+    if (any(character in DOMAIN_FORBIDDEN or _is_space_or_control(character) for character in domain)):
+        _invalid(jid, "has a forbidden character in its domainpart")
+    if (any(not label or len(label) > 63 or label.startswith("-") or label.endswith("-") for label in domain.split("."))):
+        _invalid(jid, "has an invalid label in its domainpart")
+    _check_size(jid, domain, "domainpart")
+    return domain
+
+def _normalize_resource(jid: str, resource: str) -> str:
+    # OpaqueString profile: spaces mapped to the ASCII space, NFC, no case mapping
+    if (not resource.isascii()):
+        resource = "".join(" " if unicodedata.category(character) == "Zs" else character for character in resource)
+        resource = unicodedata.normalize("NFC", resource)
+
+    if (not resource):
+        _invalid(jid, "has an empty resourcepart")
+    if (any(unicodedata.category(character) == "Cc" for character in resource)):
+        _invalid(jid, "has a control character in its resourcepart")
+    _check_size(jid, resource, "resourcepart")
+    return resource
+
+def _narrow(character: str) -> str:
+    decomposition = unicodedata.decomposition(character)
+    if (decomposition.startswith(("<wide>", "<narrow>"))):
+        return chr(int(decomposition.split()[1], 16))
+    return character
+
+def _is_space_or_control(character: str) -> bool:
+    return character.isspace() or unicodedata.category(character) in ("Cc", "Cf")
+
+def _check_size(jid: str, part: str, name: str):
+    if (len(part) > MAX_PART_SIZE // 4 and len(part.encode("utf-8")) > MAX_PART_SIZE):
+        _invalid(jid, f"has a {name} longer than {MAX_PART_SIZE} octets")
+
+def _invalid(jid, reason: str):
+    # Imported here, the validation module imports this one
+    from .validation import ValidationException
+    raise ValidationException(f"JID '{jid}' {reason}")
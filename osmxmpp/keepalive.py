@@ -0,0 +1,252 @@
+import time
+import uuid
+import threading
+
+from typing import Callable
+
+from osmxml import XmlElement, XmlAttribute
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+PING_NS = "urn:xmpp:ping"
+
+
+class XmppKeepalive:
+    """
+    Whitespace keepalives, XEP-0199 pings and dead connection detection.
+    Enable it with ``client.enable_keepalive()``.
+
+    A space is sent when nothing was written for ``interval`` seconds, which keeps NATs and
+    proxies from dropping an idle connection. The server is pinged every ``ping_interval``
+    seconds. If a ping gets no answer in ``timeout`` seconds and nothing else was read
+    meanwhile, the connection is taken as dead and the client disconnects.
+
+    Round-trip times of the pings are smoothed like TCP does: ``rtt`` moves by 1/8 of every
+    sample and ``rtt_deviation`` by 1/4 of its distance to it.
+
+    Pings from the server are answered.
+
+    Attributes:
+        interval (float): Seconds without writing before a whitespace keepalive, none to not send them. (Default: 60)
+        ping_interval (float): Seconds between pings, none to not ping. (Default: 120)
+        timeout (float): Seconds to wait for the answer to a ping. (Default: 30)
+    """
+
+    RTT_GAIN = 1 / 8
+    DEVIATION_GAIN = 1 / 4
+
+    def __init__(self, interval: float = 60, ping_interval: float = 120, timeout: float = 30):
+        self.interval = interval
+        self.ping_interval = ping_interval
+        self.timeout = timeout
+
+        self.last_received = time.monotonic()
+        self.last_sent = time.monotonic()
+
+        self.__rtt: float | None = None
+        self.__rtt_deviation: float | None = None
+        self.__last_rtt: float | None = None
+        self.__pings = 0
+        self.__timeouts = 0
+
+        # ID and monotonic time of the ping waiting for its answer
+        self.__ping_id: str | None = None
+        self.__ping_sent = 0.0
+
+        self.__write: Callable | None = None
+        self.__send_xml: Callable | None = None
+        self.__on_dead: Callable | None = None
+        self.__server: str | None = None
+
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread: threading.Thread | None = None
+
+    @property
+    def rtt(self) -> float | None:
+        """
+        The smoothed round-trip time to the server in seconds, None before the first answered ping.
+        """
+        return self.__rtt
+
+    @property
+    def rtt_deviation(self) -> float | None:
+        """
+        The smoothed deviation of the round-trip times in seconds, None before the first answered ping.
+        """
+        return self.__rtt_deviation
+
+    @property
+    def last_rtt(self) -> float | None:
+        """
+        The round-trip time of the last answered ping in seconds.
+        """
+        return self.__last_rtt
+
+    def stats(self) -> dict:
+        """
+        Gets the keepalive statistics.
+
+        Returns:
+            dict: The smoothed ``rtt``, the ``rtt_deviation`` and the ``last_rtt`` in seconds,
+            the ``pings`` sent and the ``timeouts``.
+        """
+
+        return {
+            "rtt": self.__rtt,
+            "rtt_deviation": self.__rtt_deviation,
+            "last_rtt": self.__last_rtt,
+            "pings": self.__pings,
+            "timeouts": self.__timeouts,
+        }
+
+    def start(self, write: Callable, send_xml: Callable, on_dead: Callable, server: str):
+        """
+        Starts the keepalive thread. Called by the client once it is ready.
+
+        Args:
+            write (Callable): Writes raw data to the stream.
+            send_xml (Callable): Sends an element.
+            on_dead (Callable): Called with the reason when the connection is taken as dead.
+            server (str): The domain of the server to ping.
+        """
+
+        self.stop()
+
+        self.__write = write
+        self.__send_xml = send_xml
+        self.__on_dead = on_dead
+        self.__server = server
+
+        self.last_received = self.last_sent = self.__ping_sent = time.monotonic()
+        self.__ping_id = None
+
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(self.__stopped,), name="XmppKeepalive", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the keepalive thread.
+        """
+
+        self.__stopped.set()
+        thread, self.__thread = self.__thread, None
+        if (thread is not None and thread is not threading.current_thread()):
+            thread.join()
+
+    def ping(self):
+        """
+        Pings the server now, unless a ping is already waiting for its answer.
+        """
+
+        with self.__lock:
+            if (self.__ping_id is not None or self.__send_xml is None):
+                return
+            self.__ping_id = f"ping-{uuid.uuid4().hex}"
+            self.__ping_sent = time.monotonic()
+            self.__pings += 1
+            ping_id = self.__ping_id
+
+        self.__send_xml(XmlElement(
+            "iq",
+            [
+                XmlAttribute("type", "get"),
+                XmlAttribute("to", self.__server),
+                XmlAttribute("id", ping_id),
+            ],
+            [XmlElement("ping", [XmlAttribute("xmlns", PING_NS)])]
+        ))
+
+    def on_iq(self, iq: XmlElement) -> bool:
+        """
+        Handles the answers to pings and the pings of the server. Called by the client for every IQ.
+
+        Args:
+            iq (XmlElement): The received IQ.
+
+        Returns:
+            bool: Whether the IQ was handled, and should not be dispatched.
+        """
+
+        id_attr = iq.get_attribute_by_name("id")
+        if (id_attr is None):
+            return False
+
+        type_attr = iq.get_attribute_by_name("type")
+        iq_type = type_attr.value if type_attr else None
+
+        if (iq_type in ("result", "error")):
+            with self.__lock:
+                if (id_attr.value != self.__ping_id):
+                    return False
+                self.__ping_id = None
+                # An error still went to the server and back
+                self.__observe(time.monotonic() - self.__ping_sent)
+            return True
+
+        if (iq_type == "get"):
+            ping = iq.get_child_by_name("ping")
+            xmlns = ping.get_attribute_by_name("xmlns") if ping else None
+            if (xmlns is None or xmlns.value != PING_NS):
+                return False
+
+            result = XmlElement("iq", [XmlAttribute("type", "result"), XmlAttribute("id", id_attr.value)])
+            from_attr = iq.get_attribute_by_name("from")
+            if (from_attr):
+                result.add_attribute(XmlAttribute("to", from_attr.value))
+            self.__send_xml(result)
+            return True
+
+        return False
+
+    def __observe(self, sample: float):
+        self.__last_rtt = sample
+        if (self.__rtt is None):
+            self.__rtt = sample
+            self.__rtt_deviation = sample / 2
+            return
+        self.__rtt_deviation += self.DEVIATION_GAIN * (abs(sample - self.__rtt) - self.__rtt_deviation)
+        self.__rtt += self.RTT_GAIN * (sample - self.__rtt)
+
+    def __run(self, stopped: threading.Event):
+        while not stopped.wait(self.__next_check()):
+            try:
+                self.__check()
+            except Exception as e:
+                # The connection is closing, the client stops the keepalive
+                logger.debug("Keepalive check failed: %s", e)
+
+    def __next_check(self) -> float:
+        # Checked often enough to act within a tenth of the shortest period
+        periods = [period for period in (self.interval, self.ping_interval, self.timeout) if period]
+        return max(min(periods) / 10, 0.01) if periods else 1.0
+
+    def __check(self):
+        now = time.monotonic()
+
+        with self.__lock:
+            waiting = self.__ping_id is not None
+            ping_sent = self.__ping_sent
+
+        if (waiting and now - ping_sent >= self.timeout):
+            self.__timeouts += 1
+            if (self.last_received <= ping_sent):
+                logger.warning(f"No answer to the ping in {self.timeout}s, the connection is dead")
+                self.__stopped.set()
+                self.__on_dead(f"no answer to the ping in {self.timeout}s")
+                return
+
+            # Lost, but the connection is alive since something else was read
+            with self.__lock:
+                self.__ping_id = None
+            waiting = False
+
+        if (self.ping_interval and not waiting and now - ping_sent >= self.ping_interval):
+            self.ping()
+        elif (self.interval and now - self.last_sent >= self.interval):
+            self.__write(b" ")
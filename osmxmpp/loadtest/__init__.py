@@ -0,0 +1,396 @@
+"""
+Load generator running many concurrent client sessions against a server.
+
+Run it with ``python -m osmxmpp.loadtest``.
+"""
+
+import os
+import ssl
+import time
+import threading
+import multiprocessing
+
+from typing import Dict, List
+
+from osmxml import *
+
+from ..client import XmppClient
+from ..features import TlsFeature, SaslFeature, BindFeature, PlainMechanism, ScramSha1Mechanism, ScramSha256Mechanism
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+MECHANISMS = {
+    "PLAIN": PlainMechanism,
+    "SCRAM-SHA-1": ScramSha1Mechanism,
+    "SCRAM-SHA-256": ScramSha256Mechanism,
+}
+
+PATTERNS = ("echo", "pairs")
+
+
+def percentiles(values: List[float], scale: float = 1.0) -> Dict[str, float]:
+    """
+    Gets the p50, p90, p99 and max of the values, nearest-rank.
+    """
+
+    if (not values):
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+
+    values = sorted(values)
+    def rank(percent: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * percent / 100))] * scale
+
+    return {"p50": rank(50), "p90": rank(90), "p99": rank(99), "max": values[-1] * scale}
+
+def rss() -> int:
+    """
+    Gets the resident memory of the process in bytes, the peak where ``/proc`` is not available.
+    """
+
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Session:
+    def __init__(self, index: int, client: XmppClient):
+        self.index = index
+        self.client = client
+        self.thread: threading.Thread | None = None
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.started = 0.0
+        self.connect_time: float | None = None
+        self.error: Exception | None = None
+
+
+class LoadTest:
+    """
+    Load test of concurrent client sessions, every session runs in its own thread.
+
+    Messages carry their send time, so the latency is measured where they arrive:
+    with the ``echo`` pattern sessions send to ``echo@<domain>`` and measure the
+    round trip, with ``pairs`` session ``2k`` and ``2k + 1`` send to each other
+    and measure the one-way latency.
+
+    Attributes:
+        host (str): The host of the server.
+        port (int): The port of the server.
+        domain (str): The XMPP domain of the server. If none, the host. (Default: None)
+        ssl_context (ssl.SSLContext): The client SSL context. If none, STARTTLS is not used. (Default: None)
+        sessions (int): The number of sessions. (Default: 100)
+        pattern (str): ``echo`` or ``pairs``. (Default: "echo")
+        rate (float): The messages per second sent by every session. (Default: 1.0)
+        size (int): The message body size in bytes. (Default: 100)
+        presence_interval (float): The seconds between presence updates of every session. If none, only the initial one. (Default: None)
+        duration (float): The seconds of traffic. (Default: 10.0)
+        connect_concurrency (int): The number of sessions connecting at the same time. (Default: 50)
+        mechanism (str): The SASL mechanism. (Default: "PLAIN")
+        password (str): The password of every user, named ``user<index>``. (Default: "password")
+    """
+
+    def __init__(
+                self,
+                host: str,
+                port: int,
+                domain: str = None,
+                ssl_context: ssl.SSLContext = None,
+                sessions: int = 100,
+                pattern: str = "echo",
+                rate: float = 1.0,
+                size: int = 100,
+                presence_interval: float = None,
+                duration: float = 10.0,
+                connect_concurrency: int = 50,
+                mechanism: str = "PLAIN",
+                password: str = "password",
+            ):
+        if (pattern not in PATTERNS):
+            raise ValueError(f"Unknown traffic pattern '{pattern}'")
+        if (pattern == "pairs" and sessions % 2):
+            raise ValueError("The pairs pattern needs an even number of sessions")
+
+        self.host = host
+        self.port = port
+        self.domain = domain or host
+        self.ssl_context = ssl_context
+        self.sessions = sessions
+        self.pattern = pattern
+        self.rate = rate
+        self.size = size
+        self.presence_interval = presence_interval
+        self.duration = duration
+        self.connect_concurrency = connect_concurrency
+        self.mechanism = mechanism
+        self.password = password
+
+        self.__sessions: List[_Session] = []
+        self.__latencies: List[float] = []
+        self.__counters = {
+            "sent": 0,
+            "received": 0,
+            "presences_sent": 0,
+            "presences_received": 0,
+        }
+        self.__counters_lock = threading.Lock()
+        self.__traffic = False
+
+    def run(self) -> Dict:
+        """
+        Connects the sessions, runs the traffic, disconnects and reports.
+
+        Returns:
+            Dict: The report, serializable to JSON. Times are in milliseconds, CPU per stanza
+            in microseconds and memory in bytes. The CPU time is the one of the whole process.
+        """
+
+        rss_before = rss()
+
+        connect_start = time.perf_counter()
+        self.__connect_all()
+        connect_elapsed = time.perf_counter() - connect_start
+
+        connected = [session for session in self.__sessions if session.ready.is_set() and session.error is None]
+        rss_connected = rss()
+
+        logger.info(f"{len(connected)}/{self.sessions} sessions connected in {connect_elapsed:.2f}s")
+
+        cpu_start = time.process_time()
+        traffic_start = time.perf_counter()
+        self.__run_traffic(connected)
+        traffic_elapsed = time.perf_counter() - traffic_start
+        cpu_elapsed = time.process_time() - cpu_start
+
+        self.__disconnect_all()
+
+        stanzas = sum(self.__counters.values())
+        return {
+            "sessions": self.sessions,
+            "connected": len(connected),
+            "failed": self.sessions - len(connected),
+            "pattern": self.pattern,
+            "connect": {
+                "total": connect_elapsed * 1000,
+                **percentiles([session.connect_time for session in connected], 1000),
+            },
+            "duration": traffic_elapsed,
+            **self.__counters,
+            "lost": self.__counters["sent"] - self.__counters["received"],
+            "throughput": self.__counters["received"] / traffic_elapsed if traffic_elapsed else 0,
+            "latency": percentiles(self.__latencies, 1000),
+            "rss": rss_connected,
+            "rss_per_session": (rss_connected - rss_before) / len(connected) if connected else None,
+            "cpu": cpu_elapsed,
+            "cpu_per_stanza": cpu_elapsed / stanzas * 1e6 if stanzas else None,
+        }
+
+    # Sessions
+    def __create_client(self, index: int) -> XmppClient:
+        client = XmppClient(self.host, self.port, domain=self.domain)
+        if (self.ssl_context is not None):
+            client.connect_feature(TlsFeature(self.ssl_context), TlsFeature.REQUIRED_PERMISSIONS)
+        client.connect_feature(
+            SaslFeature([MECHANISMS[self.mechanism](f"user{index}", self.password)]),
+            SaslFeature.REQUIRED_PERMISSIONS
+        )
+        client.connect_feature(BindFeature(f"load{index}"), BindFeature.REQUIRED_PERMISSIONS)
+        return client
+
+    def __connect_all(self):
+        slots = threading.Semaphore(self.connect_concurrency)
+
+        for index in range(self.sessions):
+            session = _Session(index, self.__create_client(index))
+            self.__sessions.append(session)
+
+            session.client.on_ready(lambda session=session: self.__on_ready(session, slots))
+            session.client.on_message(lambda message, session=session: self.__on_message(session, message))
+            session.client.on_presence(lambda presence: self.__on_presence())
+
+            slots.acquire()
+            session.started = time.perf_counter()
+            session.thread = threading.Thread(target=self.__run_session, args=(session, slots), name=f"loadtest-{index}", daemon=True)
+            session.thread.start()
+
+        for session in self.__sessions:
+            while (not session.ready.wait(0.1) and not session.done.is_set()):
+                pass
+
+    def __run_session(self, session: _Session, slots: threading.Semaphore):
+        try:
+            session.client.connect()
+        except Exception as e:
+            session.error = e
+            logger.debug(f"Session {session.index} failed: {e}")
+        finally:
+            if (not session.ready.is_set()):
+                slots.release()
+            session.done.set()
+
+    def __on_ready(self, session: _Session, slots: threading.Semaphore):
+        session.connect_time = time.perf_counter() - session.started
+        session.ready.set()
+        slots.release()
+
+    def __disconnect_all(self):
+        for session in self.__sessions:
+            if (session.client.connected):
+                try:
+                    session.client.disconnect()
+                except Exception as e:
+                    logger.debug(f"Session {session.index} disconnect failed: {e}")
+
+        for session in self.__sessions:
+            session.done.wait(5)
+
+    # Traffic
+    def __on_message(self, session: _Session, message):
+        body = message.body
+        if (not self.__traffic or not body):
+            return
+
+        sent_at = body.split(" ", 1)[0]
+        if (sent_at.isdigit()):
+            self.__latencies.append((time.perf_counter_ns() - int(sent_at)) / 1e9)
+            self.__count("received")
+
+    def __on_presence(self):
+        if (self.__traffic):
+            self.__count("presences_received")
+
+    def __count(self, counter: str):
+        # Handlers run in the threads of all sessions
+        with self.__counters_lock:
+            self.__counters[counter] += 1
+
+    def __target(self, session: _Session) -> str:
+        if (self.pattern == "echo"):
+            return f"echo@{self.domain}"
+        return f"user{session.index ^ 1}@{self.domain}"
+
+    def __run_traffic(self, sessions: List[_Session]):
+        self.__traffic = True
+        if (not sessions):
+            return
+
+        padding = "x" * max(0, self.size - 20)
+        message_interval = 1 / (self.rate * len(sessions)) if self.rate > 0 else None
+        presence_interval = self.presence_interval / len(sessions) if self.presence_interval else None
+
+        start = time.perf_counter()
+        end = start + self.duration
+        next_message = next_presence = start
+        message_index = presence_index = 0
+
+        # One sender thread spreads the messages of all sessions evenly over time
+        while True:
+            now = time.perf_counter()
+            if (now >= end):
+                break
+
+            if (message_interval and now >= next_message):
+                session = sessions[message_index % len(sessions)]
+                message_index += 1
+                next_message += message_interval
+                self.__send(session, lambda: session.client.send_message(self.__target(session), f"{time.perf_counter_ns()} {padding}"), "sent")
+                continue
+
+            if (presence_interval and now >= next_presence):
+                session = sessions[presence_index % len(sessions)]
+                presence_index += 1
+                next_presence += presence_interval
+                presence = XmlElement("presence", children=[XmlElement("status", children=[XmlTextElement(f"Status {presence_index}")])])
+                self.__send(session, lambda: session.client._send_xml(presence), "presences_sent")
+                continue
+
+            upcoming = min(value for value in (
+                next_message if message_interval else end,
+                next_presence if presence_interval else end,
+                end,
+            ))
+            time.sleep(max(0, upcoming - time.perf_counter()))
+
+        # Wait for the messages still in flight
+        deadline = time.perf_counter() + 5
+        while (self.__counters["received"] < self.__counters["sent"] and time.perf_counter() < deadline):
+            time.sleep(0.01)
+        self.__traffic = False
+
+    def __send(self, session: _Session, send, counter: str):
+        if (not session.client.connected):
+            return
+        try:
+            send()
+            self.__count(counter)
+        except Exception as e:
+            logger.debug(f"Session {session.index} send failed: {e}")
+
+
+def _serve(connection, kwargs: Dict):
+    from ..testing import FakeXmppServer
+
+    server = FakeXmppServer(**kwargs).start()
+    connection.send((server.port, server.certificate))
+    # Stop when asked, or when the parent is gone
+    try:
+        connection.recv()
+        connection.send(server.stats())
+    except EOFError:
+        pass
+    server.stop()
+
+
+class LocalServer:
+    """
+    ``FakeXmppServer`` in a child process, so it does not share the CPU and memory
+    of the load test process.
+
+    Attributes:
+        **kwargs: The ``FakeXmppServer`` arguments.
+    """
+
+    def __init__(self, **kwargs):
+        self.__kwargs = kwargs
+        self.__connection = None
+        self.__process = None
+
+        self.host = kwargs.get("host", "127.0.0.1")
+        self.domain = kwargs.get("domain", "example.test")
+        self.port: int | None = None
+        self.certificate: bytes | None = None
+
+    def start(self) -> "LocalServer":
+        context = multiprocessing.get_context("spawn")
+        self.__connection, child_connection = context.Pipe()
+        self.__process = context.Process(target=_serve, args=(child_connection, self.__kwargs), daemon=True)
+        self.__process.start()
+        self.port, self.certificate = self.__connection.recv()
+        return self
+
+    def stop(self) -> Dict[str, int]:
+        """
+        Stops the server.
+
+        Returns:
+            Dict[str, int]: The server counters.
+        """
+
+        self.__connection.send(None)
+        stats = self.__connection.recv()
+        self.__process.join(5)
+        return stats
+
+
+__all__ = [
+    "LoadTest",
+    "LocalServer",
+    "percentiles",
+    "rss",
+]
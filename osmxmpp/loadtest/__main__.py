@@ -0,0 +1,109 @@
+"""
+Runs a load test of concurrent client sessions.
+
+Without --host, a FakeXmppServer is started in a child process.
+
+Usage:
+    python -m osmxmpp.loadtest [--sessions 100] [--rate 1] [--duration 10] [--pattern echo]
+    python -m osmxmpp.loadtest --sessions 1000 --pattern pairs --presence-interval 5 --latency 0.01
+    python -m osmxmpp.loadtest --host xmpp.example.org --domain example.org --no-tls --json
+"""
+
+import sys
+import json
+import ssl
+import argparse
+import threading
+
+from . import LoadTest, LocalServer, MECHANISMS, PATTERNS
+from ..testing.certificate import make_client_context
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m osmxmpp.loadtest", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--pattern", choices=PATTERNS, default="echo")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per session")
+    parser.add_argument("--size", type=int, default=100, help="message body size in bytes")
+    parser.add_argument("--presence-interval", type=float, help="seconds between presence updates of a session")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--connect-concurrency", type=int, default=50)
+    parser.add_argument("--mechanism", choices=list(MECHANISMS), default="PLAIN")
+    parser.add_argument("--no-tls", action="store_true")
+    parser.add_argument("--host", help="server to test, a local one if not given")
+    parser.add_argument("--port", type=int, default=5222)
+    parser.add_argument("--domain")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--latency", type=float, default=0.0, help="local server latency in seconds")
+    parser.add_argument("--rate-limit", type=int, help="local server read limit in bytes per second")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    # Thread stacks are mostly untouched, a smaller reservation keeps thousands of sessions cheap
+    threading.stack_size(512 * 1024)
+
+    server = None
+    if (args.host is None):
+        rosters = {}
+        if (args.pattern == "pairs"):
+            for index in range(args.sessions):
+                rosters[f"user{index}"] = [f"user{index ^ 1}@example.test"]
+
+        server = LocalServer(
+            tls=not args.no_tls,
+            mechanisms=[args.mechanism],
+            latency=args.latency,
+            rate_limit=args.rate_limit,
+            rosters=rosters,
+        ).start()
+        host, port, domain = server.host, server.port, server.domain
+        ssl_context = make_client_context(server.certificate) if not args.no_tls else None
+    else:
+        host, port, domain = args.host, args.port, args.domain
+        ssl_context = ssl.create_default_context() if not args.no_tls else None
+
+    report = LoadTest(
+        host,
+        port,
+        domain=domain,
+        ssl_context=ssl_context,
+        sessions=args.sessions,
+        pattern=args.pattern,
+        rate=args.rate,
+        size=args.size,
+        presence_interval=args.presence_interval,
+        duration=args.duration,
+        connect_concurrency=args.connect_concurrency,
+        mechanism=args.mechanism,
+        password=args.password,
+    ).run()
+
+    if (server is not None):
+        report["server"] = server.stop()
+
+    if (args.json):
+        print(json.dumps(report, indent=4))
+        return 0 if report["connected"] else 1
+
+    def ms(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    print(f"sessions       {report['connected']}/{report['sessions']} connected, {report['failed']} failed")
+    print(f"connect        total {report['connect']['total']:.0f} ms, p50 {ms(report['connect']['p50'])} ms, p99 {ms(report['connect']['p99'])} ms")
+    print(f"messages       {report['sent']} sent, {report['received']} received, {report['lost']} lost in {report['duration']:.1f} s")
+    print(f"presences      {report['presences_sent']} sent, {report['presences_received']} received")
+    print(f"throughput     {report['throughput']:.0f} messages/s")
+    print(
+        f"latency        p50 {ms(report['latency']['p50'])} ms, p90 {ms(report['latency']['p90'])} ms, "
+        f"p99 {ms(report['latency']['p99'])} ms, max {ms(report['latency']['max'])} ms"
+    )
+    if (report["rss_per_session"] is not None):
+        print(f"memory         {report['rss'] / 2**20:.1f} MiB RSS, {report['rss_per_session'] / 1024:.1f} KiB per session")
+    if (report["cpu_per_stanza"] is not None):
+        print(f"cpu            {report['cpu']:.2f} s, {report['cpu_per_stanza']:.1f} us per stanza")
+
+    return 0 if report["connected"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import os
+import sys
+import types
+import tracemalloc
+
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+
+# Followed by deep_size, anything else is counted by its own size only
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+# Shared by everything, not owned by a structure
+_SKIPPED = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType, types.CodeType)
+
+
+def deep_size(obj: Any) -> int:
+    """
+    Estimates the memory of an object and of what it holds, in bytes.
+
+    Containers and the attributes of plain objects are followed, every object is counted once.
+    Classes, modules and functions are not counted, they are shared and not owned by the object.
+
+    Args:
+        obj (Any): The object.
+
+    Returns:
+        int: The size in bytes.
+    """
+
+    seen = set()
+    size = 0
+    stack = [obj]
+
+    while stack:
+        current = stack.pop()
+        if (id(current) in seen or isinstance(current, _SKIPPED)):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+
+        if (isinstance(current, dict)):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif (isinstance(current, _CONTAINERS)):
+            stack.extend(current)
+        elif (isinstance(current, (str, bytes, bytearray, int, float, bool))):
+            continue
+        else:
+            attributes = getattr(current, "__dict__", None)
+            if (attributes is not None):
+                stack.append(attributes)
+            for slot in getattr(type(current), "__slots__", ()):
+                value = getattr(current, slot, None)
+                if (value is not None):
+                    stack.append(value)
+
+    return size
+
+def measure(structure: Any) -> Dict[str, int]:
+    """
+    Measures an internal cache, queue or buffer for a memory report.
+
+    Args:
+        structure (Any): The structure, anything with a length.
+
+    Returns:
+        Dict[str, int]: The number of ``entries`` and the estimated ``bytes``.
+    """
+
+    return {"entries": len(structure), "bytes": deep_size(structure)}
+
+
+class XmppAllocationTracker:
+    """
+    Attributes the memory allocated through ``tracemalloc`` to the extensions and features of a client.
+    Enable it with ``client.enable_allocation_tracking()``, it is reported by ``client.memory_report()``.
+
+    An allocation belongs to the innermost frame of its traceback in the code of an extension or feature,
+    to ``client`` if it was only made by the rest of osmxmpp, and to ``other`` otherwise.
+    An extension laid out as a package, with its class in the ``base`` module or the package
+    itself, owns the whole package, otherwise only the module of its class.
+
+    Tracing allocations slows down the whole process, it is meant for investigations.
+
+    Attributes:
+        frames (int): The number of frames stored per allocation. (Default: 25)
+    """
+
+    def __init__(self, frames: int = 25):
+        self.frames = frames
+        self.__started = False
+
+        self.__client_path = os.path.dirname(os.path.abspath(__file__)) + os.sep
+        self.__owned_paths: List[Tuple[str, str]] = []
+        self.__owners: Dict[str, str | None] = {}
+
+    def start(self):
+        """
+        Starts tracing allocations, unless ``tracemalloc`` was already started.
+        """
+
+        if (not tracemalloc.is_tracing()):
+            tracemalloc.start(self.frames)
+            self.__started = True
+
+    def stop(self):
+        """
+        Stops tracing allocations, if it was started by the tracker.
+        """
+
+        if (self.__started):
+            tracemalloc.stop()
+            self.__started = False
+
+    def add_owner(self, owner_id: str, owner: object):
+        """
+        Attributes the code of an extension or feature to its ID.
+
+        Args:
+            owner_id (str): The ID.
+            owner (object): The extension or feature.
+        """
+
+        module = sys.modules.get(type(owner).__module__)
+        path = getattr(module, "__file__", None)
+        if (path is None):
+            return
+
+        path = os.path.abspath(path)
+        if (os.path.basename(path) in ("base.py", "__init__.py")):
+            path = os.path.dirname(path) + os.sep
+
+        self.__owned_paths.append((path, owner_id))
+        # The most specific path first
+        self.__owned_paths.sort(key=lambda entry: len(entry[0]), reverse=True)
+        self.__owners = {}
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """
+        Takes a snapshot of the traced allocations still alive.
+
+        Returns:
+            Dict[str, Dict[str, int]]: The ``bytes`` and ``blocks`` by owner ID, ``client`` and ``other``,
+            the biggest first. Empty if ``tracemalloc`` is not tracing.
+        """
+
+        if (not tracemalloc.is_tracing()):
+            return {}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+
+        report: Dict[str, Dict[str, int]] = {}
+        for statistic in snapshot.statistics("traceback"):
+            owner = self.__owner_of(statistic.traceback)
+            entry = report.setdefault(owner, {"bytes": 0, "blocks": 0})
+            entry["bytes"] += statistic.size
+            entry["blocks"] += statistic.count
+
+        return dict(sorted(report.items(), key=lambda item: item[1]["bytes"], reverse=True))
+
+    def __owner_of(self, traceback: tracemalloc.Traceback) -> str:
+        in_client = False
+        # Frames are stored from the most recent
+        for frame in traceback:
+            owner = self.__owner_of_file(frame.filename)
+            if (owner is not None):
+                return owner
+            if (frame.filename.startswith(self.__client_path)):
+                in_client = True
+        return "client" if in_client else "other"
+
+    def __owner_of_file(self, filename: str) -> str | None:
+        if (filename in self.__owners):
+            return self.__owners[filename]
+
+        owner = None
+        for path, owner_id in self.__owned_paths:
+            if (filename == path or (path.endswith(os.sep) and filename.startswith(path))):
+                owner = owner_id
+                break
+        self.__owners[filename] = owner
+        return owner
@@ -0,0 +1,208 @@
+import bisect
+import threading
+
+from typing import Dict, List, Tuple
+
+
+# Seconds, from the microseconds of a hook to the seconds of a slow IQ
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+RTT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict:
+        return {
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class XmppMetrics:
+    """
+    Counters and fixed-bucket histograms of an ``XmppClient``.
+    Enable them with ``client.enable_metrics()``, a disabled client only checks for ``None``.
+
+    Every metric has one label, the stanza kind or the hook and handler event.
+
+    Metrics:
+        xmpp_stanzas_received_total (counter): Stanzas received, by kind.
+        xmpp_stanzas_sent_total (counter): Stanzas sent, by kind.
+        xmpp_bytes_received_total (counter): Bytes read from the socket.
+        xmpp_bytes_sent_total (counter): Bytes written to the socket.
+        xmpp_stanza_sent_bytes (histogram): Size of the sent stanzas, by kind.
+        xmpp_read_bytes (histogram): Size of the socket reads.
+        xmpp_parse_seconds (histogram): Parse time of the received data.
+        xmpp_hook_seconds (histogram): Time in the hooks of an event.
+        xmpp_handler_seconds (histogram): Time in the handlers of an event.
+        xmpp_iq_rtt_seconds (histogram): Time from a sent get or set IQ to its result or error.
+
+    Example:
+        >>> metrics = client.enable_metrics()
+        >>> print(metrics.to_prometheus())
+    """
+
+    # Name: (type, help, buckets)
+    METRICS = {
+        "xmpp_stanzas_received_total": ("counter", "Stanzas received.", None),
+        "xmpp_stanzas_sent_total": ("counter", "Stanzas sent.", None),
+        "xmpp_bytes_received_total": ("counter", "Bytes read from the socket.", None),
+        "xmpp_bytes_sent_total": ("counter", "Bytes written to the socket.", None),
+        "xmpp_stanza_sent_bytes": ("histogram", "Size of the sent stanzas in bytes.", SIZE_BUCKETS),
+        "xmpp_read_bytes": ("histogram", "Size of the socket reads in bytes.", SIZE_BUCKETS),
+        "xmpp_parse_seconds": ("histogram", "Parse time of the received data.", TIME_BUCKETS),
+        "xmpp_hook_seconds": ("histogram", "Time in the hooks of an event.", TIME_BUCKETS),
+        "xmpp_handler_seconds": ("histogram", "Time in the handlers of an event.", TIME_BUCKETS),
+        "xmpp_iq_rtt_seconds": ("histogram", "Round trip time of get and set IQs.", RTT_BUCKETS),
+    }
+
+    LABELS = {
+        "xmpp_stanzas_received_total": "kind",
+        "xmpp_stanzas_sent_total": "kind",
+        "xmpp_stanza_sent_bytes": "kind",
+        "xmpp_hook_seconds": "event",
+        "xmpp_handler_seconds": "event",
+    }
+
+    # IQs never answered are dropped beyond this
+    MAX_PENDING_IQS = 1024
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__values: Dict[str, Dict[str, int | _Histogram]] = {name: {} for name in self.METRICS}
+        self.__pending_iqs: Dict[str, float] = {}
+
+    def inc(self, name: str, value: int = 1, label: str = ""):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The counter name.
+            value (int): The increment. (Default: 1)
+            label (str): The label value. (Default: "")
+        """
+
+        with self.__lock:
+            values = self.__values[name]
+            values[label] = values.get(label, 0) + value
+
+    def observe(self, name: str, value: float, label: str = ""):
+        """
+        Records a value in a histogram.
+
+        Args:
+            name (str): The histogram name.
+            value (float): The value.
+            label (str): The label value. (Default: "")
+        """
+
+        with self.__lock:
+            values = self.__values[name]
+            histogram = values.get(label)
+            if (histogram is None):
+                histogram = values[label] = _Histogram(self.METRICS[name][2])
+            histogram.observe(value)
+
+    def iq_sent(self, iq_id: str, now: float):
+        """
+        Remembers the send time of a get or set IQ.
+        """
+
+        with self.__lock:
+            if (len(self.__pending_iqs) >= self.MAX_PENDING_IQS):
+                self.__pending_iqs.pop(next(iter(self.__pending_iqs)))
+            self.__pending_iqs[iq_id] = now
+
+    def iq_received(self, iq_id: str, now: float):
+        """
+        Records the round trip time of a result or error IQ, if its request was sent.
+        """
+
+        with self.__lock:
+            sent = self.__pending_iqs.pop(iq_id, None)
+        if (sent is not None):
+            self.observe("xmpp_iq_rtt_seconds", now - sent)
+
+    def _memory_report(self) -> Dict:
+        return {"pending_iqs": self.__pending_iqs}
+
+    def reset(self):
+        """
+        Clears all the metrics.
+        """
+
+        with self.__lock:
+            self.__values = {name: {} for name in self.METRICS}
+            self.__pending_iqs = {}
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Gets the metrics as a dict.
+
+        Returns:
+            Dict[str, Dict]: The values of every metric by label value, histograms as
+            their ``buckets`` (upper bound: count, not cumulative), ``sum`` and ``count``.
+        """
+
+        with self.__lock:
+            snapshot = {}
+            for name, values in self.__values.items():
+                snapshot[name] = {
+                    label: value.snapshot() if isinstance(value, _Histogram) else value
+                    for label, value in values.items()
+                }
+            return snapshot
+
+    def to_prometheus(self) -> str:
+        """
+        Gets the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+
+        lines: List[str] = []
+        for name, values in self.snapshot().items():
+            kind, description, _ = self.METRICS[name]
+            label_name = self.LABELS.get(name)
+
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for label, value in sorted(values.items()):
+                labels = f'{label_name}="{_escape_label(label)}"' if label_name else ""
+
+                if (kind == "counter"):
+                    lines.append(f"{name}{_braces(labels)} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in value["buckets"].items():
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+                lines.append(f"{name}_sum{_braces(labels)} {value['sum']}")
+                lines.append(f"{name}_count{_braces(labels)} {value['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
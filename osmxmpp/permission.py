@@ -1,13 +1,13 @@
-from enum import Enum, auto
+from enum import IntFlag, auto
+from typing import Iterable
 
 
-class XmppPermission(Enum):
+class XmppPermission(IntFlag):
     """
     Permissions are used to control what actions Feature or Extension can perform.
+    They are flags, several permissions can be combined with ``|``.
     """
 
-    ALL = auto()
-
     SEND_XML = auto()
     RECV_XML = auto()
 
@@ -36,11 +36,38 @@ class XmppPermission(Enum):
     HOOK_ON_IQ = auto()
 
     HOOK_SEND_MESSAGE = auto()
+    HOOK_SEND_PRESENCE = auto()
 
     DISCONNECT = auto()
 
+    # Every permission above
+    ALL = (DISCONNECT << 1) - 1
+
+    @classmethod
+    def combine(cls, permissions: "XmppPermission | Iterable[XmppPermission]") -> "XmppPermission":
+        """
+        Combines permissions into one flag.
+
+        Args:
+            permissions (XmppPermission | Iterable[XmppPermission]): A permission, combined permissions or a list of them.
+
+        Returns:
+            XmppPermission: The combined permissions.
+
+        Example:
+            >>> XmppPermission.combine([XmppPermission.SEND_XML, XmppPermission.GET_JID])
+            <XmppPermission.SEND_XML|GET_JID>
+        """
+        if isinstance(permissions, cls):
+            return permissions
+
+        value = 0
+        for permission in permissions:
+            value |= cls(permission).value
+        return cls(value)
+
     def __str__(self):
-        return self.name
+        return self.name or "NONE"
     
     def __repr__(self):
         return f"<XmppPermission.{self.name}>"
\ No newline at end of file
@@ -0,0 +1,138 @@
+import time
+import functools
+
+from typing import Callable, Dict, List, Tuple
+
+
+class XmppProfiler:
+    """
+    CPU time accounting of the hooks and handlers registered by extensions and features.
+    Enable it with ``client.enable_profiling()``, read it with ``client.profile()``.
+
+    Every hook and handler registered through an ``XmppClientInterface`` is wrapped,
+    the wrapper only checks for a profiler when profiling is disabled.
+
+    With a sample rate below 1, only every ``1 / sample_rate``-th call of a hook or handler is
+    timed and the total time is extrapolated from the sampled calls. Calls and exceptions are always counted.
+    Counts are not locked, they can miss a few calls made at the same time from several threads.
+
+    Attributes:
+        sample_rate (float): The share of the calls timed, between 0 and 1. (Default: 1.0)
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        if (not 0 < sample_rate <= 1):
+            raise ValueError("The sample rate must be in (0, 1]")
+
+        self.sample_rate = sample_rate
+        self.__every = round(1 / sample_rate)
+
+        # (owner, kind, event): [calls, sampled calls, sampled seconds, exceptions]
+        self.__stats: Dict[Tuple[str, str, str], List] = {}
+
+    def call(self, key: Tuple[str, str, str], func: Callable, args: tuple, kwargs: dict):
+        """
+        Calls a hook or handler, accounting it to its owner.
+
+        Args:
+            key (Tuple[str, str, str]): The owner ID, ``hook`` or ``handler``, and the event.
+            func (Callable): The hook or handler.
+            args (tuple): The positional arguments.
+            kwargs (dict): The keyword arguments.
+        """
+
+        stats = self.__stats.get(key)
+        if (stats is None):
+            stats = self.__stats.setdefault(key, [0, 0, 0.0, 0])
+        stats[0] += 1
+
+        if (stats[0] % self.__every):
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                stats[3] += 1
+                raise
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            stats[3] += 1
+            raise
+        finally:
+            stats[1] += 1
+            stats[2] += time.perf_counter() - start
+
+    def reset(self):
+        """
+        Clears the accounted calls.
+        """
+
+        self.__stats = {}
+
+    def report(self) -> List[Dict]:
+        """
+        Gets the accounted time of every hook and handler, the most expensive first.
+
+        Returns:
+            List[Dict]: The ``owner``, ``kind``, ``event``, ``calls``, ``exceptions``,
+            the estimated ``time`` in seconds and ``time_per_call`` in microseconds.
+        """
+
+        report = []
+        for (owner, kind, event), (calls, sampled, seconds, exceptions) in list(self.__stats.items()):
+            estimated = seconds * calls / sampled if sampled else 0.0
+            report.append({
+                "owner": owner,
+                "kind": kind,
+                "event": event,
+                "calls": calls,
+                "exceptions": exceptions,
+                "time": estimated,
+                "time_per_call": estimated / calls * 1e6 if calls else 0.0,
+            })
+
+        report.sort(key=lambda entry: entry["time"], reverse=True)
+        return report
+
+
+def wrap(client, owner: str, kind: str, event: str, func: Callable) -> Callable:
+    """
+    Wraps a hook or handler to account it to its owner when the client is profiling.
+    The wrapped function is kept in ``__wrapped__``.
+
+    Args:
+        client (XmppClient): The client.
+        owner (str): The ID of the extension or feature.
+        kind (str): ``hook`` or ``handler``.
+        event (str): The event of the hook or handler.
+        func (Callable): The hook or handler.
+
+    Returns:
+        Callable: The wrapper.
+    """
+
+    key = (owner, kind, event)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = client.profiler
+        if (profiler is None):
+            return func(*args, **kwargs)
+        return profiler.call(key, func, args, kwargs)
+
+    return wrapper
+
+
+def format_report(report: List[Dict]) -> str:
+    """
+    Formats a ``client.profile()`` report as a table.
+    """
+
+    lines = [f"{'owner':>30} {'kind':>8} {'event':>14} {'calls':>9} {'errors':>7} {'time s':>10} {'us/call':>9}"]
+    for entry in report:
+        lines.append(
+            f"{entry['owner']:>30} {entry['kind']:>8} {entry['event']:>14} {entry['calls']:>9} "
+            f"{entry['exceptions']:>7} {entry['time']:>10.4f} {entry['time_per_call']:>9.1f}"
+        )
+    return "\n".join(lines)
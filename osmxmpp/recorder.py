@@ -0,0 +1,135 @@
+import time
+import datetime
+import itertools
+import threading
+
+from typing import List, TextIO, Tuple
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class XmppFlightRecorder:
+    """
+    Ring buffer of the last raw data received and sent by a client, for post-mortems.
+    Enable it with ``client.enable_flight_recorder()``.
+
+    Recording only stores the bytes as read or written and the time, in preallocated slots,
+    so it can stay enabled in production where debug logging costs too much. The records
+    are only decoded and formatted when they are dumped. Received data is recorded per read,
+    like it came from the socket, so a dump also shows malformed or partial data.
+
+    Attributes:
+        size (int): The number of reads and writes kept. (Default: 256)
+        output (str | TextIO): Where dumps are written, a path to append to or an open text file.
+            If none, dumps are logged as a warning. (Default: None)
+
+    Example:
+        >>> recorder = client.enable_flight_recorder(size=512, output="xmpp-postmortem.log")
+        >>> ...
+        >>> print(recorder.format())
+    """
+
+    RECEIVED = "<<"
+    SENT = ">>"
+
+    def __init__(self, size: int = 256, output: str | TextIO = None):
+        if (size < 1):
+            raise ValueError("The flight recorder size must be at least 1")
+
+        self.size = size
+        self.output = output
+
+        self.__times: List[float] = [0.0] * size
+        self.__directions: List[str | None] = [None] * size
+        self.__data: List[bytes | None] = [None] * size
+        # next() on a count is atomic, the reader and sending threads record at the same time
+        self.__counter = itertools.count()
+
+        self.__dump_lock = threading.Lock()
+
+    def received(self, data: bytes):
+        """
+        Records data read from the socket.
+        """
+
+        index = next(self.__counter) % self.size
+        self.__data[index] = data
+        self.__times[index] = time.time()
+        self.__directions[index] = self.RECEIVED
+
+    def sent(self, data: bytes):
+        """
+        Records data written to the socket.
+        """
+
+        index = next(self.__counter) % self.size
+        self.__data[index] = data
+        self.__times[index] = time.time()
+        self.__directions[index] = self.SENT
+
+    def records(self) -> List[Tuple[float, str, bytes]]:
+        """
+        Gets the kept records, the oldest first.
+
+        Returns:
+            List[Tuple[float, str, bytes]]: The time, ``<<`` for received or ``>>`` for sent data, and the data.
+        """
+
+        records = [
+            (self.__times[index], self.__directions[index], self.__data[index])
+            for index in range(self.size)
+            if self.__directions[index] is not None
+        ]
+        records.sort(key=lambda record: record[0])
+        return records
+
+    def clear(self):
+        """
+        Drops the kept records.
+        """
+
+        self.__directions = [None] * self.size
+        self.__data = [None] * self.size
+
+    def format(self, reason: str = None) -> str:
+        """
+        Formats the kept records, one line per read or write.
+
+        Args:
+            reason (str): Why the records are dumped, put in the header. (Default: None)
+
+        Returns:
+            str: The records.
+        """
+
+        records = self.records()
+        lines = [f"--- XMPP flight recorder: {len(records)} records{f', {reason}' if reason else ''} ---"]
+        for timestamp, direction, data in records:
+            moment = datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="microseconds")
+            lines.append(f"{moment} {direction} {data.decode('utf-8', errors='replace')}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, reason: str = None, output: str | TextIO = None):
+        """
+        Writes the kept records to the output.
+
+        Args:
+            reason (str): Why the records are dumped, put in the header. (Default: None)
+            output (str | TextIO): Where to write them instead of the recorder output. (Default: None)
+        """
+
+        text = self.format(reason)
+        output = output if output is not None else self.output
+
+        with self.__dump_lock:
+            if (output is None):
+                logger.warning(text)
+            elif (isinstance(output, str)):
+                with open(output, "a", encoding="utf-8") as file:
+                    file.write(text)
+            else:
+                output.write(text)
+                output.flush()
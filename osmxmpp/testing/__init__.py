@@ -0,0 +1,11 @@
+"""
+Local XMPP server for tests and benchmarks, requires ``cryptography``.
+"""
+
+from .server import FakeXmppServer
+from .certificate import make_self_signed_certificate
+
+__all__ = [
+    "FakeXmppServer",
+    "make_self_signed_certificate",
+]
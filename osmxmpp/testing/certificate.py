@@ -0,0 +1,91 @@
+import os
+import ssl
+import datetime
+import tempfile
+import ipaddress
+
+from typing import List, Tuple
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+
+def make_self_signed_certificate(names: List[str]) -> Tuple[bytes, bytes]:
+    """
+    Generates a self-signed certificate valid for the given host names and IP addresses.
+
+    Args:
+        names (List[str]): The names, the first one is also the common name.
+
+    Returns:
+        Tuple[bytes, bytes]: The PEM certificate and the PEM private key.
+    """
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, names[0])])
+
+    alt_names = []
+    for name in names:
+        try:
+            alt_names.append(x509.IPAddress(ipaddress.ip_address(name)))
+        except ValueError:
+            alt_names.append(x509.DNSName(name))
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+
+    certificate_pem = certificate.public_bytes(serialization.Encoding.PEM)
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    return certificate_pem, key_pem
+
+def make_server_context(certificate_pem: bytes, key_pem: bytes) -> ssl.SSLContext:
+    """
+    Creates the server SSL context of a certificate.
+    """
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+
+    # load_cert_chain only reads files
+    directory = tempfile.mkdtemp()
+    certificate_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    try:
+        with open(certificate_path, "wb") as file:
+            file.write(certificate_pem)
+        with open(key_path, "wb") as file:
+            file.write(key_pem)
+        context.load_cert_chain(certificate_path, key_path)
+    finally:
+        os.remove(certificate_path)
+        os.remove(key_path)
+        os.rmdir(directory)
+
+    return context
+
+def make_client_context(certificate_pem: bytes) -> ssl.SSLContext:
+    """
+    Creates a client SSL context trusting only the given certificate.
+    """
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = True
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(cadata=certificate_pem.decode("utf-8"))
+    return context
@@ -0,0 +1,1049 @@
+import ssl
+import time
+import uuid
+import heapq
+import base64
+import hashlib
+import hmac
+import os
+import socket
+import selectors
+import threading
+
+from typing import Callable, Dict, List, Tuple
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+
+from osmxml import *
+
+from .certificate import make_self_signed_certificate, make_server_context, make_client_context
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+NS_STREAMS = "urn:ietf:params:xml:ns:xmpp-streams"
+NS_STANZAS = "urn:ietf:params:xml:ns:xmpp-stanzas"
+NS_TLS = "urn:ietf:params:xml:ns:xmpp-tls"
+NS_SASL = "urn:ietf:params:xml:ns:xmpp-sasl"
+NS_BIND = "urn:ietf:params:xml:ns:xmpp-bind"
+NS_ROSTER = "jabber:iq:roster"
+NS_DISCO_INFO = "http://jabber.org/protocol/disco#info"
+NS_DISCO_ITEMS = "http://jabber.org/protocol/disco#items"
+NS_PING = "urn:xmpp:ping"
+NS_PUBSUB = "http://jabber.org/protocol/pubsub"
+NS_PUBSUB_EVENT = "http://jabber.org/protocol/pubsub#event"
+
+SCRAM_HASHES = {
+    "SCRAM-SHA-1": "sha1",
+    "SCRAM-SHA-256": "sha256",
+}
+
+DEFAULT_PASSWORD = "password"
+
+
+def _bare(jid: str) -> str:
+    return jid.split("/")[0]
+
+def _xmlns(element: XmlElement) -> str | None:
+    xmlns = element.get_attribute_by_name("xmlns")
+    return xmlns.value if xmlns else None
+
+def _attribute(element: XmlElement, name: str) -> str | None:
+    attribute = element.get_attribute_by_name(name)
+    return attribute.value if attribute else None
+
+def _set_attribute(element: XmlElement, name: str, value: str):
+    element.remove_attribute_by_name(name)
+    element.add_attribute(_XmlAttribute(name, value))
+
+def _elements(element: XmlElement) -> List[XmlElement]:
+    return [child for child in element.children if not isinstance(child, XmlTextElement)]
+
+def _text(element: XmlElement) -> str:
+    return "".join(child.text for child in element.children if isinstance(child, XmlTextElement))
+
+def _to_string(element: XmlElement) -> str:
+    # The client parser nests stanzas following a self-closing one into it
+    if (not element.has_children()):
+        attributes = "".join(f" {attribute.to_string()}" for attribute in element.attributes)
+        return f"<{element.name}{attributes}></{element.name}>"
+    return element.to_string()
+
+
+class _XmlAttribute(XmlAttribute):
+    # XmlAttribute does not escape its value
+    def to_string(self, raw=True) -> str:
+        return f"{self.name}={quoteattr(self.value)}"
+
+
+class _FakeSession:
+    """
+    Server side of one client connection. Only used from the server thread.
+    """
+
+    def __init__(self, server: "FakeXmppServer", sock: socket.socket):
+        self.server = server
+        self.sock = sock
+
+        self.tls: ssl.SSLObject | None = None
+        self.tls_incoming: ssl.MemoryBIO | None = None
+        self.tls_outgoing: ssl.MemoryBIO | None = None
+        self.handshaking = False
+
+        self.secure = False
+        self.username: str | None = None
+        self.jid: str | None = None
+        self.presence: XmlElement | None = None
+        self.scram: Dict | None = None
+
+        self.out = bytearray()
+        self.events = 0
+        self.closing = False
+        self.closed = False
+
+        self.tokens = float(server.rate_limit or 0)
+        self.refilled = time.monotonic()
+        self.paused = False
+
+        self.reset_parser()
+
+    # Stream parsing
+    def reset_parser(self):
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.__on_start
+        self.parser.EndElementHandler = self.__on_end
+        self.parser.CharacterDataHandler = self.__on_text
+        self.stack: List[XmlElement] = []
+        self.text: List[str] = []
+        self.stream_open = False
+
+    def __on_start(self, name: str, attributes: Dict[str, str]):
+        if (not self.stream_open):
+            self.stream_open = True
+            self.server._on_stream_start(self)
+            return
+
+        element = XmlElement(name, [_XmlAttribute(key, value) for key, value in attributes.items()])
+        if (self.stack):
+            self.__flush_text(False)
+            self.stack[-1].add_child(element)
+        self.stack.append(element)
+
+    def __on_end(self, name: str):
+        if (not self.stack):
+            self.server._on_stream_end(self)
+            return
+
+        self.__flush_text(not _elements(self.stack[-1]))
+        element = self.stack.pop()
+        if (not self.stack):
+            self.server._on_stanza(self, element)
+
+    def __on_text(self, data: str):
+        if (self.stack):
+            self.text.append(data)
+
+    def __flush_text(self, leaf: bool):
+        text = "".join(self.text)
+        self.text = []
+        # Whitespace between child elements is only formatting
+        if (text and (leaf or text.strip())):
+            self.stack[-1].add_child(XmlTextElement(text))
+
+    # Input
+    def on_events(self, events: int):
+        if (events & selectors.EVENT_WRITE):
+            self.flush()
+        if (events & selectors.EVENT_READ and not self.closed):
+            self.read()
+
+    def read(self):
+        size = 65536
+        if (self.server.rate_limit):
+            now = time.monotonic()
+            self.tokens = min(self.server.rate_limit, self.tokens + (now - self.refilled) * self.server.rate_limit)
+            self.refilled = now
+            if (self.tokens < 1):
+                # Throttled, read again once a chunk is allowed
+                self.paused = True
+                self.update_events()
+                self.server._schedule(min(4096, self.server.rate_limit) / self.server.rate_limit, self.resume)
+                return
+            size = min(size, int(self.tokens))
+
+        try:
+            data = self.sock.recv(size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+
+        if (not data):
+            self.close()
+            return
+
+        self.tokens -= len(data)
+        self.server._stats["bytes_in"] += len(data)
+
+        if (self.tls is None):
+            self.feed(data)
+            return
+
+        self.tls_incoming.write(data)
+        if (self.handshaking):
+            try:
+                self.tls.do_handshake()
+            except ssl.SSLWantReadError:
+                self.flush_tls()
+                return
+            except ssl.SSLError as e:
+                logger.debug(f"TLS handshake failed: {e}")
+                self.close()
+                return
+
+            self.handshaking = False
+            self.secure = True
+            self.reset_parser()
+
+        while (not self.closed):
+            try:
+                plain = self.tls.read(65536)
+            except ssl.SSLWantReadError:
+                break
+            except (ssl.SSLZeroReturnError, ssl.SSLError):
+                self.close()
+                return
+            self.feed(plain)
+
+        self.flush_tls()
+
+    def resume(self):
+        self.paused = False
+        self.update_events()
+
+    def feed(self, data: bytes):
+        try:
+            self.parser.Parse(data, False)
+        except expat.ExpatError as e:
+            logger.debug(f"Invalid XML from {self.jid or 'client'}: {e}")
+            self.stream_error("not-well-formed")
+
+    # Output
+    def send(self, data: str | XmlElement, after: Callable = None):
+        if (isinstance(data, XmlElement)):
+            data = _to_string(data)
+
+        self.server._stats["stanzas_out"] += 1
+        data = data.encode("utf-8")
+        if (self.server.latency > 0):
+            self.server._schedule(self.server.latency, lambda: self.write(data, after))
+        else:
+            self.write(data, after)
+
+    def write(self, data: bytes, after: Callable = None):
+        if (self.closed):
+            return
+
+        if (self.tls is not None and not self.handshaking):
+            self.tls.write(data)
+            self.flush_tls()
+        else:
+            self.out += data
+            self.flush()
+
+        if (after):
+            after()
+
+    def flush_tls(self):
+        data = self.tls_outgoing.read()
+        if (data):
+            self.out += data
+            self.flush()
+
+    def flush(self):
+        if (self.out and not self.closed):
+            try:
+                sent = self.sock.send(self.out)
+                del self.out[:sent]
+                self.server._stats["bytes_out"] += sent
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self.close()
+                return
+
+        if (not self.out and self.closing):
+            self.close()
+            return
+        self.update_events()
+
+    def update_events(self):
+        if (self.closed):
+            return
+
+        events = (0 if self.paused else selectors.EVENT_READ) | (selectors.EVENT_WRITE if self.out else 0)
+        if (events == self.events):
+            return
+
+        if (not self.events):
+            self.server._selector.register(self.sock, events, self.on_events)
+        elif (not events):
+            self.server._selector.unregister(self.sock)
+        else:
+            self.server._selector.modify(self.sock, events, self.on_events)
+        self.events = events
+
+    def start_tls(self):
+        self.tls_incoming = ssl.MemoryBIO()
+        self.tls_outgoing = ssl.MemoryBIO()
+        self.tls = self.server._ssl_context.wrap_bio(self.tls_incoming, self.tls_outgoing, server_side=True)
+        self.handshaking = True
+
+    def stream_error(self, condition: str):
+        self.send(f"<stream:error><{condition} xmlns='{NS_STREAMS}'/></stream:error></stream:stream>", self.end)
+
+    def end(self):
+        self.closing = True
+        self.flush()
+
+    def close(self):
+        if (self.closed):
+            return
+
+        if (self.events):
+            self.server._selector.unregister(self.sock)
+            self.events = 0
+        self.closed = True
+        self.sock.close()
+        self.server._on_close(self)
+
+
+class FakeXmppServer:
+    """
+    In-process XMPP server for tests and benchmarks, listening on loopback.
+
+    All connections are served by one background thread. The server speaks stream
+    negotiation with STARTTLS (a self-signed certificate), SASL PLAIN and SCRAM and
+    resource binding. It answers roster, disco, ping and PEP (pubsub) requests, and routes
+    messages, presences and IQs between the connected clients.
+    Messages to ``echo@<domain>`` are sent back to their sender.
+
+    Undirected presences and PEP notifications of a user go to the users having them
+    in their roster. Rosters are fixed at start, but can be changed by roster pushes.
+
+    Attributes:
+        domain (str): The XMPP domain of the server. (Default: "example.test")
+        host (str): The address to listen on. (Default: "127.0.0.1")
+        port (int): The port to listen on, 0 picks a free one. (Default: 0)
+        users (Dict[str, str]): Passwords by username. If none, any username is accepted with the password ``password``. (Default: None)
+        rosters (Dict[str, List[str]]): Contact bare JIDs by username. (Default: None)
+        tls (bool): Whether to offer STARTTLS. (Default: True)
+        tls_required (bool): Whether SASL is only offered after STARTTLS. (Default: True)
+        mechanisms (List[str]): The SASL mechanisms to offer, ``PLAIN``, ``SCRAM-SHA-1`` and ``SCRAM-SHA-256``. (Default: all)
+        scram_iterations (int): The SCRAM PBKDF2 iterations. (Default: 4096)
+        latency (float): The number of seconds every outgoing stanza is delayed by. (Default: 0)
+        rate_limit (int): The number of bytes per second read from every connection. If none, unlimited. (Default: None)
+        disco_features (List[str]): The features announced by disco#info. If none, the implemented ones. (Default: None)
+
+    Example:
+        >>> with FakeXmppServer(latency=0.01) as server:
+        ...     client = server.create_client("alice")
+        ...     threading.Thread(target=client.connect, daemon=True).start()
+    """
+
+    def __init__(
+                self,
+                domain: str = "example.test",
+                host: str = "127.0.0.1",
+                port: int = 0,
+                users: Dict[str, str] = None,
+                rosters: Dict[str, List[str]] = None,
+                tls: bool = True,
+                tls_required: bool = True,
+                mechanisms: List[str] = None,
+                scram_iterations: int = 4096,
+                latency: float = 0,
+                rate_limit: int = None,
+                disco_features: List[str] = None,
+            ):
+        self.domain = domain
+        self.host = host
+        self.port = port
+
+        self.users = users
+        self.tls = tls
+        self.tls_required = tls_required
+        self.mechanisms = list(mechanisms or ["SCRAM-SHA-256", "SCRAM-SHA-1", "PLAIN"])
+        self.scram_iterations = scram_iterations
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.disco_features = list(disco_features or [
+            NS_DISCO_INFO,
+            NS_DISCO_ITEMS,
+            NS_ROSTER,
+            NS_PING,
+            NS_PUBSUB,
+        ])
+
+        self.__rosters: Dict[str, Dict[str, None]] = {
+            username: dict.fromkeys(contacts) for username, contacts in (rosters or {}).items()
+        }
+
+        self.__certificate_pem: bytes | None = None
+        self._ssl_context: ssl.SSLContext | None = None
+
+        self._selector: selectors.BaseSelector | None = None
+        self.__listener: socket.socket | None = None
+        self.__wakeup: Tuple[socket.socket, socket.socket] | None = None
+        self.__thread: threading.Thread | None = None
+        self.__running = False
+
+        self.__timers: List[Tuple[float, int, Callable]] = []
+        self.__timer_sequence = 0
+
+        self.__connections: List[_FakeSession] = []
+        # bare JID -> resource -> session
+        self.__sessions: Dict[str, Dict[str, _FakeSession]] = {}
+        # (owner bare JID, node) -> item ID -> item
+        self.__pep: Dict[Tuple[str, str], Dict[str, XmlElement]] = {}
+        # (username, mechanism) -> (salt, stored key, server key)
+        self.__scram_keys: Dict[Tuple[str, str], Tuple[bytes, bytes, bytes]] = {}
+
+        self._stats = {
+            "connections": 0,
+            "sessions": 0,
+            "auth_failures": 0,
+            "stanzas_in": 0,
+            "stanzas_out": 0,
+            "routed": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """
+        Gets the address the server listens on, the port is known after ``start``.
+        """
+
+        return self.host, self.port
+
+    @property
+    def certificate(self) -> bytes | None:
+        """
+        Gets the PEM certificate of the server, known after ``start`` if TLS is offered.
+        """
+
+        return self.__certificate_pem
+
+    def start(self) -> "FakeXmppServer":
+        """
+        Starts listening and serving in a background thread.
+
+        Returns:
+            FakeXmppServer: The server (not changed).
+        """
+
+        if (self.tls):
+            self.__certificate_pem, key_pem = make_self_signed_certificate([self.domain, "localhost", self.host])
+            self._ssl_context = make_server_context(self.__certificate_pem, key_pem)
+
+        self.__listener = socket.create_server((self.host, self.port), backlog=1024)
+        self.__listener.setblocking(False)
+        self.port = self.__listener.getsockname()[1]
+
+        self.__wakeup = socket.socketpair()
+        self.__wakeup[0].setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.__listener, selectors.EVENT_READ, self.__accept)
+        self._selector.register(self.__wakeup[0], selectors.EVENT_READ, self.__drain_wakeup)
+
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="FakeXmppServer", daemon=True)
+        self.__thread.start()
+
+        logger.info(f"Fake XMPP server '{self.domain}' listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Closes all connections and stops the server thread.
+
+        Args:
+            timeout (float): The number of seconds to wait for the thread. (Default: 5.0)
+        """
+
+        if (not self.__running):
+            return
+
+        # The thread closes the sockets when it ends
+        self.__running = False
+        self.__wakeup[1].send(b"\0")
+        self.__thread.join(timeout)
+
+    def client_ssl_context(self) -> ssl.SSLContext:
+        """
+        Creates a client SSL context trusting the certificate of the server.
+
+        Returns:
+            ssl.SSLContext: The SSL context, for ``TlsFeature``.
+        """
+
+        return make_client_context(self.__certificate_pem)
+
+    def create_client(self, username: str, password: str = None, resource: str = "osmxmpp", mechanism: str = None):
+        """
+        Creates a client with the TLS, SASL and bind features set up for this server.
+
+        Args:
+            username (str): The username to log in with.
+            password (str): The password. If none, the one of the user. (Default: None)
+            resource (str): The resource to bind. (Default: "osmxmpp")
+            mechanism (str): The SASL mechanism. If none, the first offered one. (Default: None)
+
+        Returns:
+            XmppClient: The client, not connected yet.
+        """
+
+        from ..client import XmppClient
+        from ..features import TlsFeature, SaslFeature, BindFeature, PlainMechanism, ScramSha1Mechanism, ScramSha256Mechanism
+
+        mechanism_classes = {
+            "PLAIN": PlainMechanism,
+            "SCRAM-SHA-1": ScramSha1Mechanism,
+            "SCRAM-SHA-256": ScramSha256Mechanism,
+        }
+
+        if (password is None):
+            password = self.__password(username) or DEFAULT_PASSWORD
+
+        client = XmppClient(self.host, self.port, domain=self.domain)
+        if (self.tls):
+            client.connect_feature(TlsFeature(self.client_ssl_context()), TlsFeature.REQUIRED_PERMISSIONS)
+        client.connect_feature(
+            SaslFeature([mechanism_classes[mechanism or self.mechanisms[0]](username, password)]),
+            SaslFeature.REQUIRED_PERMISSIONS
+        )
+        client.connect_feature(BindFeature(resource), BindFeature.REQUIRED_PERMISSIONS)
+        return client
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Gets the server counters.
+
+        Returns:
+            Dict[str, int]: ``connections`` accepted, bound ``sessions`` now, ``auth_failures``,
+            ``stanzas_in``, ``stanzas_out``, ``routed`` stanzas, ``bytes_in`` and ``bytes_out``.
+        """
+
+        return self._stats.copy()
+
+    def __enter__(self) -> "FakeXmppServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Event loop
+    def __run(self):
+        try:
+            while (self.__running):
+                timeout = None
+                if (self.__timers):
+                    timeout = max(0, self.__timers[0][0] - time.monotonic())
+
+                for key, events in self._selector.select(timeout):
+                    key.data(events)
+
+                now = time.monotonic()
+                while (self.__timers and self.__timers[0][0] <= now):
+                    heapq.heappop(self.__timers)[2]()
+        except Exception as e:
+            logger.exception(f"Fake XMPP server failed: {e}")
+        finally:
+            self.__running = False
+            for session in list(self.__connections):
+                session.close()
+            self._selector.close()
+            self.__listener.close()
+            for sock in self.__wakeup:
+                sock.close()
+
+    def _schedule(self, delay: float, callback: Callable):
+        self.__timer_sequence += 1
+        heapq.heappush(self.__timers, (time.monotonic() + delay, self.__timer_sequence, callback))
+
+    def __accept(self, events: int):
+        while True:
+            try:
+                sock, _ = self.__listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _FakeSession(self, sock)
+            self.__connections.append(session)
+            self._stats["connections"] += 1
+            session.update_events()
+
+    def __drain_wakeup(self, events: int):
+        try:
+            self.__wakeup[0].recv(4096)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    # Stream
+    def _on_stream_start(self, session: _FakeSession):
+        header = (
+            f"<?xml version='1.0'?>"
+            f"<stream:stream xmlns='jabber:client' xmlns:stream='http://etherx.jabber.org/streams' "
+            f"id='{uuid.uuid4().hex}' from='{self.domain}' version='1.0'>"
+        )
+
+        features = ""
+        if (self.tls and not session.secure):
+            features += f"<starttls xmlns='{NS_TLS}'>{'<required/>' if self.tls_required else ''}</starttls>"
+
+        if (session.username is None and (session.secure or not self.tls or not self.tls_required)):
+            mechanisms = "".join(f"<mechanism>{mechanism}</mechanism>" for mechanism in self.mechanisms)
+            features += f"<mechanisms xmlns='{NS_SASL}'>{mechanisms}</mechanisms>"
+
+        if (session.username is not None):
+            features += f"<bind xmlns='{NS_BIND}'/>"
+
+        session.send(f"{header}<stream:features>{features}</stream:features>")
+
+    def _on_stream_end(self, session: _FakeSession):
+        session.send("</stream:stream>", session.end)
+
+    def _on_close(self, session: _FakeSession):
+        self.__connections.remove(session)
+        if (session.jid is None):
+            return
+
+        bare, resource = session.jid.split("/", 1)
+        resources = self.__sessions.get(bare, {})
+        if (resources.get(resource) is session):
+            del resources[resource]
+            if (not resources):
+                del self.__sessions[bare]
+            self._stats["sessions"] -= 1
+
+        if (session.presence is not None):
+            self.__broadcast_presence(session, XmlElement("presence", [XmlAttribute("type", "unavailable")]))
+
+    def _on_stanza(self, session: _FakeSession, element: XmlElement):
+        self._stats["stanzas_in"] += 1
+
+        if (session.jid is not None):
+            if (element.name == "message"):
+                return self.__on_message(session, element)
+            if (element.name == "presence"):
+                return self.__on_presence(session, element)
+            if (element.name == "iq"):
+                return self.__on_iq(session, element)
+            return session.stream_error("unsupported-stanza-type")
+
+        if (element.name == "starttls" and self.tls and not session.secure):
+            return session.send(f"<proceed xmlns='{NS_TLS}'></proceed>", session.start_tls)
+
+        if (session.username is None and (session.secure or not self.tls or not self.tls_required)):
+            if (element.name == "auth"):
+                return self.__on_auth(session, element)
+            if (element.name == "response" and session.scram is not None):
+                return self.__on_scram_response(session, element)
+            if (element.name == "abort"):
+                session.scram = None
+                return self.__sasl_failure(session, "aborted")
+
+        if (session.username is not None and element.name == "iq"):
+            bind = element.get_child_by_name("bind")
+            if (bind is not None and _attribute(element, "type") == "set"):
+                return self.__on_bind(session, element, bind)
+
+        session.stream_error("not-authorized")
+
+    # Authentication
+    def __password(self, username: str) -> str | None:
+        if (self.users is None):
+            return DEFAULT_PASSWORD
+        return self.users.get(username)
+
+    def __sasl_success(self, session: _FakeSession, username: str, data: str = None):
+        session.username = username
+        session.scram = None
+        # The client opens a new stream
+        session.reset_parser()
+        session.send(f"<success xmlns='{NS_SASL}'>{data or ''}</success>")
+
+    def __sasl_failure(self, session: _FakeSession, condition: str = "not-authorized"):
+        self._stats["auth_failures"] += 1
+        session.send(f"<failure xmlns='{NS_SASL}'><{condition}/></failure>")
+
+    def __on_auth(self, session: _FakeSession, element: XmlElement):
+        mechanism = _attribute(element, "mechanism")
+        if (mechanism not in self.mechanisms):
+            return self.__sasl_failure(session, "invalid-mechanism")
+
+        try:
+            data = base64.b64decode(_text(element).strip()).decode("utf-8")
+        except ValueError:
+            return self.__sasl_failure(session, "incorrect-encoding")
+
+        if (mechanism == "PLAIN"):
+            parts = data.split("\0")
+            if (len(parts) != 3):
+                return self.__sasl_failure(session, "malformed-request")
+
+            _, username, password = parts
+            expected = self.__password(username)
+            if (expected is None or not hmac.compare_digest(expected, password)):
+                return self.__sasl_failure(session)
+            return self.__sasl_success(session, username)
+
+        # SCRAM client-first: gs2 header, then n=username,r=nonce
+        if (not data.startswith("n,,")):
+            return self.__sasl_failure(session, "malformed-request")
+        client_first_bare = data[3:]
+        fields = dict(field.split("=", 1) for field in client_first_bare.split(",") if "=" in field)
+        username = fields.get("n", "").replace("=2C", ",").replace("=3D", "=")
+
+        keys = self.__scram_keys_of(username, mechanism)
+        if (keys is None or "r" not in fields):
+            return self.__sasl_failure(session)
+
+        nonce = fields["r"] + base64.b64encode(os.urandom(18)).decode()
+        server_first = f"r={nonce},s={base64.b64encode(keys[0]).decode()},i={self.scram_iterations}"
+        session.scram = {
+            "username": username,
+            "mechanism": mechanism,
+            "nonce": nonce,
+            "auth_message": f"{client_first_bare},{server_first}",
+        }
+        session.send(f"<challenge xmlns='{NS_SASL}'>{base64.b64encode(server_first.encode()).decode()}</challenge>")
+
+    def __on_scram_response(self, session: _FakeSession, element: XmlElement):
+        scram, session.scram = session.scram, None
+        hash_name = SCRAM_HASHES[scram["mechanism"]]
+        salt, stored_key, server_key = self.__scram_keys_of(scram["username"], scram["mechanism"])
+
+        try:
+            client_final = base64.b64decode(_text(element).strip()).decode("utf-8")
+            client_final_bare, proof = client_final.rsplit(",p=", 1)
+            proof = base64.b64decode(proof)
+        except ValueError:
+            return self.__sasl_failure(session, "malformed-request")
+
+        fields = dict(field.split("=", 1) for field in client_final_bare.split(","))
+        if (fields.get("r") != scram["nonce"]):
+            return self.__sasl_failure(session)
+
+        auth_message = f"{scram['auth_message']},{client_final_bare}".encode("utf-8")
+        client_signature = hmac.digest(stored_key, auth_message, hash_name)
+        client_key = bytes(a ^ b for a, b in zip(proof, client_signature))
+        if (not hmac.compare_digest(hashlib.new(hash_name, client_key).digest(), stored_key)):
+            return self.__sasl_failure(session)
+
+        server_signature = base64.b64encode(hmac.digest(server_key, auth_message, hash_name)).decode()
+        self.__sasl_success(session, scram["username"], base64.b64encode(f"v={server_signature}".encode()).decode())
+
+    def __scram_keys_of(self, username: str, mechanism: str) -> Tuple[bytes, bytes, bytes] | None:
+        keys = self.__scram_keys.get((username, mechanism))
+        if (keys is not None):
+            return keys
+
+        password = self.__password(username)
+        if (password is None):
+            return None
+
+        # Computed once per user, a login only costs the client PBKDF2
+        hash_name = SCRAM_HASHES[mechanism]
+        salt = hashlib.sha256(f"{self.domain}/{username}".encode("utf-8")).digest()[:16]
+        salted_password = hashlib.pbkdf2_hmac(hash_name, password.encode("utf-8"), salt, self.scram_iterations)
+        stored_key = hashlib.new(hash_name, hmac.digest(salted_password, b"Client Key", hash_name)).digest()
+        server_key = hmac.digest(salted_password, b"Server Key", hash_name)
+
+        keys = self.__scram_keys[(username, mechanism)] = (salt, stored_key, server_key)
+        return keys
+
+    def __on_bind(self, session: _FakeSession, element: XmlElement, bind: XmlElement):
+        bare = f"{session.username}@{self.domain}"
+        resources = self.__sessions.setdefault(bare, {})
+
+        resource_element = bind.get_child_by_name("resource")
+        resource = _text(resource_element).strip() if resource_element is not None else ""
+        if (not resource or resource in resources):
+            resource = f"{resource or 'osmxmpp'}-{uuid.uuid4().hex[:8]}"
+
+        session.jid = f"{bare}/{resource}"
+        resources[resource] = session
+        self._stats["sessions"] += 1
+
+        session.send(
+            f"<iq type='result' id={quoteattr(_attribute(element, 'id') or '')}>"
+            f"<bind xmlns='{NS_BIND}'><jid>{escape(session.jid)}</jid></bind>"
+            f"</iq>"
+        )
+
+    # Routing
+    def __deliver(self, jid: str, element: XmlElement) -> bool:
+        resources = self.__sessions.get(_bare(jid))
+        if (not resources):
+            return False
+
+        if ("/" in jid):
+            session = resources.get(jid.split("/", 1)[1])
+            if (session is not None):
+                session.send(element)
+                self._stats["routed"] += 1
+                return True
+            # Messages to a gone resource go to the other ones
+            if (element.name != "message"):
+                return False
+
+        for session in list(resources.values()):
+            session.send(element)
+            self._stats["routed"] += 1
+        return True
+
+    def __reply_error(self, session: _FakeSession, element: XmlElement, condition: str = "service-unavailable", error_type: str = "cancel"):
+        if (_attribute(element, "type") in ("error", "result")):
+            return
+
+        attributes = f"type='error' to={quoteattr(session.jid)}"
+        if (_attribute(element, "to")):
+            attributes += f" from={quoteattr(_attribute(element, 'to'))}"
+        if (_attribute(element, "id")):
+            attributes += f" id={quoteattr(_attribute(element, 'id'))}"
+
+        session.send(
+            f"<{element.name} {attributes}>"
+            f"<error type='{error_type}'><{condition} xmlns='{NS_STANZAS}'/></error>"
+            f"</{element.name}>"
+        )
+
+    def __on_message(self, session: _FakeSession, element: XmlElement):
+        to = _attribute(element, "to")
+        if (not to or to == self.domain):
+            return
+
+        if (_bare(to) == f"echo@{self.domain}"):
+            _set_attribute(element, "from", to)
+            _set_attribute(element, "to", session.jid)
+            session.send(element)
+            return
+
+        _set_attribute(element, "from", session.jid)
+        if (not self.__deliver(to, element)):
+            self.__reply_error(session, element)
+
+    def __on_presence(self, session: _FakeSession, element: XmlElement):
+        _set_attribute(element, "from", session.jid)
+
+        to = _attribute(element, "to")
+        if (to):
+            self.__deliver(to, element)
+            return
+
+        initial = session.presence is None
+        if (_attribute(element, "type") == "unavailable"):
+            session.presence = None
+        else:
+            session.presence = element
+
+        self.__broadcast_presence(session, element)
+
+        # The current presences of the contacts, as a server would answer a probe
+        if (initial and session.presence is not None):
+            for contact in self.__rosters.get(session.username, {}):
+                for contact_session in list(self.__sessions.get(contact, {}).values()):
+                    if (contact_session.presence is not None and contact_session is not session):
+                        session.send(contact_session.presence)
+
+    def __broadcast_presence(self, session: _FakeSession, element: XmlElement):
+        _set_attribute(element, "from", session.jid)
+        bare = _bare(session.jid)
+        for jid in self.__watchers(bare):
+            for watcher in list(self.__sessions.get(jid, {}).values()):
+                if (watcher is not session):
+                    watcher.send(element)
+                    self._stats["routed"] += 1
+
+    def __watchers(self, bare: str) -> List[str]:
+        # The users having the JID in their roster, and the user itself
+        watchers = [bare]
+        for username, contacts in self.__rosters.items():
+            if (bare in contacts):
+                watchers.append(f"{username}@{self.domain}")
+        return watchers
+
+    # IQ
+    def __on_iq(self, session: _FakeSession, element: XmlElement):
+        to = _attribute(element, "to")
+        iq_type = _attribute(element, "type")
+        bare = _bare(session.jid)
+
+        if (to and "/" in to):
+            _set_attribute(element, "from", session.jid)
+            if (not self.__deliver(to, element)):
+                self.__reply_error(session, element)
+            return
+
+        if (iq_type in ("result", "error")):
+            return
+
+        payload = _elements(element)
+        if (not payload):
+            return self.__reply_error(session, element, "bad-request", "modify")
+
+        payload = payload[0]
+        xmlns = _xmlns(payload)
+        owner = to or bare
+
+        if (xmlns == NS_PING):
+            return self.__result(session, element)
+
+        if (xmlns == NS_DISCO_INFO):
+            return self.__on_disco_info(session, element, owner)
+
+        if (xmlns == NS_DISCO_ITEMS):
+            return self.__on_disco_items(session, element, payload, owner)
+
+        if (xmlns == NS_ROSTER and owner == bare):
+            return self.__on_roster(session, element, payload)
+
+        if (xmlns == NS_PUBSUB and owner != self.domain):
+            return self.__on_pubsub(session, element, payload, owner)
+
+        self.__reply_error(session, element)
+
+    def __result(self, session: _FakeSession, element: XmlElement, content: str = ""):
+        attributes = f"type='result' to={quoteattr(session.jid)}"
+        if (_attribute(element, "to")):
+            attributes += f" from={quoteattr(_attribute(element, 'to'))}"
+        if (_attribute(element, "id")):
+            attributes += f" id={quoteattr(_attribute(element, 'id'))}"
+        session.send(f"<iq {attributes}>{content}</iq>")
+
+    def __on_disco_info(self, session: _FakeSession, element: XmlElement, owner: str):
+        if (owner == self.domain):
+            identity = "<identity category='server' type='im' name='osmxmpp fake server'/>"
+            features = "".join(f"<feature var={quoteattr(feature)}/>" for feature in self.disco_features)
+        else:
+            identity = "<identity category='account' type='registered'/><identity category='pubsub' type='pep'/>"
+            features = f"<feature var='{NS_DISCO_INFO}'/><feature var='{NS_PUBSUB}'/>"
+
+        self.__result(session, element, f"<query xmlns='{NS_DISCO_INFO}'>{identity}{features}</query>")
+
+    def __on_disco_items(self, session: _FakeSession, element: XmlElement, query: XmlElement, owner: str):
+        node = _attribute(query, "node")
+        if (node is None):
+            return self.__result(session, element, f"<query xmlns='{NS_DISCO_ITEMS}'></query>")
+
+        items = self.__pep.get((owner, node))
+        if (items is None):
+            return self.__reply_error(session, element, "item-not-found")
+
+        content = "".join(f"<item jid={quoteattr(owner)} name={quoteattr(item_id)}/>" for item_id in items)
+        self.__result(session, element, f"<query xmlns='{NS_DISCO_ITEMS}' node={quoteattr(node)}>{content}</query>")
+
+    def __on_roster(self, session: _FakeSession, element: XmlElement, query: XmlElement):
+        roster = self.__rosters.setdefault(session.username, {})
+
+        if (_attribute(element, "type") == "get"):
+            content = "".join(f"<item jid={quoteattr(jid)} subscription='both'/>" for jid in roster)
+            return self.__result(session, element, f"<query xmlns='{NS_ROSTER}'>{content}</query>")
+
+        items = [item for item in _elements(query) if item.name == "item" and _attribute(item, "jid")]
+        for item in items:
+            if (_attribute(item, "subscription") == "remove"):
+                roster.pop(_attribute(item, "jid"), None)
+            else:
+                roster[_attribute(item, "jid")] = None
+        self.__result(session, element)
+
+        # Roster push to every resource
+        push = "".join(_to_string(item) for item in items)
+        for resource_session in list(self.__sessions.get(_bare(session.jid), {}).values()):
+            resource_session.send(
+                f"<iq type='set' id='{uuid.uuid4().hex}' to={quoteattr(resource_session.jid)}>"
+                f"<query xmlns='{NS_ROSTER}'>{push}</query>"
+                f"</iq>"
+            )
+
+    def __on_pubsub(self, session: _FakeSession, element: XmlElement, pubsub: XmlElement, owner: str):
+        iq_type = _attribute(element, "type")
+        for action in _elements(pubsub):
+            node = _attribute(action, "node")
+
+            if (action.name == "items" and iq_type == "get"):
+                stored = self.__pep.get((owner, node))
+                if (stored is None):
+                    return self.__reply_error(session, element, "item-not-found")
+
+                wanted = [_attribute(item, "id") for item in _elements(action) if item.name == "item"]
+                items = [stored[item_id] for item_id in wanted if item_id in stored] if wanted else list(stored.values())
+
+                max_items = _attribute(action, "max_items")
+                if (max_items and max_items.isdigit()):
+                    items = items[-int(max_items):]
+
+                content = "".join(_to_string(item) for item in items)
+                return self.__result(
+                    session,
+                    element,
+                    f"<pubsub xmlns='{NS_PUBSUB}'><items node={quoteattr(node)}>{content}</items></pubsub>"
+                )
+
+            if (owner != _bare(session.jid) or iq_type != "set"):
+                continue
+
+            if (action.name == "create"):
+                self.__pep.setdefault((owner, node), {})
+                return self.__result(session, element)
+
+            if (action.name == "publish"):
+                item = action.get_child_by_name("item")
+                if (item is None):
+                    return self.__reply_error(session, element, "bad-request", "modify")
+
+                item_id = _attribute(item, "id")
+                if (item_id is None):
+                    item_id = uuid.uuid4().hex
+                    _set_attribute(item, "id", item_id)
+
+                items = self.__pep.setdefault((owner, node), {})
+                items.pop(item_id, None)
+                items[item_id] = item
+
+                self.__result(
+                    session,
+                    element,
+                    f"<pubsub xmlns='{NS_PUBSUB}'><publish node={quoteattr(node)}><item id={quoteattr(item_id)}/></publish></pubsub>"
+                )
+                self.__notify(owner, node, item)
+                return
+
+            if (action.name == "retract"):
+                items = self.__pep.get((owner, node), {})
+                for item in _elements(action):
+                    items.pop(_attribute(item, "id"), None)
+                return self.__result(session, element)
+
+        self.__reply_error(session, element, "feature-not-implemented")
+
+    def __notify(self, owner: str, node: str, item: XmlElement):
+        event = (
+            f"<event xmlns='{NS_PUBSUB_EVENT}'><items node={quoteattr(node)}>{_to_string(item)}</items></event>"
+        )
+        for jid in self.__watchers(owner):
+            for session in list(self.__sessions.get(jid, {}).values()):
+                session.send(
+                    f"<message from={quoteattr(owner)} to={quoteattr(session.jid)} type='headline' id='{uuid.uuid4().hex}'>{event}</message>"
+                )
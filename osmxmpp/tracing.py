@@ -0,0 +1,332 @@
+import json
+import time
+import random
+import threading
+import contextvars
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, TextIO
+
+
+class XmppSpan:
+    """
+    A timed operation of a trace: a sent stanza, an IQ exchange, a hook or a socket write.
+
+    Attributes:
+        name (str): The name of the span.
+        trace_id (int): The 128-bit ID of the trace.
+        span_id (int): The 64-bit ID of the span.
+        parent_id (int): The ID of the parent span, None for a root span.
+        start (int): The start time in Unix nanoseconds.
+        end (int): The end time in Unix nanoseconds, None while running.
+        attributes (Dict[str, Any]): The attributes.
+        error (str): The error the span ended with, None if it succeeded.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "error", "_tracer")
+
+    def __init__(self, tracer: "XmppTracer", name: str, trace_id: int, parent_id: int | None, attributes: Dict[str, Any] | None):
+        self._tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key: str, value: Any):
+        """
+        Sets an attribute of the span.
+        """
+
+        self.attributes[key] = value
+
+    def finish(self, error: str | None = None):
+        """
+        Ends the span and exports it, once.
+
+        Args:
+            error (str): The error the span ended with. (Default: None)
+        """
+
+        if (self.end is not None):
+            return
+        self.end = time.time_ns()
+        if (error is not None):
+            self.error = error
+        self._tracer._export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Gets the span as a JSON-serializable dict, with hexadecimal IDs.
+        """
+
+        return {
+            "name": self.name,
+            "trace_id": f"{self.trace_id:032x}",
+            "span_id": f"{self.span_id:016x}",
+            "parent_id": f"{self.parent_id:016x}" if self.parent_id is not None else None,
+            "start": self.start,
+            "end": self.end,
+            "duration_us": (self.end - self.start) / 1000 if self.end is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return f"<XmppSpan {self.name} {self.span_id:016x}>"
+
+
+class XmppSpanExporter(ABC):
+    """
+    Receives the spans of an ``XmppTracer``.
+    """
+
+    def on_start(self, span: XmppSpan) -> None:
+        """
+        Called when a sampled span starts.
+        """
+        ...
+
+    @abstractmethod
+    def export(self, span: XmppSpan) -> None:
+        """
+        Called when a sampled span ends.
+        """
+        ...
+
+    def shutdown(self) -> None:
+        """
+        Flushes and releases the exporter.
+        """
+        ...
+
+
+class JsonLinesExporter(XmppSpanExporter):
+    """
+    Writes every ended span as a line of JSON.
+
+    Attributes:
+        file (str | TextIO): The path of the file to append to, or an open text file.
+    """
+
+    def __init__(self, file: str | TextIO):
+        self.__owned = isinstance(file, str)
+        self.__file = open(file, "a", encoding="utf-8") if self.__owned else file
+        self.__lock = threading.Lock()
+
+    def export(self, span: XmppSpan):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self.__lock:
+            self.__file.write(line)
+
+    def shutdown(self):
+        with self.__lock:
+            self.__file.flush()
+            if (self.__owned):
+                self.__file.close()
+
+
+class MemoryExporter(XmppSpanExporter):
+    """
+    Keeps the ended spans in a list, for tests and interactive use.
+
+    Attributes:
+        spans (List[XmppSpan]): The ended spans, in end order.
+    """
+
+    def __init__(self):
+        self.spans: List[XmppSpan] = []
+
+    def export(self, span: XmppSpan):
+        self.spans.append(span)
+
+
+class OpenTelemetryExporter(XmppSpanExporter):
+    """
+    Mirrors the spans to OpenTelemetry, keeping their parents and times.
+    Needs the ``opentelemetry-api`` package, and an SDK to record anything.
+
+    Attributes:
+        tracer_provider (TracerProvider): The OpenTelemetry tracer provider. If none, the global one. (Default: None)
+    """
+
+    # Spans can start after their parent ended, the contexts of ended spans are kept for a while
+    MAX_ENDED = 4096
+
+    def __init__(self, tracer_provider=None):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetryExporter needs the opentelemetry-api package") from e
+
+        self.__trace = trace
+        self.__tracer = trace.get_tracer("osmxmpp", tracer_provider=tracer_provider)
+        self.__running: Dict[int, Any] = {}
+        self.__ended: OrderedDict[int, Any] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def on_start(self, span: XmppSpan):
+        with self.__lock:
+            parent = self.__running.get(span.parent_id)
+            if (parent is None):
+                parent = self.__ended.get(span.parent_id)
+
+        context = self.__trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.__tracer.start_span(span.name, context=context, start_time=span.start)
+
+        with self.__lock:
+            self.__running[span.span_id] = otel_span
+
+    def export(self, span: XmppSpan):
+        with self.__lock:
+            otel_span = self.__running.pop(span.span_id, None)
+            if (otel_span is None):
+                return
+            self.__ended[span.span_id] = self.__trace.NonRecordingSpan(otel_span.get_span_context())
+            if (len(self.__ended) > self.MAX_ENDED):
+                self.__ended.popitem(last=False)
+
+        otel_span.set_attributes({key: value if isinstance(value, (str, bool, int, float)) else str(value) for key, value in span.attributes.items()})
+        if (span.error is not None):
+            otel_span.set_status(self.__trace.Status(self.__trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=span.end)
+
+
+class _Unsampled:
+    # The current span of a trace that was not sampled, its children are not recorded either
+    __slots__ = ()
+
+_UNSAMPLED = _Unsampled()
+
+
+class _SpanScope:
+    __slots__ = ("tracer", "span", "token", "finish")
+
+    def __init__(self, tracer: "XmppTracer", span: XmppSpan | _Unsampled, finish: bool):
+        self.tracer = tracer
+        self.span = span
+        self.finish = finish
+
+    def __enter__(self) -> XmppSpan | None:
+        self.token = self.tracer._current.set(self.span)
+        return self.span if self.span is not _UNSAMPLED else None
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.tracer._current.reset(self.token)
+        if (self.finish and self.span is not _UNSAMPLED):
+            self.span.finish(f"{exc_type.__name__}: {exc}" if exc_type is not None else None)
+        return False
+
+
+class XmppTracer:
+    """
+    Tracer of an ``XmppClient``. Enable it with ``client.enable_tracing(exporter)``.
+
+    The client opens a span for every sent stanza, IQ exchange and received stanza,
+    with child spans for every hook. The current span is kept per thread, so spans
+    opened by hooks and extensions become children of the stanza being processed.
+
+    The sampling is decided once per trace, at its root span.
+
+    Attributes:
+        exporter (XmppSpanExporter): The exporter of the ended spans.
+        sample_rate (float): The share of the traces recorded, between 0 and 1. (Default: 1.0)
+
+    Example:
+        >>> tracer = client.enable_tracing(JsonLinesExporter("trace.jsonl"), sample_rate=0.1)
+        >>> with tracer.span("startup"):
+        ...     client.send_message("john@jabber.org", "Hello, John!")
+    """
+
+    def __init__(self, exporter: XmppSpanExporter, sample_rate: float = 1.0):
+        if (not 0 <= sample_rate <= 1):
+            raise ValueError("The sample rate must be in [0, 1]")
+
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._current: contextvars.ContextVar = contextvars.ContextVar(f"osmxmpp_span_{id(self)}", default=None)
+
+    def current(self) -> XmppSpan | None:
+        """
+        Gets the current span of the thread, None outside of a sampled trace.
+        """
+
+        span = self._current.get()
+        return span if span is not _UNSAMPLED else None
+
+    def in_trace(self) -> bool:
+        """
+        Checks whether the thread is inside a trace, sampled or not.
+        """
+
+        return self._current.get() is not None
+
+    def start_span(self, name: str, attributes: Dict[str, Any] = None, parent: XmppSpan | None = None) -> XmppSpan | None:
+        """
+        Starts a span without making it current, a child of the given or the current span.
+        The caller ends it with ``finish()``.
+
+        Args:
+            name (str): The name of the span.
+            attributes (Dict[str, Any]): The attributes. (Default: None)
+            parent (XmppSpan): The parent span. If none, the current span. (Default: None)
+
+        Returns:
+            XmppSpan | None: The span, None if its trace is not sampled.
+        """
+
+        span = self.__start(name, attributes, parent)
+        return span if span is not _UNSAMPLED else None
+
+    def span(self, name: str, attributes: Dict[str, Any] = None, parent: XmppSpan | None = None) -> _SpanScope:
+        """
+        Starts a span as the current one of the thread, ended at the end of the ``with`` block.
+
+        Args:
+            name (str): The name of the span.
+            attributes (Dict[str, Any]): The attributes. (Default: None)
+            parent (XmppSpan): The parent span. If none, the current span. (Default: None)
+
+        Returns:
+            The context manager, giving the span or None if its trace is not sampled.
+        """
+
+        return _SpanScope(self, self.__start(name, attributes, parent), finish=True)
+
+    def activate(self, span: XmppSpan) -> _SpanScope:
+        """
+        Makes a started span the current one of the thread in a ``with`` block, without ending it.
+        """
+
+        return _SpanScope(self, span if span is not None else _UNSAMPLED, finish=False)
+
+    def __start(self, name: str, attributes: Dict[str, Any] | None, parent: XmppSpan | None) -> XmppSpan | _Unsampled:
+        if (parent is None):
+            parent = self._current.get()
+
+        if (parent is _UNSAMPLED):
+            return _UNSAMPLED
+
+        if (parent is None):
+            if (self.sample_rate < 1 and random.random() >= self.sample_rate):
+                return _UNSAMPLED
+            span = XmppSpan(self, name, random.getrandbits(128), None, attributes)
+        else:
+            span = XmppSpan(self, name, parent.trace_id, parent.span_id, attributes)
+
+        self.exporter.on_start(span)
+        return span
+
+    def _export(self, span: XmppSpan):
+        self.exporter.export(span)
+
+    def shutdown(self):
+        """
+        Shuts the exporter down.
+        """
+
+        self.exporter.shutdown()
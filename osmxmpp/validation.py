@@ -3,7 +3,6 @@ import re
 
 osmxmpp_id_regex = re.compile(r'^[A-Za-z0-9]+(?:\.[A-Za-z0-9]+)+$')
 
-xmpp_jid_regex = re.compile(r'^(?:([a-zA-Z0-9._%+-]+)@)?([a-zA-Z0-9.-]+\.[a-zA-Z]{2,})(?:/(.+))?$')
 xmpp_resource_regex = re.compile(r'^[^\s/]+$')
 
 
@@ -11,6 +10,10 @@ class ValidationException(Exception):
     pass
 
 
+# Imported after ValidationException, which the jid module raises
+from .jid import Jid
+
+
 class XmppValidation:
     """
     OsmXmpp validation methods
@@ -37,7 +40,8 @@ class XmppValidation:
     @staticmethod
     def validate_jid(jid:str):
         """
-        Validates the JID.
+        Validates the JID, as in RFC 7622.
+        A JID already validated is found in the cache of ``Jid`` and not parsed again.
 
         Args:
             jid (str): The JID to validate.
@@ -46,11 +50,7 @@ class XmppValidation:
             ValidationException: If the JID is invalid.
         """
 
-        if type(jid) != str:
-            raise ValidationException(f"JID '{jid}' is not a string")
-        
-        if not xmpp_jid_regex.match(jid):
-            raise ValidationException(f"Invalid JID '{jid}'")
+        Jid(jid)
 
     @staticmethod
     def validate_resource(resource:str):
@@ -0,0 +1,41 @@
+import re
+import random
+import unittest
+
+from osmxmpp.capture import XmlTextRedactor
+from osmxmpp.bench.cases import make_stream
+
+
+# The generated stanzas have no > in attribute values, the text is between > and <
+TEXT = re.compile(rb">[^<]*<")
+
+
+class XmlTextRedactorTest(unittest.TestCase):
+    def test_random_reads(self):
+        data = "".join(make_stream(400)).encode("utf-8")
+
+        rng = random.Random(0)
+        redactor = XmlTextRedactor()
+        redacted = b""
+        position = 0
+        while position < len(data):
+            piece = data[position:position + rng.randint(1, 64)]
+            position += len(piece)
+            redacted += redactor(piece)
+
+        self.assertEqual(len(redacted), len(data))
+        self.assertEqual(TEXT.sub(b"><", redacted), TEXT.sub(b"><", data))
+        self.assertIsNone(re.search(rb">[^<]*[^x\s<][^<]*<", redacted))
+
+    def test_attribute_value_with_end_of_tag(self):
+        redactor = XmlTextRedactor()
+        pieces = [b'<message type="chat" note="a>b"><body>se', b"cret &am", b"p; caf\xc3", b"\xa9</body></message>"]
+
+        self.assertEqual(
+            b"".join(redactor(piece) for piece in pieces),
+            b'<message type="chat" note="a>b"><body>xxxxxx xxxxx xxxxx</body></message>'
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import random
+import itertools
+import unittest
+
+from osmxmpp.framing import XmppStreamFramer
+from osmxmpp.bench.cases import make_stream
+
+
+class XmppStreamFramerTest(unittest.TestCase):
+    def test_random_reads(self):
+        stream = make_stream(400)
+        data = "".join(stream).encode("utf-8")
+        ends = set(itertools.accumulate(len(stanza.encode("utf-8")) for stanza in stream))
+
+        rng = random.Random(0)
+        framer = XmppStreamFramer()
+        chunks = []
+        position = 0
+        while position < len(data):
+            piece = data[position:position + rng.randint(1, 64)]
+            position += len(piece)
+            chunks += framer.feed(piece)
+
+            # Once the last byte of a stanza is fed, nothing complete is kept back
+            if (position in ends):
+                self.assertEqual(len(framer), 0)
+
+        self.assertEqual(b"".join(chunks), data)
+
+    def test_split_end_tag(self):
+        framer = XmppStreamFramer()
+
+        self.assertEqual(framer.feed(b"<message><body>x</body></"), [])
+        self.assertEqual(framer.feed(b"messa"), [])
+        self.assertEqual(framer.feed(b"ge>"), [b"<message><body>x</body></message>"])
+        self.assertEqual(len(framer), 0)
+
+    def test_split_character(self):
+        framer = XmppStreamFramer()
+
+        self.assertEqual(framer.feed(b"<message><body>caf\xc3"), [])
+        self.assertEqual(framer.feed(b"\xa9</body></message>"), ["<message><body>café</body></message>".encode("utf-8")])
+
+
+if __name__ == "__main__":
+    unittest.main()
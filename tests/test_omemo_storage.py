@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import base64
+import random
+import signal
+import tempfile
+import unittest
+import subprocess
+
+from osmxmpp.extensions.omemo.storage import SqliteOmemoStorage
+
+
+JID = "bob@example.org"
+
+DEVICES = 20
+
+
+def step_secret(step: int) -> str:
+    return base64.b64encode(step.to_bytes(32, "big")).decode("utf-8")
+
+def secret_step(secret: str) -> int:
+    return int.from_bytes(base64.b64decode(secret), "big")
+
+
+def crash_child(path: str, interval: float):
+    """
+    Steps the ratchets of several devices and flushes periodically, printing the
+    last flushed step, until it is killed.
+    """
+
+    storage = SqliteOmemoStorage(path, commit_interval=interval)
+    for device in range(DEVICES):
+        storage.add_device(JID, device)
+        storage.add_session(JID, device, step_secret(0), step_secret(0), "", "")
+    storage.flush()
+
+    step = 0
+    while True:
+        step += 1
+        for device in range(DEVICES):
+            storage.update_send_secret(JID, device, step_secret(step))
+            storage.set_send_nonce(JID, device, os.urandom(12))
+
+        if (step % 50 == 0):
+            storage.flush()
+            print(step, flush=True)
+
+
+class SqliteOmemoStorageCrashTest(unittest.TestCase):
+    RUNS = 3
+    INTERVAL = 1.0
+
+    def test_killed_writer(self):
+        # The database must open after a kill, and every session must hold the state
+        # of one committed step, not older than the last flush the child reported
+        for run in range(self.RUNS):
+            path = os.path.join(tempfile.mkdtemp(), "omemo.db")
+            child = subprocess.Popen(
+                [sys.executable, "-m", "tests.test_omemo_storage", path, str(self.INTERVAL)],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            time.sleep(random.Random(run).uniform(0.5, 2.0))
+            child.send_signal(signal.SIGKILL)
+            flushed = [int(line) for line in child.communicate()[0].split()]
+            last_flush = flushed[-1] if flushed else 0
+
+            storage = SqliteOmemoStorage(path)
+            try:
+                devices = storage.get_device_list(JID)
+                self.assertEqual(len(devices), DEVICES)
+
+                for device in devices:
+                    session = storage.get_session(JID, device)
+                    step = secret_step(session.send_secret_key)
+                    self.assertGreaterEqual(step, last_flush)
+                    # The first session has no nonce yet
+                    if (step):
+                        self.assertEqual(len(base64.b64decode(session.send_nonce)), 12)
+            finally:
+                storage.close()
+
+
+if __name__ == "__main__":
+    crash_child(sys.argv[1], float(sys.argv[2]))